@@ -0,0 +1,157 @@
+"""
+Analysis result cache for InventoScan
+Content-addressed: keyed by the SHA-256 of the image bytes plus the prompt/model version,
+with an LRU in-memory tier in front of a JSON-file disk tier
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from image_processing import VISION_JPEG_QUALITY, VISION_MAX_EDGE
+from vision_client import ANALYSIS_PROMPT, VISION_MAX_TOKENS, VISION_MODEL
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "512"))
+ANALYSIS_CACHE_DIR = Path(os.getenv("ANALYSIS_CACHE_DIR", "uploads/.analysis_cache"))
+
+# Changing the prompt, model or preprocessing invalidates every cached analysis
+ANALYSIS_VERSION = hashlib.sha256(
+    f"{VISION_MODEL}:{VISION_MAX_TOKENS}:{VISION_MAX_EDGE}:{VISION_JPEG_QUALITY}:{ANALYSIS_PROMPT}".encode()
+).hexdigest()[:16]
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """Hash a file in chunks (blocking, run in a thread)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Two-tier analysis cache
+    Memory tier is bounded LRU, disk tier survives restarts and is shared by all workers
+    """
+
+    def __init__(self, max_entries: int = ANALYSIS_CACHE_SIZE, cache_dir: Path = ANALYSIS_CACHE_DIR,
+                 version: str = ANALYSIS_VERSION):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.version = version
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Analyses currently running, so concurrent requests for one image share a single upstream call
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, image_sha256: str) -> str:
+        return f"{self.version}-{image_sha256}"
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / key[-2:] / f"{key}.json"
+
+    def _remember(self, key: str, value: Dict[str, Any]):
+        """Insert into the memory tier, evicting the least recently used entry"""
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_disk(self, key: str, value: Dict[str, Any]):
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so readers never see partial JSON
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def get(self, image_sha256: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached analysis (memory first, then disk)"""
+        key = self.make_key(image_sha256)
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+            return value
+
+        value = await asyncio.to_thread(self._read_disk, key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    async def set(self, image_sha256: str, value: Dict[str, Any]):
+        """Store an analysis in both tiers"""
+        key = self.make_key(image_sha256)
+        self._remember(key, value)
+        await asyncio.to_thread(self._write_disk, key, value)
+
+    async def get_or_compute(
+        self,
+        image_sha256: str,
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+        cacheable: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Return (analysis, cache_hit)
+        On a miss, compute() runs once even if several requests ask for the same image;
+        its result is only stored if cacheable(result) allows it
+        """
+        cached = await self.get(image_sha256)
+        if cached is not None:
+            self.hits += 1
+            return cached, True
+
+        key = self.make_key(image_sha256)
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending), True
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await compute()
+            if cacheable is None or cacheable(value):
+                await self.set(image_sha256, value)
+            future.set_result(value)
+            return value, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure does not log a warning
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Global analysis cache instance
+analysis_cache = AnalysisCache()
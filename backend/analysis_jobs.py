@@ -0,0 +1,219 @@
+"""
+Background analysis jobs for InventoScan
+Postgres-backed job queue drained by a bounded pool of async workers with retries and backoff
+"""
+
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from image_analysis import analyze_upload
+from upload_registry import upload_registry
+from vision_client import VisionAPIError
+import models
+import schemas
+
+# Worker pool configuration
+ANALYSIS_JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "4"))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_JOB_MAX_ATTEMPTS", "4"))
+ANALYSIS_JOB_RETRY_DELAY = float(os.getenv("ANALYSIS_JOB_RETRY_DELAY", "2"))        # first retry, doubles each time
+ANALYSIS_JOB_RETRY_MAX_DELAY = float(os.getenv("ANALYSIS_JOB_RETRY_MAX_DELAY", "120"))
+ANALYSIS_JOB_POLL_INTERVAL = float(os.getenv("ANALYSIS_JOB_POLL_INTERVAL", "2"))
+# Items left 'running' longer than this belonged to a crashed worker and are claimed again
+ANALYSIS_JOB_STALE_AFTER = int(os.getenv("ANALYSIS_JOB_STALE_AFTER", "600"))
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+
+class AnalysisJobQueue:
+    """
+    Job state lives in analysis_jobs / analysis_job_items, so queued work survives
+    restarts and any number of API workers can drain the same queue safely
+    """
+
+    def __init__(self, workers: int = ANALYSIS_JOB_WORKERS, max_attempts: int = ANALYSIS_JOB_MAX_ATTEMPTS):
+        self.worker_count = workers
+        self.max_attempts = max_attempts
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    # ========== SUBMISSION ==========
+
+    async def submit(self, db: Session, job: schemas.AnalysisJobCreate) -> models.AnalysisJob:
+        """Persist a job with one item per product group and wake the workers"""
+        # The inserts run in a thread; the wakeup event belongs to the event loop
+        db_job = await asyncio.to_thread(self._persist, db, job)
+        self._wakeup.set()
+        return db_job
+
+    def _persist(self, db: Session, job: schemas.AnalysisJobCreate) -> models.AnalysisJob:
+        db_job = models.AnalysisJob(session_id=job.session_id, total_items=len(job.groups))
+        for group in job.groups:
+            # The first image of a group is analyzed for the whole group
+            db_job.items.append(models.AnalysisJobItem(
+                product_group=group.product_group,
+                image_id=group.image_ids[0]
+            ))
+        db.add(db_job)
+        db.commit()
+        db.refresh(db_job)
+        db_job.items  # Load the items here, job_to_response reads them on the event loop
+        return db_job
+
+    # ========== WORKER POOL ==========
+
+    async def start(self):
+        """Start the worker tasks (call on application startup)"""
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"analysis-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+
+    async def stop(self):
+        """Cancel the worker tasks; interrupted items are reclaimed after ANALYSIS_JOB_STALE_AFTER"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await asyncio.to_thread(self._claim_next)
+            except Exception as e:
+                print(f"Warning: analysis job claim failed: {e}")
+                claimed = None
+
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=ANALYSIS_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(*claimed)
+            except Exception as e:
+                print(f"Warning: analysis job item {claimed[0]} crashed: {e}")
+
+    # ========== ITEM PROCESSING ==========
+
+    def _claim_next(self) -> Optional[Tuple[UUID, UUID, int]]:
+        """Atomically mark the next due item as running; returns (item_id, image_id, attempt)"""
+        db = SessionLocal()
+        try:
+            stale_before = datetime.now(timezone.utc) - timedelta(seconds=ANALYSIS_JOB_STALE_AFTER)
+            item = db.query(models.AnalysisJobItem).filter(
+                or_(
+                    and_(
+                        models.AnalysisJobItem.status == 'queued',
+                        models.AnalysisJobItem.next_attempt_at <= func.now()
+                    ),
+                    and_(
+                        models.AnalysisJobItem.status == 'running',
+                        models.AnalysisJobItem.updated_at < stale_before
+                    )
+                )
+            ).order_by(
+                models.AnalysisJobItem.next_attempt_at
+            ).with_for_update(skip_locked=True).first()
+
+            if item is None:
+                return None
+
+            item.status = 'running'
+            item.attempts += 1
+            claimed = (item.id, item.image_id, item.attempts)
+
+            db.query(models.AnalysisJob).filter(
+                models.AnalysisJob.id == item.job_id,
+                models.AnalysisJob.status == 'queued'
+            ).update({"status": "running"}, synchronize_session=False)
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _load_image_info(self, image_id: UUID):
+        db = SessionLocal()
+        try:
+            return upload_registry.get(db, str(image_id))
+        finally:
+            db.close()
+
+    async def _process(self, item_id: UUID, image_id: UUID, attempt: int):
+        image_info = await asyncio.to_thread(self._load_image_info, image_id)
+        if image_info is None:
+            await asyncio.to_thread(self._finish, item_id, 'failed', error="Image not found")
+            return
+
+        try:
+            analysis, _ = await analyze_upload(image_info)
+        except Exception as e:
+            retryable = e.retryable if isinstance(e, VisionAPIError) else not isinstance(e, FileNotFoundError)
+            if retryable and attempt < self.max_attempts:
+                # Exponential backoff with jitter so a rate-limited upstream is not hammered in lockstep
+                delay = min(ANALYSIS_JOB_RETRY_MAX_DELAY, ANALYSIS_JOB_RETRY_DELAY * 2 ** (attempt - 1))
+                delay *= random.uniform(0.5, 1.0)
+                await asyncio.to_thread(self._finish, item_id, 'queued', error=str(e), retry_delay=delay)
+            else:
+                await asyncio.to_thread(self._finish, item_id, 'failed', error=str(e))
+            return
+
+        await asyncio.to_thread(self._finish, item_id, 'completed', result=analysis)
+
+    def _finish(self, item_id: UUID, status: str, result: Optional[dict] = None,
+                error: Optional[str] = None, retry_delay: Optional[float] = None):
+        """Record an item outcome and close the job once every item is terminal"""
+        db = SessionLocal()
+        try:
+            item = db.query(models.AnalysisJobItem).filter(models.AnalysisJobItem.id == item_id).first()
+            if item is None:
+                return
+            item.status = status
+            item.result = result
+            item.error = error
+            if retry_delay is not None:
+                item.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=retry_delay)
+            db.flush()
+
+            if status in TERMINAL_STATUSES:
+                # Lock the job row so concurrent workers finishing the last items agree on the outcome
+                job = db.query(models.AnalysisJob).filter(
+                    models.AnalysisJob.id == item.job_id
+                ).with_for_update().one()
+                counts = dict(db.query(
+                    models.AnalysisJobItem.status, func.count(models.AnalysisJobItem.id)
+                ).filter(
+                    models.AnalysisJobItem.job_id == job.id
+                ).group_by(models.AnalysisJobItem.status).all())
+
+                if sum(counts.get(s, 0) for s in TERMINAL_STATUSES) == job.total_items:
+                    job.status = 'failed' if counts.get('failed', 0) == job.total_items else 'completed'
+                    job.finished_at = datetime.now(timezone.utc)
+
+            db.commit()
+        finally:
+            db.close()
+
+
+def job_to_response(job: models.AnalysisJob) -> schemas.AnalysisJob:
+    """Build the job status response with per-status counts"""
+    response = schemas.AnalysisJob.model_validate(job)
+    response.completed_items = sum(1 for item in job.items if item.status == 'completed')
+    response.failed_items = sum(1 for item in job.items if item.status == 'failed')
+    return response
+
+
+# Global analysis job queue instance
+analysis_job_queue = AnalysisJobQueue()
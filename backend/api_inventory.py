@@ -1,27 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
+from sqlalchemy import BigInteger, cast, or_, func, text
 from typing import List, Optional
 from datetime import datetime, timedelta
 from uuid import UUID
 
 from database import get_db
-from models import Product, ProductImage, StockMovement
-from schemas import ProductCreate, ProductUpdate, ProductResponse
+from pagination import InvalidCursor, approximate_count, keyset_paginate, set_pagination_headers
+import crud
+import http_cache
+import product_search
+import sparse_fields
+import stock_ledger
+from models import (
+    Product, ProductImage, StockMovement, CatalogVersion,
+    InventoryStats, InventoryCategoryStats, InventoryLocationStats
+)
+from schemas import ProductCreate, ProductUpdate, ProductResponse, ProductSummary
 
 router = APIRouter(prefix="/api/inventory", tags=["inventory"])
 
+INCLUDE_DESCRIPTION = "Comma list of expansions: images, stock_movements (recent movements per product)"
+
+def parse_include_param(include: Optional[str]):
+    try:
+        return crud.parse_include(include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.get("/products", response_model=List[ProductResponse])
-async def get_products(
+def get_products(
+    response: Response,
     search: Optional[str] = Query(None, description="Search term for name, brand, or barcode"),
     category: Optional[str] = Query(None, description="Filter by category"),
     location: Optional[str] = Query(None, description="Filter by location"),
     low_stock: Optional[bool] = Query(False, description="Show only low stock items"),
-    skip: int = Query(0, ge=0),
-    limit: int = Query(100, le=500),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor or X-Prev-Cursor from a previous page"),
+    skip: int = Query(0, ge=0, description="Offset paging (slow on deep pages); ignored with a cursor"),
+    limit: int = Query(100, ge=1, le=500),
+    with_total: bool = Query(False, description="Add an approximate X-Total-Count header"),
+    include: Optional[str] = Query(crud.DEFAULT_PRODUCT_INCLUDE, description=INCLUDE_DESCRIPTION),
+    fields: Optional[str] = Query(None, description="Comma list of fields to return (only those columns are read)"),
+    view: str = Query("full", regex="^(full|summary)$", description="'summary' for compact list rows"),
     db: Session = Depends(get_db)
 ):
-    """Get all products with optional filters"""
+    """Get all products with optional filters, newest first"""
+    expansions = parse_include_param(include)
+    try:
+        selected = sparse_fields.parse_fields(ProductResponse, fields, view, summary=ProductSummary)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if selected:
+        options, expansions = sparse_fields.load_options(Product, selected), sparse_fields.expansions(selected)
+    else:
+        options = crud.product_load_options(expansions)
     query = db.query(Product)
     
     # Apply search filter
@@ -45,33 +77,78 @@ async def get_products(
     if low_stock:
         query = query.filter(Product.stock_quantity <= Product.min_stock)
     
-    # Get total count before pagination
-    total = query.count()
+    # Planner estimate instead of COUNT(*), so deep pages cost the same as page one
+    total = approximate_count(db, query) if with_total else None
     
     # Apply pagination and get results
-    products = query.offset(skip).limit(limit).all()
+    try:
+        products, next_cursor, prev_cursor = keyset_paginate(
+            query.options(*options), Product, limit, cursor=cursor, skip=skip
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    return products
+    products = crud.expand_products(db, products, expansions)
+    if selected:
+        # Bypasses response_model, which would lazy-load the columns left out
+        response = sparse_fields.sparse_response(products, ProductResponse, selected, summary=ProductSummary)
+    set_pagination_headers(response, next_cursor, prev_cursor, total)
+    return response if selected else products
+
+@router.get("/products/search", response_model=List[ProductResponse])
+def search_products(
+    q: str = Query(..., min_length=1, description="Search text, or a barcode for an exact match"),
+    mode: str = Query("full", regex="^(full|prefix)$", description="'prefix' for search-as-you-type"),
+    category: Optional[str] = Query(None, description="Filter by category"),
+    limit: int = Query(20, ge=1, le=100),
+    include: Optional[str] = Query(crud.DEFAULT_PRODUCT_INCLUDE, description=INCLUDE_DESCRIPTION),
+    db: Session = Depends(get_db)
+):
+    """Ranked product search (most relevant first)"""
+    expansions = parse_include_param(include)
+    query = db.query(Product).options(*crud.product_load_options(expansions))
+    if category and category != 'all':
+        query = query.filter(Product.category == category)
+    products = product_search.search_products(query, Product, product_search.CORE_SEARCH, q, mode=mode, limit=limit)
+    return crud.expand_products(db, products, expansions)
 
 @router.get("/products/{product_id}", response_model=ProductResponse)
-async def get_product(product_id: UUID, db: Session = Depends(get_db)):
-    """Get a single product by ID"""
-    product = db.query(Product).filter(Product.id == product_id).first()
+def get_product(
+    product_id: UUID,
+    request: Request,
+    response: Response,
+    include: Optional[str] = Query(crud.DEFAULT_PRODUCT_INCLUDE, description=INCLUDE_DESCRIPTION),
+    db: Session = Depends(get_db)
+):
+    """Get a single product by ID (conditional GET: ETag / Last-Modified from updated_at)"""
+    expansions = parse_include_param(include)
+    updated_at = http_cache.row_updated_at(db, Product, product_id)
+    if updated_at is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    etag = http_cache.make_etag("product", product_id, updated_at.isoformat(), *sorted(expansions))
+    not_modified = http_cache.conditional_response(request, response, etag, updated_at)
+    if not_modified:
+        return not_modified
+
+    product = crud.get_product(db, product_id, include=expansions)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return product
 
 @router.post("/products", response_model=ProductResponse)
-async def create_product(product: ProductCreate, db: Session = Depends(get_db)):
+def create_product(product: ProductCreate, db: Session = Depends(get_db)):
     """Create a new product"""
     db_product = Product(**product.dict())
     db.add(db_product)
-    db.commit()
+    try:
+        crud.commit_product(db)
+    except crud.DuplicateBarcode as e:
+        raise HTTPException(status_code=409, detail=str(e))
     db.refresh(db_product)
     return db_product
 
 @router.put("/products/{product_id}", response_model=ProductResponse)
-async def update_product(
+def update_product(
     product_id: UUID,
     product: ProductUpdate,
     db: Session = Depends(get_db)
@@ -87,12 +164,15 @@ async def update_product(
         setattr(db_product, field, value)
     
     db_product.updated_at = datetime.utcnow()
-    db.commit()
+    try:
+        crud.commit_product(db)
+    except crud.DuplicateBarcode as e:
+        raise HTTPException(status_code=409, detail=str(e))
     db.refresh(db_product)
     return db_product
 
 @router.delete("/products/{product_id}")
-async def delete_product(product_id: UUID, db: Session = Depends(get_db)):
+def delete_product(product_id: UUID, db: Session = Depends(get_db)):
     """Delete a product"""
     db_product = db.query(Product).filter(Product.id == product_id).first()
     if not db_product:
@@ -102,20 +182,69 @@ async def delete_product(product_id: UUID, db: Session = Depends(get_db)):
     db.commit()
     return {"message": "Product deleted successfully"}
 
+def catalog_not_modified(request: Request, response: Response, db: Session, resource: str) -> Optional[Response]:
+    """304 response when the category/location lists did not change since the client's copy of `resource`"""
+    catalog_version = http_cache.catalog_version(db, CatalogVersion)
+    if catalog_version is None:
+        # No trigger-maintained version: an ETag could never change, so send none
+        return None
+    version, updated_at = catalog_version
+    etag = http_cache.make_etag(resource, version)
+    return http_cache.conditional_response(request, response, etag, updated_at)
+
 @router.get("/categories")
-async def get_categories(db: Session = Depends(get_db)):
+def get_categories(request: Request, response: Response, db: Session = Depends(get_db)):
     """Get all unique categories"""
+    not_modified = catalog_not_modified(request, response, db, "categories")
+    if not_modified:
+        return not_modified
     categories = db.query(Product.category).distinct().filter(Product.category.isnot(None)).all()
     return [cat[0] for cat in categories]
 
 @router.get("/locations")
-async def get_locations(db: Session = Depends(get_db)):
+def get_locations(request: Request, response: Response, db: Session = Depends(get_db)):
     """Get all unique locations"""
+    not_modified = catalog_not_modified(request, response, db, "locations")
+    if not_modified:
+        return not_modified
     locations = db.query(Product.location).distinct().filter(Product.location.isnot(None)).all()
     return [loc[0] for loc in locations]
 
+# Set once this worker has seen the stats triggers in place (see ensure_dashboard_stats)
+_dashboard_stats_ready = False
+
+def ensure_dashboard_stats(db: Session):
+    """
+    Make sure the trigger-maintained stats can be trusted before they are summed
+    Without the triggers (database created by create_all, not init.sql) they would
+    silently read as zero: fail with 503 instead. Stats that were never filled for
+    an existing catalog are rebuilt once.
+    """
+    global _dashboard_stats_ready
+    if _dashboard_stats_ready:
+        return
+    
+    installed = db.execute(text(
+        "SELECT to_regprocedure('refresh_inventory_stats()') IS NOT NULL "
+        "AND EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'products_stats_insert' "
+        "AND tgrelid = to_regclass('products'))"
+    )).scalar()
+    if not installed:
+        raise HTTPException(
+            status_code=503,
+            detail="Dashboard statistics not initialised: apply init.sql or migrations/upgrade_core_schema.sql"
+        )
+    
+    unfilled = db.execute(text(
+        "SELECT NOT EXISTS (SELECT 1 FROM inventory_stats) AND EXISTS (SELECT 1 FROM products)"
+    )).scalar()
+    if unfilled:
+        db.execute(text("SELECT refresh_inventory_stats()"))
+        db.commit()
+    _dashboard_stats_ready = True
+
 @router.get("/dashboard/stats")
-async def get_dashboard_stats(
+def get_dashboard_stats(
     time_range: str = Query("month", regex="^(week|month|year)$"),
     db: Session = Depends(get_db)
 ):
@@ -130,39 +259,45 @@ async def get_dashboard_stats(
     else:  # year
         start_date = now - timedelta(days=365)
     
-    # Get total products
-    total_products = db.query(func.count(Product.id)).scalar()
+    # Catalog aggregates come from the trigger-maintained summary tables (init.sql),
+    # which keep one row per shard: add the shards up
+    ensure_dashboard_stats(db)
+    total_products, total_value, low_stock_items = db.query(
+        cast(func.coalesce(func.sum(InventoryStats.total_products), 0), BigInteger),
+        func.coalesce(func.sum(InventoryStats.total_value), 0),
+        cast(func.coalesce(func.sum(InventoryStats.low_stock_items), 0), BigInteger)
+    ).one()
     
-    # Calculate total value
-    total_value = db.query(
-        func.sum(Product.stock_quantity * Product.price_regular)
-    ).filter(Product.price_regular.isnot(None)).scalar() or 0
-    
-    # Get low stock items
-    low_stock_items = db.query(func.count(Product.id)).filter(
-        Product.stock_quantity <= Product.min_stock
+    categories = db.query(func.count()).select_from(
+        db.query(InventoryCategoryStats.category)
+        .group_by(InventoryCategoryStats.category)
+        .having(func.sum(InventoryCategoryStats.product_count) > 0)
+        .subquery()
+    ).scalar()
+    locations = db.query(func.count()).select_from(
+        db.query(InventoryLocationStats.location)
+        .group_by(InventoryLocationStats.location)
+        .having(func.sum(InventoryLocationStats.product_count) > 0)
+        .subquery()
     ).scalar()
     
-    # Get unique categories and locations
-    categories = db.query(func.count(func.distinct(Product.category))).scalar()
-    locations = db.query(func.count(func.distinct(Product.location))).scalar()
-    
-    # Get recent products
+    # Get recent products (idx_products_created_at_id)
     recent_products = db.query(Product).filter(
         Product.created_at >= start_date
     ).order_by(Product.created_at.desc()).limit(5).all()
     
-    # Get category breakdown
+    # Get category breakdown (priced products only)
     category_breakdown = db.query(
-        Product.category,
-        func.count(Product.id).label('count'),
-        func.sum(Product.stock_quantity * Product.price_regular).label('value')
-    ).filter(
-        Product.category.isnot(None),
-        Product.price_regular.isnot(None)
-    ).group_by(Product.category).all()
+        InventoryCategoryStats.category,
+        cast(func.sum(InventoryCategoryStats.priced_count), BigInteger).label('count'),
+        func.sum(InventoryCategoryStats.total_value).label('value')
+    ).group_by(
+        InventoryCategoryStats.category
+    ).having(
+        func.sum(InventoryCategoryStats.priced_count) > 0
+    ).all()
     
-    # Get stock alerts
+    # Get stock alerts (idx_products_low_stock)
     stock_alerts = db.query(Product).filter(
         Product.stock_quantity <= Product.min_stock
     ).limit(10).all()
@@ -179,7 +314,7 @@ async def get_dashboard_stats(
                 "name": p.name,
                 "brand": p.brand,
                 "stock_quantity": p.stock_quantity,
-                "price_regular": p.price_regular,
+                "price_regular": p.selling_price,
                 "created_at": p.created_at.isoformat()
             }
             for p in recent_products
@@ -204,49 +339,43 @@ async def get_dashboard_stats(
         ]
     }
 
+@router.post("/dashboard/stats/refresh")
+def refresh_dashboard_stats(db: Session = Depends(get_db)):
+    """Rebuild the dashboard aggregates from the products table (after restores or bulk repairs)"""
+    db.execute(text("SELECT refresh_inventory_stats()"))
+    db.commit()
+    return {"message": "Dashboard statistics refreshed"}
+
 @router.post("/products/{product_id}/stock-movement")
-async def add_stock_movement(
+def add_stock_movement(
     product_id: UUID,
     movement_type: str = Query(..., regex="^(in|out|adjustment)$"),
     quantity: int = Query(..., gt=0),
     notes: Optional[str] = None,
+    reference_number: Optional[str] = Query(None, max_length=100, description="Idempotency key for safe retries"),
     db: Session = Depends(get_db)
 ):
     """Add a stock movement (in/out/adjustment)"""
-    # Get the product
-    product = db.query(Product).filter(Product.id == product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    # Update stock quantity
-    if movement_type == "in":
-        product.stock_quantity += quantity
-    elif movement_type == "out":
-        if product.stock_quantity < quantity:
-            raise HTTPException(status_code=400, detail="Insufficient stock")
-        product.stock_quantity -= quantity
-    else:  # adjustment
-        product.stock_quantity = quantity
-    
-    # Create stock movement record
-    movement = StockMovement(
-        product_id=product_id,
-        movement_type=movement_type,
-        quantity=quantity,
-        notes=notes
-    )
-    
-    db.add(movement)
-    product.updated_at = datetime.utcnow()
-    db.commit()
+    try:
+        applied = stock_ledger.apply_movement(
+            db,
+            product_id=product_id,
+            movement_type=movement_type,
+            quantity=quantity,
+            notes=notes,
+            reference_number=reference_number
+        )
+    except stock_ledger.StockMovementError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
     
     return {
-        "message": "Stock movement recorded",
-        "new_quantity": product.stock_quantity
+        "message": "Stock movement already recorded" if applied.replayed else "Stock movement recorded",
+        "new_quantity": applied.new_quantity,
+        "replayed": applied.replayed
     }
 
 @router.get("/products/{product_id}/stock-history")
-async def get_stock_history(
+def get_stock_history(
     product_id: UUID,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, le=200),
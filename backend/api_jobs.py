@@ -0,0 +1,90 @@
+"""Background analysis job endpoints for InventoScan"""
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from uuid import UUID
+import asyncio
+import json
+
+from database import get_db, SessionLocal
+from analysis_jobs import analysis_job_queue, job_to_response, TERMINAL_STATUSES
+import crud
+import schemas
+from rate_limiter import rate_limit_policy
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+# Seconds between progress checks on the event stream
+EVENT_POLL_INTERVAL = 1.0
+
+@router.post("/analysis", response_model=schemas.AnalysisJob, status_code=202)
+@rate_limit_policy("analyze")
+async def create_analysis_job(
+    job: schemas.AnalysisJobCreate,
+    db: Session = Depends(get_db)
+):
+    """Queue analyses for one or more product groups and return the job immediately"""
+    db_job = await analysis_job_queue.submit(db, job)
+    return job_to_response(db_job)
+
+@router.get("/{job_id}", response_model=schemas.AnalysisJob)
+def get_analysis_job(job_id: UUID, db: Session = Depends(get_db)):
+    """Poll job progress and per-group results"""
+    db_job = crud.get_analysis_job(db, job_id)
+    if not db_job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_response(db_job)
+
+def _load_job_status(job_id: UUID):
+    db = SessionLocal()
+    try:
+        db_job = crud.get_analysis_job(db, job_id)
+        return job_to_response(db_job) if db_job else None
+    finally:
+        db.close()
+
+@router.get("/{job_id}/events")
+async def stream_analysis_job(job_id: UUID):
+    """
+    Server-Sent Events stream of job progress.
+    Emits an 'item' event whenever a product group changes state and
+    a final 'done' event once the job has finished.
+    """
+    status = await asyncio.to_thread(_load_job_status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream(status):
+        seen = {}
+        last_progress = None
+        while True:
+            for item in status.items:
+                state = (item.status, item.attempts)
+                if seen.get(item.id) != state:
+                    seen[item.id] = state
+                    yield f"event: item\ndata: {item.model_dump_json()}\n\n"
+
+            progress = {
+                "status": status.status,
+                "total_items": status.total_items,
+                "completed_items": status.completed_items,
+                "failed_items": status.failed_items
+            }
+            if status.status in TERMINAL_STATUSES:
+                yield f"event: done\ndata: {json.dumps(progress)}\n\n"
+                return
+            if progress != last_progress:
+                last_progress = progress
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+            status = await asyncio.to_thread(_load_job_status, job_id)
+            if status is None:
+                return
+
+    return StreamingResponse(
+        event_stream(status),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,23 +1,32 @@
 """Marketplace API endpoints for InventoScan"""
 
-from fastapi import APIRouter, HTTPException, Depends, Response
+from fastapi import APIRouter, HTTPException, Depends, File, Form, Query, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from uuid import UUID
+from datetime import datetime
+import asyncio
 import csv
 import io
 import json
 
-from database import get_db
+from database import get_db, SessionLocal
+import http_cache
 import models_marketplace as models
 import schemas_marketplace as schemas
+import product_search
+from marketplace_export import EXPORT_FORMATS, delta_window, stream_delta_export, stream_export
+from product_import import ImportFormatError, ImportTarget, detect_format, import_products
+from schemas import ProductImportResult
+from rate_limiter import rate_limit_policy
 
 router = APIRouter(prefix="/api/marketplace", tags=["marketplace"])
 
 # ========== PRODUCT CRUD WITH MARKETPLACE FIELDS ==========
 
 @router.post("/products/complete", response_model=schemas.ProductMarketplace)
-async def create_complete_product(
+def create_complete_product(
     product: schemas.ProductMarketplaceCreate,
     db: Session = Depends(get_db)
 ):
@@ -33,8 +42,46 @@ async def create_complete_product(
     
     return db_product
 
+MARKETPLACE_IMPORT = ImportTarget(
+    model=models.Product,
+    schema=schemas.ProductMarketplaceCreate,
+    key="sku",
+    json_columns=frozenset({"bullet_points", "search_terms", "specifications", "attributes"})
+)
+
+@router.post("/products/import", response_model=ProductImportResult)
+@rate_limit_policy("upload")
+async def import_marketplace_products(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Import marketplace products from a CSV (header row) or JSON Lines file.
+    Rows with a known SKU update that product; invalid rows are reported by line.
+    """
+    try:
+        file_format = detect_format(file.filename, format)
+        return await asyncio.to_thread(import_products, db, MARKETPLACE_IMPORT, file.file, file_format)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
+
+@router.get("/products/search", response_model=List[schemas.ProductMarketplace])
+def search_marketplace_products(
+    q: str = Query(..., min_length=1, description="Search text, or an EAN/MPN/SKU for an exact match"),
+    mode: str = Query("full", regex="^(full|prefix)$", description="'prefix' for search-as-you-type"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """Ranked search over titles, brands, descriptions and bullet points"""
+    return product_search.search_products(
+        db.query(models.Product), models.Product, product_search.MARKETPLACE_SEARCH, q, mode=mode, limit=limit
+    )
+
 @router.get("/products/{product_id}/validate")
-async def validate_product_for_marketplace(
+def validate_product_for_marketplace(
     product_id: UUID,
     marketplace: str,
     db: Session = Depends(get_db)
@@ -85,7 +132,7 @@ async def validate_product_for_marketplace(
 # ========== EXPORT ENDPOINTS ==========
 
 @router.get("/export/ebay/{product_id}")
-async def export_product_for_ebay(
+def export_product_for_ebay(
     product_id: UUID,
     format: str = "json",  # json, csv
     db: Session = Depends(get_db)
@@ -113,7 +160,7 @@ async def export_product_for_ebay(
         return ebay_data
 
 @router.get("/export/amazon/{product_id}")
-async def export_product_for_amazon(
+def export_product_for_amazon(
     product_id: UUID,
     format: str = "json",  # json, csv, txt
     db: Session = Depends(get_db)
@@ -141,46 +188,96 @@ async def export_product_for_amazon(
         return amazon_data
 
 @router.get("/export/bulk")
-async def export_bulk_products(
+def export_bulk_products(
     marketplace: str,
     status: Optional[str] = "active",
-    limit: int = 100,
+    limit: Optional[int] = Query(None, ge=1, description="Export at most this many products (default: all)"),
+    format: str = Query("csv", regex="^(csv|tsv)$"),
+    gzip: bool = Query(False, description="Return a .gz compressed file"),
     db: Session = Depends(get_db)
 ):
-    """Export multiple products for marketplace"""
-    query = db.query(models.Product)
+    """
+    Export products for a marketplace as a streamed CSV/TSV feed.
+    Memory use is constant, so whole catalogs can be exported.
+    """
+    export_format = EXPORT_FORMATS.get(marketplace.lower())
+    if export_format is None:
+        raise HTTPException(status_code=400, detail="Unsupported marketplace")
     
+    query = db.query(models.Product.id)
     if status:
         query = query.filter(models.Product.status == status)
+    if not db.query(query.exists()).scalar():
+        return {"message": "No products to export"}
     
-    products = query.limit(limit).all()
+    delimiter, extension, media_type = (
+        (",", "csv", "text/csv") if format == "csv" else ("\t", "txt", "text/tab-separated-values")
+    )
+    filename = f"{export_format.name}_export.{extension}"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
     
-    if marketplace.lower() == "ebay":
-        data = [p.to_ebay_format() for p in products]
-    elif marketplace.lower() == "amazon":
-        data = [p.to_amazon_format() for p in products]
-    else:
+    return StreamingResponse(
+        # Own session: the request session is closed before the body is streamed
+        stream_export(SessionLocal(), models.Product, export_format, status, limit, delimiter, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@router.get("/export/delta")
+def export_delta_products(
+    marketplace: str,
+    since: Optional[datetime] = Query(None, description="Export changes after this time instead of the stored watermark"),
+    advance: Optional[bool] = Query(None, description="Move the watermark after the feed (default: only without since)"),
+    format: str = Query("csv", regex="^(csv|tsv)$"),
+    gzip: bool = Query(False, description="Return a .gz compressed file")
+):
+    """
+    Export only the products changed or deleted since the marketplace's last delta feed.
+    The first feed of a marketplace is a full snapshot of the active products.
+    """
+    export_format = EXPORT_FORMATS.get(marketplace.lower())
+    if export_format is None:
         raise HTTPException(status_code=400, detail="Unsupported marketplace")
     
-    # Create CSV response
-    if data:
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=data[0].keys())
-        writer.writeheader()
-        writer.writerows(data)
-        
-        return Response(
-            content=output.getvalue(),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={marketplace}_export.csv"}
-        )
+    # Own session, kept open while the body is streamed
+    db = SessionLocal()
+    try:
+        window = delta_window(db, models.FeedWatermark, export_format.name, since)
+    except Exception:
+        db.close()
+        raise
     
-    return {"message": "No products to export"}
+    delimiter, extension, media_type = (
+        (",", "csv", "text/csv") if format == "csv" else ("\t", "txt", "text/tab-separated-values")
+    )
+    filename = f"{export_format.name}_delta.{extension}"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "X-Feed-Until": window.until.isoformat()
+    }
+    if window.since:
+        headers["X-Feed-Since"] = window.since.isoformat()
+    
+    return StreamingResponse(
+        stream_delta_export(
+            db, models.Product, models.ProductTombstone, models.FeedWatermark, models.MarketplaceListing,
+            export_format, window,
+            advance=since is None if advance is None else advance, delimiter=delimiter, compress=gzip
+        ),
+        media_type=media_type,
+        headers=headers
+    )
 
 # ========== AI INTEGRATION ==========
 
 @router.post("/analyze-for-marketplace")
-async def analyze_image_for_marketplace(
+def analyze_image_for_marketplace(
     image_id: str,
     db: Session = Depends(get_db)
 ):
@@ -276,28 +373,41 @@ def validate_marketplace_product(product: schemas.ProductMarketplaceCreate) -> s
     
     return validation
 
+# Static category lists: the ETag only changes with a deployment
+EBAY_CATEGORIES = {
+    "categories": [
+        {"id": "42630", "name": "Befestigungstechnik"},
+        {"id": "11804", "name": "Elektronik & Elektrotechnik"},
+        {"id": "131090", "name": "Werkzeug"},
+        {"id": "26395", "name": "Industriebedarf"},
+        {"id": "92074", "name": "Sicherheitstechnik"}
+    ]
+}
+EBAY_CATEGORIES_ETAG = http_cache.make_etag("ebay-categories", json.dumps(EBAY_CATEGORIES, sort_keys=True))
+
+AMAZON_CATEGORIES = {
+    "categories": [
+        {"id": "B001", "name": "Baumarkt"},
+        {"id": "B002", "name": "Gewerbe, Industrie & Wissenschaft"},
+        {"id": "B003", "name": "Elektronik & Foto"},
+        {"id": "B004", "name": "Werkzeug"},
+        {"id": "B005", "name": "Befestigungstechnik"}
+    ]
+}
+AMAZON_CATEGORIES_ETAG = http_cache.make_etag("amazon-categories", json.dumps(AMAZON_CATEGORIES, sort_keys=True))
+
 @router.get("/categories/ebay")
-async def get_ebay_categories():
+async def get_ebay_categories(request: Request, response: Response):
     """Get common eBay categories"""
-    return {
-        "categories": [
-            {"id": "42630", "name": "Befestigungstechnik"},
-            {"id": "11804", "name": "Elektronik & Elektrotechnik"},
-            {"id": "131090", "name": "Werkzeug"},
-            {"id": "26395", "name": "Industriebedarf"},
-            {"id": "92074", "name": "Sicherheitstechnik"}
-        ]
-    }
+    not_modified = http_cache.conditional_response(
+        request, response, EBAY_CATEGORIES_ETAG, cache_control=http_cache.STATIC_CACHE_CONTROL
+    )
+    return not_modified or EBAY_CATEGORIES
 
 @router.get("/categories/amazon")
-async def get_amazon_categories():
+async def get_amazon_categories(request: Request, response: Response):
     """Get common Amazon categories"""
-    return {
-        "categories": [
-            {"id": "B001", "name": "Baumarkt"},
-            {"id": "B002", "name": "Gewerbe, Industrie & Wissenschaft"},
-            {"id": "B003", "name": "Elektronik & Foto"},
-            {"id": "B004", "name": "Werkzeug"},
-            {"id": "B005", "name": "Befestigungstechnik"}
-        ]
-    }
\ No newline at end of file
+    not_modified = http_cache.conditional_response(
+        request, response, AMAZON_CATEGORIES_ETAG, cache_control=http_cache.STATIC_CACHE_CONTROL
+    )
+    return not_modified or AMAZON_CATEGORIES
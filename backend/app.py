@@ -1,46 +1,81 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Response
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Response, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
-from datetime import datetime
+
+# Load .env before local modules read their configuration
+load_dotenv()
+
 from pathlib import Path
 from typing import List, Optional
 from uuid import UUID
-import openai
-import base64
+import asyncio
 import shutil
 import uuid
 import os
-import json
 import secrets
 
 # Import database dependencies
-from database import get_db, engine
+from database import get_db, engine, pool_status, count_queries, DEBUG_QUERY_COUNT, DEBUG_QUERY_BUDGET
 import models
 import schemas
 import crud
+import http_cache
 
 # Import API routers
 from api_inventory import router as inventory_router
 from api_marketplace import router as marketplace_router
+from api_jobs import router as jobs_router
 
 # Import CSRF protection
 from csrf_protection import CSRFProtection, csrf_middleware, create_csrf_endpoint
 
 # Import Rate Limiting
-from rate_limiter import rate_limit_middleware, rate_limit, strict_limit
+from rate_limiter import rate_limit_middleware, rate_limit, rate_limit_policy, strict_limit
+
+# Import Vision API client
+from vision_client import vision_client, VisionAPIError
+from image_analysis import analyze_upload
+from analysis_jobs import analysis_job_queue
+from image_processing import (
+    shutdown_process_pool, run_in_process_pool, generate_derivative, generate_all_derivatives,
+    read_image_size, guess_mime_type, compute_dhash, DERIVATIVE_SIZES, DERIVATIVE_FORMATS
+)
+from perceptual_index import perceptual_index
 
-load_dotenv()
+# Import upload registry and streaming storage
+from upload_registry import upload_registry
+from upload_storage import save_upload, UploadTooLarge
+
+# Import stock ledger errors
+from stock_ledger import StockMovementError, apply_movements
+
+# Import bulk product import
+from product_import import ImportFormatError, ImportTarget, detect_format, import_products
+
+# Import sparse fieldsets for list endpoints
+import sparse_fields
+
+# Import cursor pagination helpers
+from pagination import InvalidCursor, approximate_count, set_pagination_headers, PAGINATION_HEADERS
+
+# Import response compression and the orjson response class
+from compression import CompressionMiddleware
+from fast_json import FastJSONResponse
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="InventoScan API")
+app = FastAPI(title="InventoScan API", default_response_class=FastJSONResponse)
 
 # Initialize CSRF Protection
-SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
+SECRET_KEY = os.getenv("SECRET_KEY")
+if not SECRET_KEY:
+    # CSRF tokens are signed with this key: a per-process key breaks them across workers and restarts
+    print("Warning: SECRET_KEY is not set, using a random key for this process")
+    SECRET_KEY = secrets.token_urlsafe(32)
 csrf_protection = CSRFProtection(SECRET_KEY)
 app.state.csrf_protection = csrf_protection
 
@@ -48,6 +83,20 @@ app.state.csrf_protection = csrf_protection
 app.middleware("http")(rate_limit_middleware)  # Rate limiting first
 app.middleware("http")(csrf_middleware)  # Then CSRF protection
 
+if DEBUG_QUERY_COUNT:
+    @app.middleware("http")
+    async def query_count_middleware(request: Request, call_next):
+        """Report the statements each request issued and fail requests over the budget (N+1 guard)"""
+        with count_queries() as counter:
+            response = await call_next(request)
+        response.headers["X-Query-Count"] = str(counter[0])
+        if counter[0] > DEBUG_QUERY_BUDGET:
+            raise AssertionError(
+                f"{request.method} {request.url.path} issued {counter[0]} queries "
+                f"(DEBUG_QUERY_BUDGET={DEBUG_QUERY_BUDGET}); check for lazy loads in a loop"
+            )
+        return response
+
 # Create uploads directory if it doesn't exist
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -56,17 +105,17 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 MAX_FILE_SIZE = 10 * 1024 * 1024
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
 
-# Initialize OpenAI (will be None if no API key)
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if openai_api_key:
-    openai.api_key = openai_api_key
-    client_available = True
-else:
-    client_available = False
-    print("Warning: OpenAI API key not configured")
+# Build thumbnails right after upload instead of on first request
+DERIVATIVES_EAGER = os.getenv("DERIVATIVES_EAGER", "true").lower() == "true"
+# Derivatives never change for a given original, so browsers may cache them for a year
+DERIVATIVE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Similar earlier uploads listed in upload responses
+MAX_REPORTED_DUPLICATES = int(os.getenv("MAX_REPORTED_DUPLICATES", "5"))
 
-# Store uploaded images info (in production, use a database)
-uploaded_images = {}
+# Vision API availability (False without OPENAI_API_KEY)
+client_available = vision_client.available
+if not client_available:
+    print("Warning: OpenAI API key not configured")
 
 app.add_middleware(
     CORSMiddleware,
@@ -82,11 +131,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=PAGINATION_HEADERS + http_cache.VALIDATOR_HEADERS + ["Idempotent-Replayed"],
 )
 
+# Outermost: compresses the final body, including CORS and error responses
+app.add_middleware(CompressionMiddleware)
+
 # Include API routers
 app.include_router(inventory_router)
 app.include_router(marketplace_router)
+app.include_router(jobs_router)
+
+@app.on_event("startup")
+async def start_analysis_workers():
+    """Start the background analysis worker pool"""
+    await analysis_job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_background_services():
+    """Stop analysis workers, image processes and pooled upstream connections"""
+    await analysis_job_queue.stop()
+    await vision_client.close()
+    shutdown_process_pool()
 
 @app.get("/")
 async def root():
@@ -96,14 +162,23 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@app.get("/api/health/db")
+def database_health():
+    """Connection pool metrics (checked out vs capacity, peak usage since startup)"""
+    return {"pool": pool_status()}
+
 # CSRF Token endpoint
 @app.get("/api/csrf-token")
-async def get_csrf_token_endpoint(response: Response):
+async def get_csrf_token_endpoint(request: Request, response: Response):
     """Get a new CSRF token for API requests"""
-    return await create_csrf_endpoint(csrf_protection)(response)
+    return await create_csrf_endpoint(csrf_protection)(request, response)
 
 @app.post("/api/upload")
-async def upload_image(file: UploadFile = File(...)):
+async def upload_image(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
     """
     Upload an image file with validation.
     - Max size: 10MB
@@ -117,47 +192,46 @@ async def upload_image(file: UploadFile = File(...)):
             detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
-    # Check file size
-    contents = await file.read()
-    file_size = len(contents)
-    
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File too large. Maximum size: {MAX_FILE_SIZE / 1024 / 1024}MB"
-        )
-    
     # Generate unique filename
-    unique_id = str(uuid.uuid4())
+    unique_id = uuid.uuid4()
     filename = f"{unique_id}{file_extension}"
     file_path = UPLOAD_DIR / filename
     
-    # Save file
+    # Stream file to disk (size limit is enforced while streaming)
     try:
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
+        file_size, file_hash = await save_upload(file, file_path, MAX_FILE_SIZE)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+    
+    image_info = None
+    try:
+        phash = await hash_upload(file_path)
         
-        # Store image info
-        image_info = {
-            "id": unique_id,
-            "filename": filename,
-            "original_filename": file.filename,
-            "path": str(file_path),
-            "size": file_size,
-            "uploaded_at": datetime.now().isoformat()
-        }
-        uploaded_images[unique_id] = image_info
+        # Register image info
+        image_info = await asyncio.to_thread(upload_registry.register, db, schemas.UploadedImageCreate(
+            id=unique_id,
+            filename=filename,
+            original_filename=file.filename,
+            file_path=str(file_path),
+            file_size=file_size,
+            sha256=file_hash,
+            phash=phash
+        ))
+        image_info["duplicates"] = await index_upload(db, image_info)
+        
+        if DERIVATIVES_EAGER:
+            background_tasks.add_task(warm_derivatives, str(file_path))
         
         # Return response
         return image_info
     except Exception as e:
-        # Clean up file if error occurs
-        if file_path.exists():
-            file_path.unlink()
+        await discard_failed_upload(db, file_path, image_info)
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
 
 @app.post("/api/analyze/{image_id}")
-async def analyze_image(image_id: str):
+async def analyze_image(image_id: str, db: Session = Depends(get_db)):
     """
     Analyze an uploaded image using OpenAI Vision API.
     Returns product information: name, brand, category, description.
@@ -170,188 +244,39 @@ async def analyze_image(image_id: str):
         )
     
     # Check if image exists
-    if image_id not in uploaded_images:
+    image_info = await asyncio.to_thread(upload_registry.get, db, image_id)
+    if not image_info:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    image_info = uploaded_images[image_id]
     image_path = Path(image_info["path"])
     
     if not image_path.exists():
         raise HTTPException(status_code=404, detail="Image file not found")
     
     try:
-        # Read and encode image
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        # Use requests to call OpenAI API directly (avoiding proxy issues)
-        import requests
-        
-        headers = {
-            "Authorization": f"Bearer {openai_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """Analyze this product image for marketplace selling. Extract ALL visible information.
-
-IDENTIFY (look for text, labels, markings):
-- brand: Manufacturer/brand name
-- model: Model number or product code  
-- mpn: Manufacturer part number (e.g., Art. Nr., Item #)
-- ean: EAN/UPC barcode number if visible
-- material: Material composition (steel, plastic, aluminum, etc.)
-- color: Product color
-- size: Dimensions or size designation
-- din_iso: DIN/ISO/EN standards (e.g., DIN 912, ISO 9001)
-- country: Country of origin if marked
-- certifications: CE, RoHS, TÜV, other certifications
-
-ANALYZE TECHNICAL DETAILS:
-- specifications: All technical specs (thread size, voltage, capacity, etc.)
-- quantity_per_package: Number of items if bulk package
-- surface_treatment: Coating/finish (galvanized, anodized, painted)
-
-SUGGEST FOR MARKETPLACE (be specific):
-- title: Product title max 80 chars, format: "BRAND Product Type Specification Size Quantity"
-- category_ebay_id: eBay category ID (e.g., 42630 for fasteners)
-- category_amazon: Amazon browse node
-- bullet_points: Exactly 5 bullet points, each max 500 chars:
-  1. Main feature/use case
-  2. Technical specification
-  3. Material and quality
-  4. Compatibility/application
-  5. Package contents/quantity
-- search_terms: 10 relevant search keywords
-- hs_code: Suggested customs HS code
-
-Return ONLY valid JSON with this structure:
-{
-    "brand": "",
-    "model": "",  
-    "mpn": "",
-    "ean": "",
-    "product_name": "",
-    "category": "",
-    "description": "",
-    "material": "",
-    "color": "",
-    "size": "",
-    "din_iso": "",
-    "country_of_origin": "",
-    "certifications": [],
-    "specifications": {},
-    "quantity": "",
-    "surface_treatment": "",
-    "marketplace_suggestions": {
-        "title": "",
-        "category_ebay_id": "",
-        "category_amazon": "",
-        "bullet_points": [],
-        "search_terms": [],
-        "hs_code": ""
-    }
-}"""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 500
-        }
-        
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            error_detail = response.json().get('error', {}).get('message', 'Unknown error')
-            raise HTTPException(status_code=500, detail=f"OpenAI API error: {error_detail}")
-        
-        # Parse the response
-        result = response.json()
-        result_text = result['choices'][0]['message']['content'].strip()
-        
-        # Clean the response text (remove markdown code blocks if present)
-        if result_text.startswith('```json'):
-            result_text = result_text[7:]  # Remove ```json
-        if result_text.startswith('```'):
-            result_text = result_text[3:]  # Remove ```
-        if result_text.endswith('```'):
-            result_text = result_text[:-3]  # Remove trailing ```
-        result_text = result_text.strip()
-        
-        # Try to parse as JSON
-        try:
-            analysis_result = json.loads(result_text)
-        except json.JSONDecodeError:
-            # If parsing still fails, try to extract JSON from the text
-            import re
-            json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-            if json_match:
-                try:
-                    analysis_result = json.loads(json_match.group())
-                except:
-                    # Last resort: create a structured response
-                    analysis_result = {
-                        "product_name": "Unknown",
-                        "brand": "Unknown",
-                        "category": "Unknown",
-                        "description": result_text,
-                        "barcode": None,
-                        "quantity": None,
-                        "additional_info": None
-                    }
-            else:
-                analysis_result = {
-                    "product_name": "Unknown",
-                    "brand": "Unknown",
-                    "category": "Unknown",
-                    "description": result_text,
-                    "barcode": None,
-                    "quantity": None,
-                    "additional_info": None
-                }
-        
-        # Add metadata
-        analysis_result.update({
-            "image_id": image_id,
-            "analyzed_at": datetime.now().isoformat(),
-            "original_filename": image_info["original_filename"]
-        })
-        
+        analysis_result, _ = await analyze_upload(image_info)
         return analysis_result
         
+    except VisionAPIError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 @app.get("/api/images/{image_id}")
-async def get_image_info(image_id: str):
+def get_image_info(image_id: str, db: Session = Depends(get_db)):
     """Get information about an uploaded image."""
-    if image_id not in uploaded_images:
+    image_info = upload_registry.get(db, image_id)
+    if not image_info:
         raise HTTPException(status_code=404, detail="Image not found")
-    return uploaded_images[image_id]
+    return image_info
 
 @app.post("/api/batch-upload")
 async def batch_upload(
+    background_tasks: BackgroundTasks,
     session_id: str = Form(...),
     product_group: str = Form(...),
-    images: List[UploadFile] = File(...)
+    images: List[UploadFile] = File(...),
+    db: Session = Depends(get_db)
 ):
     """
     Upload multiple images for a single product group.
@@ -370,56 +295,167 @@ async def batch_upload(
         if file_extension not in ALLOWED_EXTENSIONS:
             continue
         
-        # Read and save file
-        contents = await image_file.read()
-        if len(contents) > MAX_FILE_SIZE:
-            continue
-        
         # Generate unique filename
-        unique_id = str(uuid.uuid4())
+        unique_id = uuid.uuid4()
         filename = f"{unique_id}{file_extension}"
         file_path = group_dir / filename
         
-        # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
+        # Stream file to disk, skipping files over the size limit
+        try:
+            file_size, file_hash = await save_upload(image_file, file_path, MAX_FILE_SIZE)
+        except UploadTooLarge:
+            continue
+        finally:
+            await image_file.close()
         
-        # Store image info
-        image_info = {
-            "id": unique_id,
-            "filename": filename,
-            "original_filename": image_file.filename,
-            "path": str(file_path),
-            "session_id": session_id,
-            "product_group": product_group,
-            "size": len(contents),
-            "uploaded_at": datetime.now().isoformat()
-        }
-        uploaded_images[unique_id] = image_info
+        image_info = None
+        try:
+            phash = await hash_upload(file_path)
+            
+            # Register image info
+            image_info = await asyncio.to_thread(upload_registry.register, db, schemas.UploadedImageCreate(
+                id=unique_id,
+                filename=filename,
+                original_filename=image_file.filename,
+                file_path=str(file_path),
+                file_size=file_size,
+                sha256=file_hash,
+                phash=phash,
+                session_id=session_id,
+                product_group=product_group
+            ))
+            image_info["duplicates"] = await index_upload(db, image_info)
+        except Exception as e:
+            # Files stored before this one stay uploaded
+            await discard_failed_upload(db, file_path, image_info)
+            raise HTTPException(status_code=500, detail=f"Error saving file {image_file.filename}: {str(e)}")
         uploaded.append(image_info)
+        
+        if DERIVATIVES_EAGER:
+            background_tasks.add_task(warm_derivatives, str(file_path))
     
-    # Optionally trigger AI analysis for the product group
+    # Queue AI analysis for the product group (poll /api/jobs/{job_id} for the result)
+    job_id = None
     if uploaded and client_available:
-        # Analyze first image to get product info
-        first_image = uploaded[0]
-        try:
-            analysis = await analyze_image(first_image["id"])
-            # Store analysis for the product group
-            for img in uploaded:
-                img["ai_analysis"] = analysis
-        except:
-            pass
+        job = await analysis_job_queue.submit(db, schemas.AnalysisJobCreate(
+            session_id=session_id,
+            groups=[schemas.AnalysisJobGroup(
+                product_group=product_group,
+                image_ids=[img["id"] for img in uploaded]
+            )]
+        ))
+        job_id = str(job.id)
     
     return {
         "session_id": session_id,
         "product_group": product_group,
         "uploaded_count": len(uploaded),
-        "images": uploaded
+        "images": uploaded,
+        "job_id": job_id
     }
 
+async def discard_failed_upload(db: Session, file_path: Path, image_info: Optional[dict]):
+    """Clean up file (and its registration) after an upload failed past saving"""
+    if file_path.exists():
+        file_path.unlink()
+    if image_info is not None:
+        await asyncio.to_thread(upload_registry.discard, db, image_info["id"])
+
+async def hash_upload(file_path: Path) -> Optional[str]:
+    """Perceptual hash of an upload, or None if Pillow cannot decode it"""
+    try:
+        return await run_in_process_pool(compute_dhash, str(file_path))
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not hash {file_path.name}: {e}")
+        return None
+
+async def index_upload(db: Session, image_info: dict) -> list:
+    """
+    Add an upload to the perceptual index and report likely duplicates
+    (earlier uploads within PHASH_DUPLICATE_DISTANCE and the products using them)
+    """
+    if not image_info.get("phash"):
+        return []
+    matches = await perceptual_index.find(image_info["phash"], exclude=image_info["id"])
+    perceptual_index.add(image_info["id"], image_info["phash"], image_info.get("sha256"))
+    return await asyncio.to_thread(duplicate_products, db, matches[:MAX_REPORTED_DUPLICATES])
+
+def duplicate_products(db: Session, matches: list) -> list:
+    """Earlier uploads matching an image, with the products using them (blocking, run in a thread)"""
+    duplicates = []
+    for match in matches:
+        earlier = upload_registry.get(db, match["image_id"])
+        if earlier:
+            duplicates.append({"image_id": match["image_id"], "distance": match["distance"], "path": earlier["path"]})
+    
+    products_by_path = crud.get_product_ids_by_image_paths(db, [d["path"] for d in duplicates])
+    return [
+        {
+            "image_id": d["image_id"],
+            "distance": d["distance"],
+            "product_ids": [str(pid) for pid in products_by_path.get(d["path"], [])]
+        }
+        for d in duplicates
+    ]
+
+async def warm_derivatives(file_path: str):
+    """Background task: pre-build thumbnails so the first gallery view is fast"""
+    try:
+        await run_in_process_pool(generate_all_derivatives, file_path)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not build derivatives for {file_path}: {e}")
+
+@app.get("/api/product-images/{image_id}/{size}")
+async def get_product_image_derivative(
+    image_id: UUID,
+    size: str,
+    request: Request,
+    format: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Serve a resized product image (thumb or medium) as WebP or JPEG.
+    Derivatives are generated on first request and cached on disk.
+    Without ?format= the format is negotiated from the Accept header.
+    """
+    if size not in DERIVATIVE_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown size. Allowed sizes: {', '.join(DERIVATIVE_SIZES)}")
+    if format is None:
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    if format not in DERIVATIVE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format. Allowed formats: {', '.join(DERIVATIVE_FORMATS)}")
+    
+    db_image = await asyncio.to_thread(crud.get_product_image, db, image_id)
+    if not db_image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    source = Path(db_image.file_path)
+    try:
+        source_stat = await asyncio.to_thread(source.stat)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image file not found")
+    
+    # Originals are never rewritten in place, so their identity pins the derivative
+    etag = f'"{source_stat.st_mtime_ns:x}-{source_stat.st_size:x}-{size}-{format}"'
+    headers = {"ETag": etag, "Cache-Control": DERIVATIVE_CACHE_CONTROL, "Vary": "Accept"}
+    if http_cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        derivative, width_px, height_px = await run_in_process_pool(
+            generate_derivative, str(source), size, format
+        )
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Could not resize image: {str(e)}")
+    
+    if db_image.width_px is None:
+        await asyncio.to_thread(crud.update_product_image_size, db, image_id, width_px, height_px)
+    
+    return FileResponse(derivative, media_type=DERIVATIVE_FORMATS[format][1], headers=headers)
+
 # Product CRUD Endpoints
 @app.post("/api/products", response_model=schemas.Product)
-async def create_product(
+def create_product(
     product: schemas.ProductCreate,
     db: Session = Depends(get_db)
 ):
@@ -430,44 +466,121 @@ async def create_product(
         if db_product:
             raise HTTPException(status_code=400, detail="Product with this barcode already exists")
     
-    return crud.create_product(db, product)
+    try:
+        return crud.create_product(db, product)
+    except crud.DuplicateBarcode as e:
+        # Created concurrently after the check above
+        raise HTTPException(status_code=409, detail=str(e))
+
+PRODUCT_IMPORT = ImportTarget(
+    model=models.Product,
+    schema=schemas.ProductCreate,
+    key="barcode",
+    json_columns=frozenset({"custom_fields", "ai_data"}),
+    aliases={"metadata": "custom_fields"}
+)
+
+@app.post("/api/products/import", response_model=schemas.ProductImportResult)
+@rate_limit_policy("upload")
+async def import_products_file(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Import products from a CSV (header row) or JSON Lines file.
+    Rows with a known barcode update that product; invalid rows are reported by line.
+    """
+    try:
+        file_format = detect_format(file.filename, format)
+        return await asyncio.to_thread(import_products, db, PRODUCT_IMPORT, file.file, file_format)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
 
 @app.get("/api/products", response_model=List[schemas.Product])
-async def list_products(
+def list_products(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     category: Optional[str] = None,
     search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+    include: Optional[str] = crud.DEFAULT_PRODUCT_INCLUDE,
+    fields: Optional[str] = None,
+    view: str = "full",
     db: Session = Depends(get_db)
 ):
-    """Get list of products with optional filtering"""
-    return crud.get_products(db, skip=skip, limit=limit, category=category, search=search)
+    """
+    Get list of products with optional filtering, newest first.
+    Pass the X-Next-Cursor / X-Prev-Cursor response header back as `cursor` to page;
+    `with_total` adds an approximate X-Total-Count.
+    `include` is a comma list of images and stock_movements (recent movements per product).
+    `fields` (comma list) or `view=summary` return only those fields, read from only those columns.
+    """
+    try:
+        selected = sparse_fields.parse_fields(schemas.Product, fields, view, summary=schemas.ProductSummary)
+        products, next_cursor, prev_cursor = crud.get_products(
+            db, skip=skip, limit=limit, category=category, search=search, cursor=cursor,
+            include=crud.parse_include(include), fields=selected
+        )
+    except (InvalidCursor, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    total = approximate_count(db, crud.query_products(db, category=category, search=search)) if with_total else None
+    if selected:
+        response = sparse_fields.sparse_response(products, schemas.Product, selected, summary=schemas.ProductSummary)
+    set_pagination_headers(response, next_cursor, prev_cursor, total)
+    return response if selected else products
 
 @app.get("/api/products/{product_id}", response_model=schemas.Product)
-async def get_product(
+def get_product(
     product_id: UUID,
+    request: Request,
+    response: Response,
+    include: Optional[str] = crud.DEFAULT_PRODUCT_INCLUDE,
     db: Session = Depends(get_db)
 ):
-    """Get a single product by ID"""
-    db_product = crud.get_product(db, product_id)
+    """
+    Get a single product by ID (`include`: images, stock_movements)
+    Conditional GETs (If-None-Match / If-Modified-Since) are answered with 304 from updated_at alone.
+    """
+    try:
+        expansions = crud.parse_include(include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    updated_at = http_cache.row_updated_at(db, models.Product, product_id)
+    if updated_at is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    etag = http_cache.make_etag("product", product_id, updated_at.isoformat(), *sorted(expansions))
+    not_modified = http_cache.conditional_response(request, response, etag, updated_at)
+    if not_modified:
+        return not_modified
+
+    db_product = crud.get_product(db, product_id, include=expansions)
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
     return db_product
 
 @app.patch("/api/products/{product_id}", response_model=schemas.Product)
-async def update_product(
+def update_product(
     product_id: UUID,
     product: schemas.ProductUpdate,
     db: Session = Depends(get_db)
 ):
     """Update a product"""
-    db_product = crud.update_product(db, product_id, product)
+    try:
+        db_product = crud.update_product(db, product_id, product)
+    except crud.DuplicateBarcode as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
     return db_product
 
 @app.delete("/api/products/{product_id}")
-async def delete_product(
+def delete_product(
     product_id: UUID,
     db: Session = Depends(get_db)
 ):
@@ -478,7 +591,7 @@ async def delete_product(
     return {"message": "Product deleted successfully"}
 
 @app.patch("/api/products/{product_id}/metadata")
-async def update_product_metadata(
+def update_product_metadata(
     product_id: UUID,
     metadata: dict,
     db: Session = Depends(get_db)
@@ -490,6 +603,7 @@ async def update_product_metadata(
     return db_product
 
 @app.post("/api/products/from-analysis", response_model=schemas.Product)
+@rate_limit_policy("analyze")  # Runs a vision analysis when the analysis cache has none for the image
 async def create_product_from_analysis(
     image_id: str,
     additional_data: Optional[dict] = None,
@@ -497,15 +611,14 @@ async def create_product_from_analysis(
 ):
     """Create a product from AI analysis results"""
     # Get the analysis data from uploaded images
-    if image_id not in uploaded_images:
+    image_info = await asyncio.to_thread(upload_registry.get, db, image_id)
+    if not image_info:
         raise HTTPException(status_code=404, detail="Image analysis not found")
     
-    image_info = uploaded_images[image_id]
-    
     # Analyze the image first if not already done
     try:
         # Re-analyze or get existing analysis
-        analysis = await analyze_image(image_id)
+        analysis = await analyze_image(image_id, db)
         
         # Create product from analysis
         product_data = schemas.ProductCreate(
@@ -527,45 +640,80 @@ async def create_product_from_analysis(
                 pass
         
         # Create the product
-        db_product = crud.create_product(db, product_data)
+        db_product = await asyncio.to_thread(crud.create_product, db, product_data)
         
         # Create product image record
+        try:
+            width_px, height_px = await asyncio.to_thread(read_image_size, image_info["path"])
+        except OSError:
+            width_px = height_px = None
         image_data = schemas.ProductImageCreate(
             product_id=db_product.id,
             filename=image_info["filename"],
             original_filename=image_info["original_filename"],
             file_path=image_info["path"],
             file_size=image_info["size"],
+            mime_type=guess_mime_type(Path(image_info["path"])),
+            width_px=width_px,
+            height_px=height_px,
             is_primary=True
         )
-        crud.create_product_image(db, image_data)
+        await asyncio.to_thread(crud.create_product_image, db, image_data)
         
-        return db_product
+        # Reload with its image off the event loop (the commits expired the instance)
+        return await asyncio.to_thread(crud.get_product, db, image_data.product_id)
         
+    except crud.DuplicateBarcode as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create product: {str(e)}")
 
 # Stock Movement Endpoints
 @app.post("/api/products/{product_id}/stock-movements", response_model=schemas.StockMovement)
-async def create_stock_movement(
+def create_stock_movement(
     product_id: UUID,
     movement: schemas.StockMovementBase,
+    response: Response,
     db: Session = Depends(get_db)
 ):
-    """Create a stock movement for a product"""
-    # Check if product exists
-    db_product = crud.get_product(db, product_id)
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
+    """
+    Create a stock movement for a product.
+    Retrying with the same reference_number returns the original movement
+    (marked with an Idempotent-Replayed header) instead of applying it twice.
+    """
     movement_data = schemas.StockMovementCreate(
         product_id=product_id,
         **movement.dict()
     )
-    return crud.create_stock_movement(db, movement_data)
+    try:
+        applied = crud.create_stock_movement(db, movement_data)
+    except StockMovementError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    
+    if applied.replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return {**applied.movement, "new_quantity": applied.new_quantity}
+
+@app.post("/api/stock-movements/bulk", response_model=schemas.StockMovementBulkResult)
+def create_stock_movements_bulk(
+    bulk: schemas.StockMovementBulkCreate,
+    db: Session = Depends(get_db)
+):
+    """
+    Record many stock movements (e.g. a stocktake) in one transaction.
+    Each row is reported as applied, replayed (known reference_number) or rejected;
+    rejected rows do not stop the rest of the batch.
+    """
+    results = apply_movements(db, bulk.movements)
+    return {
+        "applied": sum(1 for r in results if r["status"] == "applied"),
+        "replayed": sum(1 for r in results if r["status"] == "replayed"),
+        "rejected": sum(1 for r in results if r["status"] == "rejected"),
+        "results": results
+    }
 
 @app.get("/api/products/{product_id}/stock-movements", response_model=List[schemas.StockMovement])
-async def get_stock_movements(
+def get_stock_movements(
     product_id: UUID,
     skip: int = 0,
     limit: int = 50,
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark: serializing a page of products (GET /api/products)
+Runs FastAPI's response_model path for List[schemas.Product] on in-memory
+products (no database needed) and compares rendering with the standard
+JSONResponse against FastJSONResponse, plus the gzip/brotli cost of the body.
+
+    python bench_serialization.py --products 500 --rounds 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import List
+
+# models imports the database module, which only needs a URL to build its (lazy) engine
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+import compression
+import models
+import schemas
+from fast_json import FastJSONResponse
+
+
+def build_products(count: int) -> List[models.Product]:
+    """Transient products shaped like a typical catalog row, one image each"""
+    now = datetime.now(timezone.utc)
+    products = []
+    for n in range(count):
+        product = models.Product(
+            id=uuid.uuid4(), name=f"Akku-Bohrschrauber {n}", barcode=str(4006381333931 + n),
+            category="Werkzeug", stock_quantity=n % 40, min_stock=5, brand="Bosch", location=f"A{n % 12}",
+            condition="new", purchase_price=Decimal("89.90"), selling_price=Decimal("129.00"),
+            ai_data={"detected_objects": ["drill", "battery", "case"], "confidence": 0.94,
+                     "description": "18V cordless drill driver with two batteries and charger in a case"},
+            custom_fields={"color": "blue", "weight": "1.4 kg", "voltage": "18 V"},
+            created_at=now, updated_at=now
+        )
+        product.images = [models.ProductImage(
+            id=uuid.uuid4(), product_id=product.id, filename=f"{product.id}.jpg", original_filename="IMG_0001.jpg",
+            file_path=f"uploads/{product.id}.jpg", file_size=284113, mime_type="image/jpeg",
+            width_px=1568, height_px=1176, is_primary=True, created_at=now
+        )]
+        products.append(product)
+    return products
+
+
+def timed(function, rounds: int) -> float:
+    """Mean milliseconds per call"""
+    function()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Product page serialization benchmark")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    products = build_products(args.products)
+    field = create_model_field(name="Response_list_products", type_=List[schemas.Product], mode="serialization")
+
+    def response_model():
+        # What FastAPI does for a def route: validate from the ORM objects, then dump in JSON mode
+        return asyncio.run(serialize_response(field=field, response_content=products, is_coroutine=False))
+
+    content = response_model()
+    before = JSONResponse(content).body
+    after = FastJSONResponse(content).body
+    assert json.loads(before) == json.loads(after), "FastJSONResponse changed the response body"
+
+    validate_ms = timed(response_model, args.rounds)
+    render_before_ms = timed(lambda: JSONResponse(content), args.rounds)
+    render_after_ms = timed(lambda: FastJSONResponse(content), args.rounds)
+
+    print(f"{args.products} products, {len(before) / 1024:.0f} KiB JSON, mean of {args.rounds} rounds")
+    print(f"  response_model validation + dump  {validate_ms:8.2f} ms")
+    print(f"  render JSONResponse (json)        {render_before_ms:8.2f} ms   total {validate_ms + render_before_ms:8.2f} ms")
+    print(f"  render FastJSONResponse (orjson)  {render_after_ms:8.2f} ms   total {validate_ms + render_after_ms:8.2f} ms")
+
+    encodings = ["gzip"] + (["br"] if compression.brotli is not None else [])
+    for encoding in encodings:
+        def compress():
+            compress_chunk, _, finish = compression._compressor(encoding)
+            return compress_chunk(after) + finish()
+        size = len(compress())
+        print(f"  {encoding:<4} {size / 1024:6.0f} KiB ({size / len(after):.0%})  {timed(compress, args.rounds):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
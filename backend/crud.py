@@ -1,35 +1,124 @@
 """CRUD operations for database models"""
 
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import List, Optional
+from sqlalchemy.orm import Session, noload, selectinload
+from sqlalchemy import func, or_, select
+from sqlalchemy.exc import IntegrityError
+from typing import FrozenSet, List, Optional, Tuple
 from uuid import UUID
+from pagination import keyset_paginate
+import product_search
+import sparse_fields
+import stock_ledger
 import models
 import schemas
 
+# Product response expansions (?include=images,stock_movements)
+PRODUCT_EXPANSIONS = ("images", "stock_movements")
+DEFAULT_PRODUCT_INCLUDE = "images"
+# Movements per product with include=stock_movements
+RECENT_STOCK_MOVEMENTS = 5
+# Unique partial index on products.barcode (init.sql), the import upsert key
+BARCODE_CONSTRAINT = "idx_products_barcode"
+
+class DuplicateBarcode(ValueError):
+    """Another product already has this barcode (reported as 409 Conflict)"""
+
+def commit_product(db: Session):
+    """Commit product changes; raises DuplicateBarcode if the barcode is taken"""
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if BARCODE_CONSTRAINT in str(e.orig):
+            raise DuplicateBarcode("Product with this barcode already exists") from e
+        raise
+
+def parse_include(include: Optional[str]) -> FrozenSet[str]:
+    """'images,stock_movements' -> {'images', 'stock_movements'}; raises ValueError for unknown names"""
+    requested = frozenset(part.strip() for part in (include or "").split(",") if part.strip())
+    unknown = requested.difference(PRODUCT_EXPANSIONS)
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(sorted(unknown))}. Use: {', '.join(PRODUCT_EXPANSIONS)}")
+    return requested
+
+DEFAULT_EXPANSIONS = parse_include(DEFAULT_PRODUCT_INCLUDE)
+
+def product_load_options(include: FrozenSet[str]):
+    """
+    Loader options for product queries
+    Images come with one SELECT ... WHERE product_id IN (...) for all rows, or are
+    not loaded at all, so serializing a page never lazy-loads per product.
+    """
+    if "images" in include:
+        return [selectinload(models.Product.images)]
+    return [noload(models.Product.images)]
+
+def attach_recent_stock_movements(db: Session, products: List[models.Product],
+                                  limit: int = RECENT_STOCK_MOVEMENTS):
+    """Set `recent_stock_movements` on each product using one windowed query for all of them"""
+    if not products:
+        return products
+    ranked = select(
+        models.StockMovement.id,
+        func.row_number().over(
+            partition_by=models.StockMovement.product_id,
+            order_by=(models.StockMovement.created_at.desc(), models.StockMovement.id.desc())
+        ).label("position")
+    ).where(models.StockMovement.product_id.in_([product.id for product in products])).subquery()
+    movements = db.query(models.StockMovement)\
+        .join(ranked, ranked.c.id == models.StockMovement.id)\
+        .filter(ranked.c.position <= limit)\
+        .order_by(models.StockMovement.product_id, ranked.c.position)\
+        .all()
+
+    by_product = {product.id: [] for product in products}
+    for movement in movements:
+        by_product[movement.product_id].append(movement)
+    for product in products:
+        product.recent_stock_movements = by_product[product.id]
+    return products
+
+def expand_products(db: Session, products: List[models.Product], include: FrozenSet[str]):
+    """Load the expansions that are not loader options (run after the page query)"""
+    if "stock_movements" in include:
+        attach_recent_stock_movements(db, products)
+    return products
+
 # Product CRUD Operations
-def get_product(db: Session, product_id: UUID):
+def get_product(db: Session, product_id: UUID, include: FrozenSet[str] = DEFAULT_EXPANSIONS):
     """Get a single product by ID"""
-    return db.query(models.Product).filter(models.Product.id == product_id).first()
+    product = db.query(models.Product)\
+        .options(*product_load_options(include))\
+        .filter(models.Product.id == product_id)\
+        .first()
+    if product is not None:
+        expand_products(db, [product], include)
+    return product
 
 def get_product_by_barcode(db: Session, barcode: str):
     """Get a product by barcode"""
     return db.query(models.Product).filter(models.Product.barcode == barcode).first()
 
-def get_products(
-    db: Session, 
-    skip: int = 0, 
-    limit: int = 100,
+def query_products(
+    db: Session,
     category: Optional[str] = None,
     search: Optional[str] = None
 ):
-    """Get list of products with optional filtering"""
+    """Filtered (unordered, unpaginated) product query"""
     query = db.query(models.Product)
     
     if category:
         query = query.filter(models.Product.category == category)
     
     if search:
+        # Scanned barcode: exact btree match, the same fast path as /api/inventory/products/search
+        exact_filter = product_search.identifier_filter(models.Product, product_search.CORE_SEARCH, search)
+        if exact_filter is not None and db.query(query.filter(exact_filter).exists()).scalar():
+            return query.filter(exact_filter)
+        
+        # Otherwise deliberately a substring filter, not the ranked search: the list is keyset
+        # paginated newest first (no relevance order) and matches parts of words, which
+        # full-text search cannot. The trigram indexes in init.sql serve these ILIKEs.
         search_filter = f"%{search}%"
         query = query.filter(
             or_(
@@ -39,7 +128,30 @@ def get_products(
             )
         )
     
-    return query.offset(skip).limit(limit).all()
+    return query
+
+def get_products(
+    db: Session, 
+    skip: int = 0, 
+    limit: int = 100,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    include: FrozenSet[str] = DEFAULT_EXPANSIONS,
+    fields: Optional[Tuple[str, ...]] = None
+):
+    """
+    Get one page of products with optional filtering, newest first
+    `fields` (sparse fieldset) loads only those columns and replaces `include`.
+    Returns (products, next_cursor, prev_cursor)
+    """
+    if fields:
+        options, include = sparse_fields.load_options(models.Product, fields), sparse_fields.expansions(fields)
+    else:
+        options = product_load_options(include)
+    query = query_products(db, category=category, search=search).options(*options)
+    products, next_cursor, prev_cursor = keyset_paginate(query, models.Product, limit, cursor=cursor, skip=skip)
+    return expand_products(db, products, include), next_cursor, prev_cursor
 
 def create_product(db: Session, product: schemas.ProductCreate):
     """Create a new product"""
@@ -51,18 +163,18 @@ def create_product(db: Session, product: schemas.ProductCreate):
     
     db_product = models.Product(**product_data)
     db.add(db_product)
-    db.commit()
+    commit_product(db)
     db.refresh(db_product)
     return db_product
 
 def update_product(db: Session, product_id: UUID, product: schemas.ProductUpdate):
-    """Update an existing product"""
+    """Update an existing product; raises DuplicateBarcode if the new barcode is taken"""
     db_product = get_product(db, product_id)
     if db_product:
         update_data = product.dict(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_product, key, value)
-        db.commit()
+        commit_product(db)
         db.refresh(db_product)
     return db_product
 
@@ -97,23 +209,11 @@ def update_product_ai_data(db: Session, product_id: UUID, ai_data: dict):
 
 # Stock Movement CRUD Operations
 def create_stock_movement(db: Session, movement: schemas.StockMovementCreate):
-    """Create a stock movement and update product quantity"""
-    db_movement = models.StockMovement(**movement.dict())
-    db.add(db_movement)
-    
-    # Update product stock quantity
-    product = get_product(db, movement.product_id)
-    if product:
-        if movement.movement_type == "in" or movement.movement_type == "initial":
-            product.stock_quantity += movement.quantity
-        elif movement.movement_type == "out":
-            product.stock_quantity -= movement.quantity
-        elif movement.movement_type == "adjustment":
-            product.stock_quantity = movement.quantity
-    
-    db.commit()
-    db.refresh(db_movement)
-    return db_movement
+    """
+    Create a stock movement and update product quantity atomically
+    Raises stock_ledger.StockMovementError when the movement is rejected
+    """
+    return stock_ledger.apply_movement(db, **movement.dict())
 
 def get_stock_movements(db: Session, product_id: UUID, skip: int = 0, limit: int = 50):
     """Get stock movements for a product"""
@@ -144,10 +244,59 @@ def get_product_images(db: Session, product_id: UUID):
         .order_by(models.ProductImage.is_primary.desc(), models.ProductImage.created_at)\
         .all()
 
+def get_product_image(db: Session, image_id: UUID):
+    """Get a product image by ID"""
+    return db.query(models.ProductImage).filter(models.ProductImage.id == image_id).first()
+
+def update_product_image_size(db: Session, image_id: UUID, width_px: int, height_px: int):
+    """Record the pixel dimensions of a product image"""
+    db.query(models.ProductImage)\
+        .filter(models.ProductImage.id == image_id)\
+        .update({"width_px": width_px, "height_px": height_px})
+    db.commit()
+
+def get_product_ids_by_image_paths(db: Session, file_paths: List[str]):
+    """Map image file paths to the IDs of products using them"""
+    if not file_paths:
+        return {}
+    rows = db.query(models.ProductImage.file_path, models.ProductImage.product_id)\
+        .filter(models.ProductImage.file_path.in_(file_paths))\
+        .all()
+    products_by_path = {}
+    for file_path, product_id in rows:
+        products_by_path.setdefault(file_path, []).append(product_id)
+    return products_by_path
+
 def delete_product_image(db: Session, image_id: UUID):
     """Delete a product image"""
     db_image = db.query(models.ProductImage).filter(models.ProductImage.id == image_id).first()
     if db_image:
         db.delete(db_image)
         db.commit()
-    return db_image
\ No newline at end of file
+    return db_image
+
+# Uploaded Image CRUD Operations
+def create_uploaded_image(db: Session, upload: schemas.UploadedImageCreate):
+    """Register an uploaded file"""
+    db_upload = models.UploadedImage(**upload.dict())
+    db.add(db_upload)
+    db.commit()
+    db.refresh(db_upload)
+    return db_upload
+
+def get_uploaded_image(db: Session, image_id: UUID):
+    """Get an uploaded file by ID"""
+    return db.query(models.UploadedImage).filter(models.UploadedImage.id == image_id).first()
+
+def delete_uploaded_image(db: Session, image_id: UUID):
+    """Remove an uploaded file's record"""
+    db.query(models.UploadedImage).filter(models.UploadedImage.id == image_id).delete()
+    db.commit()
+
+# Analysis Job CRUD Operations
+def get_analysis_job(db: Session, job_id: UUID):
+    """Get an analysis job with its items"""
+    return db.query(models.AnalysisJob)\
+        .options(selectinload(models.AnalysisJob.items))\
+        .filter(models.AnalysisJob.id == job_id)\
+        .first()
\ No newline at end of file
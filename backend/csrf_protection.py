@@ -3,18 +3,28 @@ CSRF Protection for InventoScan API
 Implements token generation and validation to prevent Cross-Site Request Forgery attacks
 """
 
+import base64
+import hmac
 import secrets
 import hashlib
 import time
-from typing import Optional, Dict
+from typing import Optional
 from fastapi import HTTPException, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import json
 
+# Random per-browser id the tokens are bound to (HttpOnly, so scripts cannot read it)
+CSRF_SESSION_COOKIE = "csrf_session"
+CSRF_SESSION_LIFETIME = 30 * 24 * 3600
+
 class CSRFProtection:
     """
     CSRF Token Manager
     Generates and validates CSRF tokens for secure API operations
+    
+    Tokens are stateless: "<timestamp>.<nonce>.<signature>", where the signature is an
+    HMAC-SHA256 with the secret key over the session id, timestamp and nonce. Any worker
+    sharing the SECRET_KEY validates them without server storage, also after a restart.
     """
     
     def __init__(self, secret_key: str, token_lifetime: int = 3600):
@@ -25,62 +35,55 @@ class CSRFProtection:
             secret_key: Application secret for token generation
             token_lifetime: Token validity in seconds (default 1 hour)
         """
-        self.secret_key = secret_key
+        self.secret_key = secret_key.encode()
         self.token_lifetime = token_lifetime
-        self.tokens: Dict[str, float] = {}  # token -> timestamp
+    
+    @staticmethod
+    def new_session_id() -> str:
+        return secrets.token_urlsafe(16)
+    
+    def _sign(self, session_id: str, timestamp: str, nonce: str) -> str:
+        digest = hmac.new(self.secret_key, f"{session_id}.{timestamp}.{nonce}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode().rstrip("=")
         
-    def generate_token(self) -> str:
+    def generate_token(self, session_id: str) -> str:
         """
-        Generate a new CSRF token
+        Generate a new CSRF token for a session
         
         Returns:
-            Secure random token string
+            Signed token string
         """
-        # Generate 32 bytes of random data
-        token = secrets.token_urlsafe(32)
-        
-        # Store token with timestamp
-        self.tokens[token] = time.time()
-        
-        # Clean up old tokens
-        self._cleanup_expired_tokens()
-        
-        return token
+        timestamp = str(int(time.time()))
+        nonce = secrets.token_urlsafe(12)
+        return f"{timestamp}.{nonce}.{self._sign(session_id, timestamp, nonce)}"
     
-    def validate_token(self, token: str) -> bool:
+    def validate_token(self, token: str, session_id: Optional[str]) -> bool:
         """
-        Validate a CSRF token
+        Validate a CSRF token against the session it was issued to
         
         Args:
             token: Token to validate
+            session_id: Value of the CSRF session cookie
             
         Returns:
             True if valid, False otherwise
         """
-        if not token:
+        if not token or not session_id:
             return False
-            
-        # Check if token exists
-        if token not in self.tokens:
+        
+        try:
+            timestamp, nonce, signature = token.split(".")
+            issued_at = int(timestamp)
+        except ValueError:
             return False
-            
-        # Check if token is expired
-        token_age = time.time() - self.tokens[token]
-        if token_age > self.token_lifetime:
-            del self.tokens[token]
+        
+        # Check if token is expired (or from the future)
+        token_age = time.time() - issued_at
+        if token_age > self.token_lifetime or token_age < -60:
             return False
-            
-        return True
-    
-    def _cleanup_expired_tokens(self):
-        """Remove expired tokens from memory"""
-        current_time = time.time()
-        expired = [
-            token for token, timestamp in self.tokens.items()
-            if current_time - timestamp > self.token_lifetime
-        ]
-        for token in expired:
-            del self.tokens[token]
+        
+        # Constant-time comparison, so the signature cannot be guessed byte by byte
+        return hmac.compare_digest(signature, self._sign(session_id, timestamp, nonce))
 
 
 # Middleware for FastAPI
@@ -113,7 +116,7 @@ async def csrf_middleware(request: Request, call_next):
     # Get CSRF protection instance from app state
     csrf_protection = request.app.state.csrf_protection
     
-    if not csrf_protection.validate_token(csrf_token):
+    if not csrf_protection.validate_token(csrf_token, request.cookies.get(CSRF_SESSION_COOKIE)):
         raise HTTPException(
             status_code=403,
             detail="Invalid or expired CSRF token. Please request a new token."
@@ -134,14 +137,26 @@ def create_csrf_endpoint(csrf_protection: CSRFProtection):
     Returns:
         FastAPI route function
     """
-    async def get_csrf_token(response: Response):
+    async def get_csrf_token(request: Request, response: Response):
         """
         Get a new CSRF token
         
         Returns:
             JSON with CSRF token
         """
-        token = csrf_protection.generate_token()
+        session_id = request.cookies.get(CSRF_SESSION_COOKIE)
+        if not session_id:
+            session_id = csrf_protection.new_session_id()
+            response.set_cookie(
+                key=CSRF_SESSION_COOKIE,
+                value=session_id,
+                httponly=True,
+                secure=True,
+                samesite="strict",
+                max_age=CSRF_SESSION_LIFETIME
+            )
+        
+        token = csrf_protection.generate_token(session_id)
         
         # Also set as cookie for convenience
         response.set_cookie(
@@ -150,7 +165,7 @@ def create_csrf_endpoint(csrf_protection: CSRFProtection):
             httponly=False,  # Allow JS to read it
             secure=True,     # HTTPS only
             samesite="strict",  # Prevent CSRF
-            max_age=3600
+            max_age=csrf_protection.token_lifetime
         )
         
         return {
@@ -0,0 +1,32 @@
+"""
+Fast JSON responses for InventoScan
+FastJSONResponse renders with orjson instead of the standard library encoder.
+It is the app's default response class, so every route benefits, and it
+serializes UUID, datetime and Decimal itself, so hot paths can return raw
+values without a jsonable_encoder pass.
+"""
+
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def _default(value: Any) -> Any:
+    # Decimal as a string, like pydantic's JSON mode, so prices keep their exact value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON (UUID/datetime natively, Decimal as string)"""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
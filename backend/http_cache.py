@@ -0,0 +1,104 @@
+"""
+HTTP cache validators for InventoScan read endpoints
+Responses carry an ETag (and Last-Modified where a timestamp exists); a
+conditional GET whose validators still match is answered with 304 Not Modified
+after a cheap version check (a product's updated_at, or the trigger-maintained
+catalog_version row), before any full rows are loaded. Without a version to
+compare (no catalog_version row) responses carry no validators at all.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+
+from fastapi import Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+# Clients may keep catalog responses but must revalidate them before each use
+CATALOG_CACHE_CONTROL = "private, no-cache"
+# Responses that only change with a deployment
+STATIC_CACHE_CONTROL = "public, max-age=86400"
+
+VALIDATOR_HEADERS = ["ETag", "Last-Modified"]
+# Bodies may be compressed (CompressionMiddleware); a 304 must repeat the Vary of the full response
+VARY = "Accept-Encoding"
+
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag over the parts identifying one representation (weak: compression may vary)"""
+    digest = hashlib.blake2b("|".join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def _modified_since(if_modified_since: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have whole seconds
+    return last_modified.replace(microsecond=0) > since
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """If-None-Match wins; If-Modified-Since is only used when the client sent no ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        return not _modified_since(if_modified_since, last_modified)
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None,
+                      cache_control: str = CATALOG_CACHE_CONTROL) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": VARY}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def conditional_response(request: Request, response: Response, etag: str,
+                         last_modified: Optional[datetime] = None,
+                         cache_control: str = CATALOG_CACHE_CONTROL) -> Optional[Response]:
+    """
+    Set the validators on `response` and return a 304 response if the client's copy is current
+    The endpoint returns that 304 as is, or goes on to build its body when None.
+    """
+    headers = validator_headers(etag, last_modified, cache_control)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def catalog_version(db: Session, version_model) -> Optional[Tuple[int, Optional[datetime]]]:
+    """
+    (version, updated_at) of the catalog_version row
+    None if the row is missing: the database was not set up by init.sql or
+    migrations/upgrade_core_schema.sql, so no trigger keeps a version current.
+    """
+    row = db.execute(select(version_model.version, version_model.updated_at).where(version_model.id == 1)).first()
+    return (row[0], row[1]) if row else None
+
+
+def row_updated_at(db: Session, model, row_id: UUID) -> Optional[datetime]:
+    """Version of one row (primary key lookup); None if the row does not exist"""
+    return db.execute(
+        select(func.coalesce(model.updated_at, model.created_at)).where(model.id == row_id)
+    ).scalar()
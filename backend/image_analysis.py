@@ -0,0 +1,77 @@
+"""
+Image analysis pipeline for InventoScan
+Shared by the /api/analyze endpoint and the background job workers
+"""
+
+import asyncio
+import base64
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from analysis_cache import analysis_cache, file_sha256
+from image_processing import guess_mime_type, prepare_for_analysis, run_in_process_pool
+from perceptual_index import perceptual_index, PHASH_REUSE_DISTANCE
+from vision_client import UnparsedAnalysis, vision_client
+
+
+async def find_reusable_analysis(image_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Cached analysis of a near-identical earlier upload, if any"""
+    if not image_info.get("phash"):
+        return None
+    matches = await perceptual_index.find(image_info["phash"], PHASH_REUSE_DISTANCE, exclude=image_info["id"])
+    for match in matches:
+        if not match["sha256"]:
+            continue
+        analysis = await analysis_cache.get(match["sha256"])
+        if analysis is not None:
+            reused = dict(analysis)
+            reused["reused_from"] = match["image_id"]
+            return reused
+    return None
+
+
+async def analyze_upload(image_info: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """
+    Analyze an uploaded image (as returned by the upload registry)
+    Returns (analysis, cache_hit); raises VisionAPIError on upstream failures
+    """
+    image_path = Path(image_info["path"])
+
+    async def run_analysis():
+        # Another photo of the same item was analyzed already
+        reused = await find_reusable_analysis(image_info)
+        if reused is not None:
+            return reused
+
+        # Send a downscaled, metadata-free JPEG; fall back to the original if Pillow cannot read it
+        try:
+            send_path = Path(await run_in_process_pool(prepare_for_analysis, str(image_path)))
+            mime_type = "image/jpeg"
+        except (OSError, ValueError) as e:
+            print(f"Warning: preprocessing failed for {image_path.name}: {e}")
+            send_path = image_path
+            mime_type = guess_mime_type(image_path)
+
+        # Read and encode image without blocking the event loop
+        image_bytes = await asyncio.to_thread(send_path.read_bytes)
+        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        result = await vision_client.analyze_image(base64_image, mime_type)
+        result["analyzed_at"] = datetime.now().isoformat()
+        return result
+
+    # Identical image bytes are only ever sent to the model once
+    image_hash = image_info.get("sha256") or await asyncio.to_thread(file_sha256, image_path)
+    # A reply that could not be parsed is returned as is, but the next request asks the model again
+    cached_result, cache_hit = await analysis_cache.get_or_compute(
+        image_hash, run_analysis, cacheable=lambda result: not isinstance(result, UnparsedAnalysis)
+    )
+
+    # Add metadata
+    analysis_result = dict(cached_result)
+    analysis_result.update({
+        "image_id": image_info["id"],
+        "original_filename": image_info["original_filename"],
+        "cached": cache_hit
+    })
+    return analysis_result, cache_hit
@@ -0,0 +1,198 @@
+"""
+Image processing for InventoScan
+Pillow work (EXIF orientation, resizing, re-encoding) runs in a process pool
+so CPU-heavy decoding never blocks the event loop
+"""
+
+import asyncio
+import mimetypes
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+# Vision preprocessing settings (part of the analysis cache version)
+VISION_MAX_EDGE = int(os.getenv("VISION_MAX_EDGE", "1568"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Create the process pool on first use"""
+    global _process_pool
+    if _process_pool is None:
+        # spawn: forking a process that already runs threads is unsafe
+        _process_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def shutdown_process_pool():
+    """Stop pool processes (call on application shutdown)"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+async def run_in_process_pool(func, *args):
+    """Run a picklable function in the image process pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), func, *args)
+
+
+def guess_mime_type(path: Path) -> str:
+    return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+def to_rgb(img: Image.Image) -> Image.Image:
+    """Flatten transparency onto white and convert to RGB for JPEG output"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def save_atomic(img: Image.Image, dest: Path, format: str, **params):
+    """Save via a temp file so concurrent readers never see a partial image"""
+    tmp_path = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    img.save(tmp_path, format=format, **params)
+    os.replace(tmp_path, dest)
+
+
+def analysis_derivative_path(source: Path, max_edge: int = VISION_MAX_EDGE,
+                             quality: int = VISION_JPEG_QUALITY) -> Path:
+    """Location of the vision derivative, next to the original"""
+    return source.with_name(f"{source.stem}.analysis-{max_edge}q{quality}.jpg")
+
+
+def prepare_for_analysis(source_path: str, max_edge: int = VISION_MAX_EDGE,
+                         quality: int = VISION_JPEG_QUALITY) -> str:
+    """
+    Create (or reuse) a downscaled JPEG for the vision model
+    EXIF orientation is applied and all metadata is dropped. Runs in the process pool.
+    """
+    source = Path(source_path)
+    dest = analysis_derivative_path(source, max_edge, quality)
+    if dest.exists() and dest.stat().st_mtime >= source.stat().st_mtime:
+        return str(dest)
+
+    with Image.open(source) as img:
+        img.seek(0)  # First frame of animated GIF/WebP
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        img = to_rgb(img)
+        # No exif/icc arguments: the derivative carries no metadata
+        save_atomic(img, dest, "JPEG", quality=quality, optimize=True)
+
+    return str(dest)
+
+
+# ========== RESPONSIVE DERIVATIVES ==========
+
+# Longest edge in pixels per derivative size
+DERIVATIVE_SIZES = {
+    "thumb": int(os.getenv("DERIVATIVE_THUMB_EDGE", "320")),
+    "medium": int(os.getenv("DERIVATIVE_MEDIUM_EDGE", "1024")),
+}
+
+# format name -> (Pillow format, MIME type, save parameters)
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+DERIVATIVE_DIR_NAME = ".derivatives"
+
+
+def derivative_path(source: Path, size: str, format: str) -> Path:
+    """Location of a cached derivative (in a hidden folder beside the original)"""
+    return source.parent / DERIVATIVE_DIR_NAME / f"{source.stem}-{size}.{format}"
+
+
+def generate_derivative(source_path: str, size: str, format: str) -> Tuple[str, int, int]:
+    """
+    Create (or reuse) a resized copy of an image
+    Returns (derivative path, original width, original height); runs in the process pool
+    """
+    source = Path(source_path)
+    dest = derivative_path(source, size, format)
+    pil_format, _, params = DERIVATIVE_FORMATS[format]
+
+    with Image.open(source) as img:
+        width, height = oriented_size(img)
+        if dest.exists() and dest.stat().st_mtime >= source.stat().st_mtime:
+            return str(dest), width, height
+
+        img.seek(0)
+        img = ImageOps.exif_transpose(img)
+        edge = DERIVATIVE_SIZES[size]
+        img.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG":
+            img = to_rgb(img)
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+
+        dest.parent.mkdir(exist_ok=True)
+        save_atomic(img, dest, pil_format, **params)
+
+    return str(dest), width, height
+
+
+def generate_all_derivatives(source_path: str) -> Tuple[int, int]:
+    """Eagerly build every size/format of an image; returns the original dimensions"""
+    width = height = 0
+    for size in DERIVATIVE_SIZES:
+        for format in DERIVATIVE_FORMATS:
+            _, width, height = generate_derivative(source_path, size, format)
+    return width, height
+
+
+def oriented_size(img: Image.Image) -> Tuple[int, int]:
+    """Display size of an image, taking EXIF rotation into account"""
+    width, height = img.size
+    # Orientations 5-8 rotate by 90 degrees
+    if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def read_image_size(source_path: str) -> Tuple[int, int]:
+    """Read display dimensions from the image header (cheap, no full decode)"""
+    with Image.open(source_path) as img:
+        return oriented_size(img)
+
+
+# ========== PERCEPTUAL HASHING ==========
+
+def compute_dhash(source_path: str, hash_size: int = 8) -> str:
+    """
+    64-bit difference hash as 16 hex characters
+    Robust to resizing and re-compression; runs in the process pool
+    """
+    with Image.open(source_path) as img:
+        # Let the JPEG decoder scale down while decoding (much faster for 12MP photos)
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        img.seek(0)
+        img = ImageOps.exif_transpose(img).convert("L")
+        img = img.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+        pixels = list(img.getdata())
+
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
@@ -1,8 +1,11 @@
 -- InventoScan Database Schema
 -- Flexible product model with JSONB fields for extensibility
+-- Runs on an empty database only; upgrade existing ones with migrations/upgrade_core_schema.sql
 
 -- Enable UUID extension
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+-- Trigram indexes for substring (ILIKE) filters
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 -- Main products table
 CREATE TABLE IF NOT EXISTS products (
@@ -13,6 +16,7 @@ CREATE TABLE IF NOT EXISTS products (
   barcode VARCHAR(50),
   category VARCHAR(100),
   stock_quantity INTEGER DEFAULT 0 CHECK (stock_quantity >= 0),
+  min_stock INTEGER NOT NULL DEFAULT 0 CHECK (min_stock >= 0),  -- Low-stock alert threshold
   
   -- Optional standard fields
   brand VARCHAR(100),
@@ -31,11 +35,25 @@ CREATE TABLE IF NOT EXISTS products (
 );
 
 -- Indexes for better performance
-CREATE INDEX idx_products_barcode ON products(barcode) WHERE barcode IS NOT NULL;
+-- Barcodes are unique (natural key for imports)
+CREATE UNIQUE INDEX idx_products_barcode ON products(barcode) WHERE barcode IS NOT NULL;
 CREATE INDEX idx_products_category ON products(category);
 CREATE INDEX idx_products_name ON products(name);
 CREATE INDEX idx_products_metadata ON products USING GIN (metadata);
 CREATE INDEX idx_products_ai_data ON products USING GIN (ai_data);
+-- Keyset pagination order (newest first)
+CREATE INDEX idx_products_created_at_id ON products(created_at, id);
+-- Stock alerts (only low-stock rows are indexed)
+CREATE INDEX idx_products_low_stock ON products(stock_quantity) WHERE stock_quantity <= min_stock;
+
+-- Full text search index (keep in sync with product_search.CORE_SEARCH)
+CREATE INDEX idx_products_search ON products USING GIN (
+  to_tsvector('simple', COALESCE(name, '') || ' ' || COALESCE(brand, ''))
+);
+-- Serve the ILIKE '%term%' filters of the product listings
+CREATE INDEX idx_products_name_trgm ON products USING GIN (name gin_trgm_ops);
+CREATE INDEX idx_products_brand_trgm ON products USING GIN (brand gin_trgm_ops);
+CREATE INDEX idx_products_barcode_trgm ON products USING GIN (barcode gin_trgm_ops);
 
 -- Images table for product photos
 CREATE TABLE IF NOT EXISTS product_images (
@@ -46,6 +64,8 @@ CREATE TABLE IF NOT EXISTS product_images (
   file_path VARCHAR(500) NOT NULL,
   file_size INTEGER,
   mime_type VARCHAR(50),
+  width_px INTEGER,
+  height_px INTEGER,
   is_primary BOOLEAN DEFAULT FALSE,
   created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
@@ -67,6 +87,57 @@ CREATE TABLE IF NOT EXISTS stock_movements (
 
 CREATE INDEX idx_stock_movements_product_id ON stock_movements(product_id);
 CREATE INDEX idx_stock_movements_created_at ON stock_movements(created_at);
+-- Idempotency key for client retries (see stock_ledger)
+CREATE UNIQUE INDEX idx_stock_movements_reference ON stock_movements(product_id, reference_number)
+  WHERE reference_number IS NOT NULL;
+
+-- Registry of uploaded files (shared by all API workers)
+CREATE TABLE IF NOT EXISTS uploaded_images (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  filename VARCHAR(255) NOT NULL,
+  original_filename VARCHAR(255),
+  file_path VARCHAR(500) NOT NULL,
+  file_size INTEGER,
+  sha256 VARCHAR(64),
+  phash VARCHAR(16),
+  session_id VARCHAR(100),
+  product_group VARCHAR(100),
+  uploaded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_uploaded_images_sha256 ON uploaded_images(sha256);
+CREATE INDEX idx_uploaded_images_session_id ON uploaded_images(session_id);
+CREATE INDEX idx_uploaded_images_uploaded_at ON uploaded_images(uploaded_at);
+
+-- Background analysis jobs (one item per product group)
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  session_id VARCHAR(100),
+  status VARCHAR(20) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'completed', 'failed')),
+  total_items INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX idx_analysis_jobs_session_id ON analysis_jobs(session_id);
+
+CREATE TABLE IF NOT EXISTS analysis_job_items (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  job_id UUID REFERENCES analysis_jobs(id) ON DELETE CASCADE,
+  product_group VARCHAR(100),
+  image_id UUID NOT NULL,
+  status VARCHAR(20) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'completed', 'failed')),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  result JSONB,
+  error TEXT,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_analysis_job_items_job_id ON analysis_job_items(job_id);
+CREATE INDEX idx_analysis_job_items_claim ON analysis_job_items(status, next_attempt_at);
 
 -- Trigger to update the updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -80,6 +151,246 @@ $$ language 'plpgsql';
 CREATE TRIGGER update_products_updated_at BEFORE UPDATE
 ON products FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- ========== DASHBOARD STATISTICS ==========
+-- Catalog aggregates kept up to date by statement-level triggers on products,
+-- so the dashboard reads a few small rows instead of scanning the catalog.
+-- Stock movements change products.stock_quantity and are covered by the same triggers.
+-- Every aggregate is split into shards: a statement only updates the shard of
+-- its own backend, so concurrent writers do not queue on one hot row, and
+-- readers add the shards up (see api_inventory.get_dashboard_stats).
+
+-- Shard written by the current connection
+CREATE OR REPLACE FUNCTION inventory_stats_shard()
+RETURNS SMALLINT AS $$
+    SELECT (pg_backend_pid() % 16)::SMALLINT;
+$$ LANGUAGE sql STABLE;
+
+CREATE TABLE IF NOT EXISTS inventory_stats (
+  shard SMALLINT PRIMARY KEY,
+  total_products BIGINT NOT NULL DEFAULT 0,
+  total_value DECIMAL(16,2) NOT NULL DEFAULT 0,      -- SUM(stock_quantity * selling_price)
+  low_stock_items BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- A shard may go negative (product added through one shard, removed through another);
+-- only the sum over all shards is meaningful
+CREATE TABLE IF NOT EXISTS inventory_category_stats (
+  category VARCHAR(100) NOT NULL,
+  shard SMALLINT NOT NULL,
+  product_count BIGINT NOT NULL DEFAULT 0,
+  priced_count BIGINT NOT NULL DEFAULT 0,            -- Products with a selling price
+  total_value DECIMAL(16,2) NOT NULL DEFAULT 0,
+  PRIMARY KEY (category, shard)
+);
+
+CREATE TABLE IF NOT EXISTS inventory_location_stats (
+  location VARCHAR(50) NOT NULL,
+  shard SMALLINT NOT NULL,
+  product_count BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (location, shard)
+);
+
+-- Apply the rows a statement removed (sign -1) and added (sign +1) to this backend's shard
+CREATE OR REPLACE FUNCTION apply_inventory_stats_delta()
+RETURNS TRIGGER AS $$
+DECLARE
+    delta TEXT;
+    my_shard SMALLINT := inventory_stats_shard();
+BEGIN
+    delta := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT 1 AS sign, * FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT -1 AS sign, * FROM old_rows'
+        ELSE 'SELECT -1 AS sign, * FROM old_rows UNION ALL SELECT 1, * FROM new_rows'
+    END;
+
+    -- Updates that leave the aggregates unchanged (renames, notes, ...) do not touch the stats rows
+    EXECUTE format($sql$
+        WITH delta AS (%s)
+        INSERT INTO inventory_stats AS s (shard, total_products, total_value, low_stock_items)
+        SELECT $1, d.products, d.value, d.low_stock
+        FROM (
+            SELECT COALESCE(SUM(sign), 0) AS products,
+                   COALESCE(SUM(sign * stock_quantity * selling_price), 0) AS value,
+                   COALESCE(SUM(sign) FILTER (WHERE stock_quantity <= min_stock), 0) AS low_stock
+            FROM delta
+        ) d
+        WHERE (d.products, d.value, d.low_stock) <> (0, 0, 0)
+        ON CONFLICT (shard) DO UPDATE SET
+            total_products = s.total_products + EXCLUDED.total_products,
+            total_value = s.total_value + EXCLUDED.total_value,
+            low_stock_items = s.low_stock_items + EXCLUDED.low_stock_items,
+            updated_at = CURRENT_TIMESTAMP
+    $sql$, delta) USING my_shard;
+
+    -- ORDER BY keeps lock order stable between concurrent statements on the same shard
+    EXECUTE format($sql$
+        WITH delta AS (%s)
+        INSERT INTO inventory_category_stats AS c (category, shard, product_count, priced_count, total_value)
+        SELECT category, $1, SUM(sign),
+               COALESCE(SUM(sign) FILTER (WHERE selling_price IS NOT NULL), 0),
+               COALESCE(SUM(sign * stock_quantity * selling_price), 0)
+        FROM delta
+        WHERE category IS NOT NULL
+        GROUP BY category
+        HAVING SUM(sign) <> 0 OR COALESCE(SUM(sign * stock_quantity * selling_price), 0) <> 0
+            OR COALESCE(SUM(sign) FILTER (WHERE selling_price IS NOT NULL), 0) <> 0
+        ORDER BY category
+        ON CONFLICT (category, shard) DO UPDATE SET
+            product_count = c.product_count + EXCLUDED.product_count,
+            priced_count = c.priced_count + EXCLUDED.priced_count,
+            total_value = c.total_value + EXCLUDED.total_value
+    $sql$, delta) USING my_shard;
+
+    EXECUTE format($sql$
+        WITH delta AS (%s)
+        INSERT INTO inventory_location_stats AS l (location, shard, product_count)
+        SELECT location, $1, SUM(sign)
+        FROM delta
+        WHERE location IS NOT NULL
+        GROUP BY location
+        HAVING SUM(sign) <> 0
+        ORDER BY location
+        ON CONFLICT (location, shard) DO UPDATE SET
+            product_count = l.product_count + EXCLUDED.product_count
+    $sql$, delta) USING my_shard;
+
+    DELETE FROM inventory_category_stats
+    WHERE shard = my_shard AND product_count = 0 AND priced_count = 0 AND total_value = 0;
+    DELETE FROM inventory_location_stats WHERE shard = my_shard AND product_count = 0;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER products_stats_insert AFTER INSERT ON products
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION apply_inventory_stats_delta();
+
+CREATE TRIGGER products_stats_update AFTER UPDATE ON products
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION apply_inventory_stats_delta();
+
+CREATE TRIGGER products_stats_delete AFTER DELETE ON products
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION apply_inventory_stats_delta();
+
+-- Rebuild all aggregates from scratch into shard 0 (after restores, TRUNCATE or manual repairs)
+CREATE OR REPLACE FUNCTION refresh_inventory_stats()
+RETURNS VOID AS $$
+BEGIN
+    -- Block product writes so no delta is applied to a half-rebuilt state
+    LOCK TABLE products IN SHARE MODE;
+
+    DELETE FROM inventory_stats;
+    INSERT INTO inventory_stats (shard, total_products, total_value, low_stock_items)
+    SELECT 0, COUNT(*), COALESCE(SUM(stock_quantity * selling_price), 0),
+           COUNT(*) FILTER (WHERE stock_quantity <= min_stock)
+    FROM products;
+
+    DELETE FROM inventory_category_stats;
+    INSERT INTO inventory_category_stats (category, shard, product_count, priced_count, total_value)
+    SELECT category, 0, COUNT(*), COUNT(selling_price), COALESCE(SUM(stock_quantity * selling_price), 0)
+    FROM products WHERE category IS NOT NULL GROUP BY category;
+
+    DELETE FROM inventory_location_stats;
+    INSERT INTO inventory_location_stats (location, shard, product_count)
+    SELECT location, 0, COUNT(*)
+    FROM products WHERE location IS NOT NULL GROUP BY location;
+END;
+$$ language 'plpgsql';
+
+-- ========== HTTP CACHE VALIDATORS ==========
+-- The catalog-wide lists (categories, locations) take their ETag from a version
+-- counter, so a conditional GET is answered from this single row. Only
+-- statements that write a category or location move it: stock movements,
+-- price changes and image uploads never touch the row. Single products use
+-- their own updated_at, which image changes touch as well.
+
+CREATE TABLE IF NOT EXISTS catalog_version (
+  id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),  -- Single row
+  version BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version()
+RETURNS TRIGGER AS $$
+DECLARE
+    listed_values_changed BOOLEAN;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT EXISTS (SELECT 1 FROM new_rows WHERE category IS NOT NULL OR location IS NOT NULL)
+        INTO listed_values_changed;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT EXISTS (SELECT 1 FROM old_rows WHERE category IS NOT NULL OR location IS NOT NULL)
+        INTO listed_values_changed;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT EXISTS (
+            SELECT 1 FROM old_rows o JOIN new_rows n USING (id)
+            WHERE o.category IS DISTINCT FROM n.category OR o.location IS DISTINCT FROM n.location
+        ) INTO listed_values_changed;
+    ELSE  -- TRUNCATE
+        listed_values_changed := TRUE;
+    END IF;
+
+    IF listed_values_changed THEN
+        -- clock_timestamp(): Last-Modified must not go back when an older transaction commits later
+        UPDATE catalog_version SET
+            version = version + 1,
+            updated_at = GREATEST(updated_at, clock_timestamp())
+        WHERE id = 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER products_catalog_version_insert AFTER INSERT ON products
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+CREATE TRIGGER products_catalog_version_update AFTER UPDATE ON products
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+CREATE TRIGGER products_catalog_version_delete AFTER DELETE ON products
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+CREATE TRIGGER products_catalog_version_truncate AFTER TRUNCATE ON products
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+-- Images are part of a product's representation, so their changes move the product's updated_at
+-- (one UPDATE per statement for all affected products)
+CREATE OR REPLACE FUNCTION touch_product_on_image_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE products SET updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (SELECT product_id FROM new_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE products SET updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (SELECT product_id FROM old_rows);
+    ELSE
+        UPDATE products SET updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (SELECT product_id FROM old_rows UNION SELECT product_id FROM new_rows);
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER product_images_touch_product_insert AFTER INSERT ON product_images
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION touch_product_on_image_change();
+
+CREATE TRIGGER product_images_touch_product_update AFTER UPDATE ON product_images
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION touch_product_on_image_change();
+
+CREATE TRIGGER product_images_touch_product_delete AFTER DELETE ON product_images
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION touch_product_on_image_change();
+
 -- Sample data for testing (optional)
 INSERT INTO products (name, barcode, category, stock_quantity, brand, metadata, ai_data)
 VALUES 
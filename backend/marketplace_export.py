@@ -0,0 +1,329 @@
+"""
+Marketplace feed export for InventoScan
+Each feed format selects only the product columns it needs and turns the
+result tuples straight into CSV/TSV rows, so exporting the whole catalog never
+hydrates ORM objects or reads the large JSONB/HTML columns the feeds ignore.
+Delta feeds carry only the products changed or deleted since each
+marketplace's watermark, with the action (new, changed, withdrawn) taken from
+what earlier feeds listed there.
+"""
+
+import csv
+import io
+import os
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+# Rows fetched per round trip and bytes buffered per streamed chunk
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", str(64 * 1024)))
+
+# Re-scanned window before a delta feed's watermark, see DeltaWindow.scan_from
+DELTA_FEED_OVERLAP = timedelta(seconds=int(os.getenv("DELTA_FEED_OVERLAP_SECONDS", "300")))
+
+# Products with this status are listed; delta feeds withdraw the others
+LISTED_STATUS = "active"
+
+AMAZON_BULLET_POINTS = 5
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    """
+    One marketplace feed layout
+    `format_row` receives a tuple of `columns` (in that order) and returns the
+    values for `fieldnames`; binding positions up front keeps the per-row cost
+    to a tuple unpack.
+    """
+    name: str
+    columns: Tuple[str, ...]
+    fieldnames: Tuple[str, ...]
+    format_row: Callable[[Sequence[Any]], Sequence[Any]]
+    # Delta feeds: leading action column with its (new, changed, withdrawn) values,
+    # and the row identifying a withdrawn product from TOMBSTONE_COLUMNS
+    action_field: str
+    actions: Tuple[str, str, str]
+    format_deleted: Callable[[Sequence[Any]], Sequence[Any]]
+
+    def as_dict(self, product) -> dict:
+        """Feed row of a loaded product (single-product exports)"""
+        values = tuple(getattr(product, name) for name in self.columns)
+        return dict(zip(self.fieldnames, self.format_row(values)))
+
+
+# Identity of a withdrawn product, as kept in product_tombstones
+TOMBSTONE_COLUMNS = ("sku", "ean", "upc", "mpn", "title")
+
+
+def _ebay_row(row):
+    (title, brand, mpn, ean, price_ebay, price_regular, stock_quantity,
+     description_html, description_short, category_ebay, condition, specifications) = row
+    return (
+        title[:80],  # eBay title limit
+        brand,
+        mpn,
+        ean,
+        float(price_ebay or price_regular or 0),
+        stock_quantity,
+        description_html or description_short,
+        category_ebay,
+        '1000' if condition == 'new' else '3000',
+        specifications
+    )
+
+
+def _amazon_row(row):
+    (sku, ean, upc, title, brand, manufacturer, mpn, price_amazon, price_regular,
+     stock_quantity, description_short, bullet_points) = row
+    bullets = list(bullet_points[:AMAZON_BULLET_POINTS]) if bullet_points else []
+    bullets += [''] * (AMAZON_BULLET_POINTS - len(bullets))
+    return (
+        sku,
+        ean or upc,
+        'EAN' if ean else 'UPC',
+        title[:200],  # Amazon title limit
+        brand,
+        manufacturer or brand,
+        mpn,
+        float(price_amazon or price_regular or 0),
+        stock_quantity,
+        description_short[:2000] if description_short else '',
+        *bullets
+    )
+
+
+def _ebay_deleted(row):
+    sku, ean, upc, mpn, title = row
+    return (title[:80], None, mpn, ean) + (None,) * 6
+
+
+def _amazon_deleted(row):
+    sku, ean, upc, mpn, title = row
+    return (sku, ean or upc, 'EAN' if ean else 'UPC') + (None,) * (7 + AMAZON_BULLET_POINTS)
+
+
+EBAY_EXPORT = ExportFormat(
+    name="ebay",
+    columns=("title", "brand", "mpn", "ean", "price_ebay", "price_regular", "stock_quantity",
+             "description_html", "description_short", "category_ebay", "condition", "specifications"),
+    fieldnames=("Title", "Brand", "MPN", "EAN", "StartPrice", "Quantity", "Description",
+                "PrimaryCategory", "ConditionID", "ItemSpecifics"),
+    format_row=_ebay_row,
+    action_field="Action",
+    actions=("Add", "Revise", "End"),
+    format_deleted=_ebay_deleted
+)
+
+AMAZON_EXPORT = ExportFormat(
+    name="amazon",
+    columns=("sku", "ean", "upc", "title", "brand", "manufacturer", "mpn", "price_amazon", "price_regular",
+             "stock_quantity", "description_short", "bullet_points"),
+    fieldnames=("sku", "product-id", "product-id-type", "item-name", "brand", "manufacturer", "part-number",
+                "standard-price", "quantity", "product-description",
+                *(f"bullet-point{n}" for n in range(1, AMAZON_BULLET_POINTS + 1))),
+    format_row=_amazon_row,
+    action_field="update-delete",
+    actions=("Update", "Update", "Delete"),
+    format_deleted=_amazon_deleted
+)
+
+EXPORT_FORMATS = {export_format.name: export_format for export_format in (EBAY_EXPORT, AMAZON_EXPORT)}
+
+
+def export_statement(model, export_format: ExportFormat, status: Optional[str] = None,
+                     limit: Optional[int] = None):
+    """SELECT of just the feed's columns"""
+    statement = select(*(getattr(model, name) for name in export_format.columns))
+    if status:
+        statement = statement.where(model.status == status)
+    if limit:
+        statement = statement.limit(limit)
+    return statement
+
+
+def _write_feed(fieldnames: Sequence[str], batches: Iterable[Iterable[Sequence[Any]]],
+                delimiter: str, compress: bool) -> Iterator[bytes]:
+    """Encode batches of rows as CSV/TSV in chunks of about EXPORT_CHUNK_SIZE bytes"""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+    writer.writerow(fieldnames)
+
+    for rows in batches:
+        writer.writerows(rows)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            chunk = buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+
+    chunk = buffer.getvalue().encode("utf-8")
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def stream_export(db: Session, model, export_format: ExportFormat, status: Optional[str] = None,
+                  limit: Optional[int] = None, delimiter: str = ",", compress: bool = False) -> Iterator[bytes]:
+    """
+    Yield the feed file in chunks, reading rows through a server-side cursor
+    compress=True yields a gzip stream. The session is closed once the feed is exhausted.
+    """
+    try:
+        result = db.execute(
+            export_statement(model, export_format, status, limit).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        format_row = export_format.format_row
+        yield from _write_feed(
+            export_format.fieldnames,
+            (map(format_row, rows) for rows in result.partitions()),
+            delimiter, compress
+        )
+    finally:
+        db.close()
+
+
+# ========== DELTA FEEDS ==========
+
+@dataclass(frozen=True)
+class DeltaWindow:
+    """
+    Changes a delta feed covers: after `since` (None: full snapshot) up to `until`
+    `until` is the database clock when the feed started and becomes the next watermark.
+    """
+    marketplace: str
+    since: Optional[datetime]
+    until: datetime
+
+    @property
+    def scan_from(self) -> Optional[datetime]:
+        # updated_at is the writing transaction's start time, so a change committed
+        # just after the previous feed can carry an older timestamp. Re-scanning a
+        # short overlap picks it up; the action of a re-sent product still comes
+        # from the listing record, so it is never listed twice.
+        return self.since - DELTA_FEED_OVERLAP if self.since else None
+
+
+def delta_window(db: Session, watermark_model, marketplace: str, since: Optional[datetime] = None) -> DeltaWindow:
+    """Window from the marketplace's stored watermark, or from an explicit `since`"""
+    until = db.execute(select(func.now())).scalar()
+    if since is None:
+        since = db.execute(
+            select(watermark_model.exported_until).where(watermark_model.marketplace == marketplace)
+        ).scalar()
+    return DeltaWindow(marketplace=marketplace, since=since, until=until)
+
+
+def advance_watermark(db: Session, watermark_model, tombstone_model, window: DeltaWindow):
+    """Store `window.until` as the marketplace's watermark and prune tombstones every feed has seen"""
+    statement = pg_insert(watermark_model).values(marketplace=window.marketplace, exported_until=window.until)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[watermark_model.marketplace],
+        # Never moves back when feeds of one marketplace overlap
+        set_={"exported_until": func.greatest(watermark_model.exported_until, statement.excluded.exported_until),
+              "updated_at": func.now()}
+    ))
+    oldest = select(func.min(watermark_model.exported_until)).scalar_subquery()
+    db.execute(delete(tombstone_model).where(tombstone_model.deleted_at < oldest - DELTA_FEED_OVERLAP))
+    db.commit()
+
+
+def stream_delta_export(db: Session, model, tombstone_model, watermark_model, listing_model,
+                        export_format: ExportFormat, window: DeltaWindow, advance: bool = True,
+                        delimiter: str = ",", compress: bool = False) -> Iterator[bytes]:
+    """
+    Yield a feed of the products changed or deleted within `window`
+    Each row starts with the format's action, taken from the marketplace's listing
+    record (`listing_model`): a LISTED_STATUS product that is not listed yet is new,
+    a listed one is changed, and a listed product that was deleted or left
+    LISTED_STATUS is withdrawn. Products never listed and not LISTED_STATUS are
+    left out. Without a `since` the feed covers every listed or listable product.
+    With advance=True the listing record and the watermark are committed together
+    once the whole feed was sent. The session is closed once the feed is exhausted.
+    """
+    new_action, changed_action, deleted_action = export_format.actions
+    format_row = export_format.format_row
+    format_deleted = export_format.format_deleted
+    marketplace = window.marketplace
+    scan_from = window.scan_from
+    width = len(export_format.columns)
+
+    listed = select(listing_model.product_id).where(
+        listing_model.marketplace == marketplace,
+        listing_model.product_id == model.id
+    ).exists()
+
+    def record(added, withdrawn):
+        # Part of the feed's transaction: only kept if the watermark advances as well
+        if not advance:
+            return
+        if added:
+            db.execute(pg_insert(listing_model).values(
+                [{"marketplace": marketplace, "product_id": product_id} for product_id in added]
+            ).on_conflict_do_nothing())
+        if withdrawn:
+            db.execute(delete(listing_model).where(
+                listing_model.marketplace == marketplace,
+                listing_model.product_id.in_(withdrawn)
+            ))
+
+    def product_rows(rows):
+        feed_rows, added, withdrawn = [], [], []
+        for row in rows:
+            product_id, status, is_listed = row[width], row[width + 1], row[width + 2]
+            if status == LISTED_STATUS:
+                if is_listed:
+                    feed_rows.append((changed_action, *format_row(row[:width])))
+                else:
+                    feed_rows.append((new_action, *format_row(row[:width])))
+                    added.append(product_id)
+            elif is_listed:
+                feed_rows.append((deleted_action, *format_deleted(row[width + 3:])))
+                withdrawn.append(product_id)
+        record(added, withdrawn)
+        return feed_rows
+
+    def deleted_rows(rows):
+        record([], [row[-1] for row in rows])
+        return [(deleted_action, *format_deleted(row[:-1])) for row in rows]
+
+    def batches():
+        statement = select(
+            *(getattr(model, name) for name in export_format.columns),
+            model.id, model.status, listed,
+            *(getattr(model, name) for name in TOMBSTONE_COLUMNS)
+        )
+        if scan_from is None:
+            statement = statement.where(or_(model.status == LISTED_STATUS, listed))
+        else:
+            statement = statement.where(model.updated_at > scan_from)
+        for rows in db.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE)).partitions():
+            yield product_rows(rows)
+
+        # Every deleted product still listed here, however long ago it was deleted
+        tombstones = select(
+            *(getattr(tombstone_model, name) for name in TOMBSTONE_COLUMNS),
+            tombstone_model.product_id
+        ).join(listing_model, and_(
+            listing_model.marketplace == marketplace,
+            listing_model.product_id == tombstone_model.product_id
+        ))
+        for rows in db.execute(tombstones.execution_options(yield_per=EXPORT_BATCH_SIZE)).partitions():
+            yield deleted_rows(rows)
+
+    try:
+        yield from _write_feed((export_format.action_field, *export_format.fieldnames),
+                               batches(), delimiter, compress)
+        if advance:
+            advance_watermark(db, watermark_model, tombstone_model, window)
+    finally:
+        db.close()
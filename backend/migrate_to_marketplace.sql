@@ -124,14 +124,21 @@ CREATE INDEX idx_products_category_ebay ON products(category_ebay);
 CREATE INDEX idx_products_category_amazon ON products(category_amazon);
 CREATE INDEX idx_products_specifications ON products USING GIN (specifications);
 CREATE INDEX idx_products_attributes ON products USING GIN (attributes);
+-- Delta feeds scan products changed since a watermark
+CREATE INDEX idx_products_updated_at ON products(updated_at);
 
 -- Full text search index
+-- array_to_string is only STABLE and index expressions must be IMMUTABLE
+CREATE OR REPLACE FUNCTION immutable_array_to_string(text[], text) RETURNS text
+  LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT array_to_string($1, $2) $$;
+
+-- Keep in sync with product_search.MARKETPLACE_SEARCH
 CREATE INDEX idx_products_search ON products USING GIN (
   to_tsvector('english', 
     COALESCE(title, '') || ' ' || 
     COALESCE(brand, '') || ' ' || 
     COALESCE(description_short, '') || ' ' ||
-    COALESCE(array_to_string(bullet_points, ' '), '')
+    COALESCE(immutable_array_to_string(bullet_points, ' '), '')
   )
 );
 
@@ -201,6 +208,51 @@ $$ language 'plpgsql';
 CREATE TRIGGER update_products_updated_at BEFORE UPDATE
 ON products FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Delta feeds (marketplace_export.stream_delta_export)
+-- Deleted products leave a tombstone so the next delta feed withdraws their listings
+CREATE TABLE IF NOT EXISTS product_tombstones (
+  product_id UUID PRIMARY KEY,
+  sku VARCHAR(100),
+  ean VARCHAR(13),
+  upc VARCHAR(12),
+  mpn VARCHAR(100),
+  title VARCHAR(200),
+  deleted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_product_tombstones_deleted_at ON product_tombstones(deleted_at);
+
+-- Per marketplace: changes up to this point have been exported
+CREATE TABLE IF NOT EXISTS feed_watermarks (
+  marketplace VARCHAR(50) PRIMARY KEY,
+  exported_until TIMESTAMP WITH TIME ZONE NOT NULL,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Per marketplace: products a feed has listed (sent as new) and not withdrawn since.
+-- No foreign key, a deleted product stays listed until a feed withdraws it.
+CREATE TABLE IF NOT EXISTS marketplace_listings (
+  marketplace VARCHAR(50) NOT NULL,
+  product_id UUID NOT NULL,
+  listed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (marketplace, product_id)
+);
+
+CREATE OR REPLACE FUNCTION record_product_tombstones()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO product_tombstones (product_id, sku, ean, upc, mpn, title)
+    SELECT id, sku, ean, upc, mpn, title FROM deleted_products
+    ON CONFLICT (product_id) DO UPDATE SET deleted_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+-- Statement level: a bulk delete records all its tombstones with one INSERT
+CREATE TRIGGER record_products_tombstones AFTER DELETE
+ON products REFERENCING OLD TABLE AS deleted_products
+FOR EACH STATEMENT EXECUTE FUNCTION record_product_tombstones();
+
 -- Sample marketplace-ready product
 INSERT INTO products (
   ean, mpn, sku, title, brand, model,
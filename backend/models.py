@@ -1,9 +1,9 @@
 """SQLAlchemy models for InventoScan"""
 
-from sqlalchemy import Column, String, Integer, Numeric, DateTime, Boolean, ForeignKey, Text, CheckConstraint
+from sqlalchemy import Column, String, Integer, SmallInteger, BigInteger, Numeric, DateTime, Boolean, ForeignKey, Text, CheckConstraint, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 import uuid
 from database import Base
 
@@ -15,9 +15,10 @@ class Product(Base):
     
     # Core required fields
     name = Column(String(255), nullable=False)
-    barcode = Column(String(50), index=True)
+    barcode = Column(String(50))
     category = Column(String(100), index=True)
     stock_quantity = Column(Integer, default=0, nullable=False)
+    min_stock = Column(Integer, default=0, nullable=False)  # Low-stock alert threshold
     
     # Optional standard fields
     brand = Column(String(100))
@@ -41,10 +42,15 @@ class Product(Base):
     # Constraints
     __table_args__ = (
         CheckConstraint('stock_quantity >= 0', name='check_stock_quantity_positive'),
+        CheckConstraint('min_stock >= 0', name='check_min_stock_positive'),
         CheckConstraint("condition IN ('new', 'used', 'refurbished', 'damaged') OR condition IS NULL", 
                        name='check_valid_condition'),
         CheckConstraint('purchase_price >= 0 OR purchase_price IS NULL', name='check_purchase_price_positive'),
         CheckConstraint('selling_price >= 0 OR selling_price IS NULL', name='check_selling_price_positive'),
+        # Keyset pagination order
+        Index('idx_products_created_at_id', 'created_at', 'id'),
+        # Natural key for imports (ON CONFLICT target)
+        Index('idx_products_barcode', 'barcode', unique=True, postgresql_where=text('barcode IS NOT NULL')),
     )
 
 
@@ -58,6 +64,8 @@ class ProductImage(Base):
     file_path = Column(String(500), nullable=False)
     file_size = Column(Integer)
     mime_type = Column(String(50))
+    width_px = Column(Integer)
+    height_px = Column(Integer)
     is_primary = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -85,4 +93,130 @@ class StockMovement(Base):
     __table_args__ = (
         CheckConstraint("movement_type IN ('in', 'out', 'adjustment', 'initial')", 
                        name='check_valid_movement_type'),
-    )
\ No newline at end of file
+        # Idempotency key for client retries (see stock_ledger)
+        Index('idx_stock_movements_reference', 'product_id', 'reference_number', unique=True,
+              postgresql_where=text('reference_number IS NOT NULL')),
+    )
+
+
+class UploadedImage(Base):
+    """Registry of uploaded files, shared by all workers (replaces the in-process dict)"""
+    __tablename__ = "uploaded_images"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    filename = Column(String(255), nullable=False)
+    original_filename = Column(String(255))
+    file_path = Column(String(500), nullable=False)
+    file_size = Column(Integer)
+    sha256 = Column(String(64), index=True)  # Content hash computed while streaming
+    phash = Column(String(16))  # Perceptual difference hash (64-bit hex) for near-duplicate lookup
+    session_id = Column(String(100), index=True)
+    product_group = Column(String(100))
+    uploaded_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    
+    def to_dict(self):
+        """Convert to the image info format returned by the upload endpoints"""
+        info = {
+            "id": str(self.id),
+            "filename": self.filename,
+            "original_filename": self.original_filename,
+            "path": self.file_path,
+            "size": self.file_size,
+            "sha256": self.sha256,
+            "phash": self.phash,
+            "uploaded_at": self.uploaded_at.isoformat() if self.uploaded_at else None
+        }
+        if self.session_id is not None:
+            info["session_id"] = self.session_id
+            info["product_group"] = self.product_group
+        return info
+
+
+class AnalysisJob(Base):
+    """Batch of background image analyses (one item per product group)"""
+    __tablename__ = "analysis_jobs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    session_id = Column(String(100), index=True)
+    status = Column(String(20), default='queued', nullable=False)  # queued, running, completed, failed
+    total_items = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True))
+    
+    # Relationships
+    items = relationship("AnalysisJobItem", back_populates="job", cascade="all, delete-orphan",
+                         order_by="AnalysisJobItem.created_at")
+    
+    # Constraints
+    __table_args__ = (
+        CheckConstraint("status IN ('queued', 'running', 'completed', 'failed')",
+                       name='check_valid_job_status'),
+    )
+
+
+class AnalysisJobItem(Base):
+    """Single analysis within a job; claimed by workers with SELECT ... FOR UPDATE SKIP LOCKED"""
+    __tablename__ = "analysis_job_items"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    job_id = Column(UUID(as_uuid=True), ForeignKey("analysis_jobs.id", ondelete="CASCADE"), index=True)
+    product_group = Column(String(100))
+    image_id = Column(UUID(as_uuid=True), nullable=False)
+    status = Column(String(20), default='queued', nullable=False)  # queued, running, completed, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now())
+    result = Column(JSONB)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    # Relationships
+    job = relationship("AnalysisJob", back_populates="items")
+    
+    # Constraints
+    __table_args__ = (
+        CheckConstraint("status IN ('queued', 'running', 'completed', 'failed')",
+                       name='check_valid_job_item_status'),
+        Index('idx_analysis_job_items_claim', 'status', 'next_attempt_at'),
+    )
+
+
+class InventoryStats(Base):
+    """Catalog-wide dashboard aggregates, one row per shard (maintained by triggers in init.sql)"""
+    __tablename__ = "inventory_stats"
+    
+    shard = Column(SmallInteger, primary_key=True)
+    total_products = Column(BigInteger, default=0, nullable=False)
+    total_value = Column(Numeric(16, 2), default=0, nullable=False)
+    low_stock_items = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class InventoryCategoryStats(Base):
+    """Per-category dashboard aggregates, one row per shard (maintained by triggers in init.sql)"""
+    __tablename__ = "inventory_category_stats"
+    
+    category = Column(String(100), primary_key=True)
+    shard = Column(SmallInteger, primary_key=True)
+    product_count = Column(BigInteger, default=0, nullable=False)
+    priced_count = Column(BigInteger, default=0, nullable=False)
+    total_value = Column(Numeric(16, 2), default=0, nullable=False)
+
+
+class InventoryLocationStats(Base):
+    """Per-location product counts, one row per shard (maintained by triggers in init.sql)"""
+    __tablename__ = "inventory_location_stats"
+    
+    location = Column(String(50), primary_key=True)
+    shard = Column(SmallInteger, primary_key=True)
+    product_count = Column(BigInteger, default=0, nullable=False)
+
+
+class CatalogVersion(Base):
+    """Version of the category/location lists for HTTP cache validators (single row, bumped by triggers in init.sql)"""
+    __tablename__ = "catalog_version"
+    
+    id = Column(Integer, primary_key=True, default=1)
+    version = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -2,13 +2,14 @@
 
 from sqlalchemy import (
     Column, String, Integer, Numeric, DateTime, Boolean, 
-    ForeignKey, Text, CheckConstraint, Date, ARRAY
+    ForeignKey, Text, CheckConstraint, Date, ARRAY, Index
 )
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import uuid
 from database import Base
+from marketplace_export import AMAZON_EXPORT, EBAY_EXPORT
 
 class Product(Base):
     __tablename__ = "products"
@@ -130,42 +131,17 @@ class Product(Base):
                        name='check_valid_condition'),
         CheckConstraint("status IN ('draft', 'active', 'inactive', 'out_of_stock')",
                        name='check_valid_status'),
+        # Delta feed watermark scans
+        Index('idx_products_updated_at', 'updated_at'),
     )
     
     def to_ebay_format(self):
         """Convert product to eBay listing format"""
-        return {
-            'Title': self.title[:80],  # eBay title limit
-            'Brand': self.brand,
-            'MPN': self.mpn,
-            'EAN': self.ean,
-            'StartPrice': float(self.price_ebay or self.price_regular or 0),
-            'Quantity': self.stock_quantity,
-            'Description': self.description_html or self.description_short,
-            'PrimaryCategory': self.category_ebay,
-            'ConditionID': '1000' if self.condition == 'new' else '3000',
-            'ItemSpecifics': self.specifications
-        }
+        return EBAY_EXPORT.as_dict(self)
     
     def to_amazon_format(self):
         """Convert product to Amazon listing format"""
-        return {
-            'sku': self.sku,
-            'product-id': self.ean or self.upc,
-            'product-id-type': 'EAN' if self.ean else 'UPC',
-            'item-name': self.title[:200],  # Amazon title limit
-            'brand': self.brand,
-            'manufacturer': self.manufacturer or self.brand,
-            'part-number': self.mpn,
-            'standard-price': float(self.price_amazon or self.price_regular or 0),
-            'quantity': self.stock_quantity,
-            'product-description': self.description_short[:2000] if self.description_short else '',
-            'bullet-point1': self.bullet_points[0] if self.bullet_points and len(self.bullet_points) > 0 else '',
-            'bullet-point2': self.bullet_points[1] if self.bullet_points and len(self.bullet_points) > 1 else '',
-            'bullet-point3': self.bullet_points[2] if self.bullet_points and len(self.bullet_points) > 2 else '',
-            'bullet-point4': self.bullet_points[3] if self.bullet_points and len(self.bullet_points) > 3 else '',
-            'bullet-point5': self.bullet_points[4] if self.bullet_points and len(self.bullet_points) > 4 else '',
-        }
+        return AMAZON_EXPORT.as_dict(self)
 
 
 class ProductImage(Base):
@@ -222,4 +198,34 @@ class ListingHistory(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
-    product = relationship("Product", back_populates="listing_history")
\ No newline at end of file
+    product = relationship("Product", back_populates="listing_history")
+
+class ProductTombstone(Base):
+    """Deleted products, recorded by trigger so delta feeds can withdraw them"""
+    __tablename__ = "product_tombstones"
+    
+    product_id = Column(UUID(as_uuid=True), primary_key=True)
+    sku = Column(String(50))
+    ean = Column(String(13))
+    upc = Column(String(12))
+    mpn = Column(String(100))
+    title = Column(String(200))
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+
+class FeedWatermark(Base):
+    """Point in time up to which each marketplace's delta feed has been exported"""
+    __tablename__ = "feed_watermarks"
+    
+    marketplace = Column(String(50), primary_key=True)
+    exported_until = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class MarketplaceListing(Base):
+    """Products a delta feed has listed on a marketplace and not withdrawn since"""
+    __tablename__ = "marketplace_listings"
+    
+    marketplace = Column(String(50), primary_key=True)
+    product_id = Column(UUID(as_uuid=True), primary_key=True)  # No foreign key: outlives the product until withdrawn
+    listed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -0,0 +1,174 @@
+"""
+Perceptual duplicate index for InventoScan
+BK-tree over 64-bit image hashes for fast Hamming-distance neighbour lookups
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from database import SessionLocal
+import models
+
+# Maximum Hamming distance reported as a likely duplicate
+PHASH_DUPLICATE_DISTANCE = int(os.getenv("PHASH_DUPLICATE_DISTANCE", "6"))
+# Stricter distance at which an earlier analysis is reused instead of calling the model
+PHASH_REUSE_DISTANCE = int(os.getenv("PHASH_REUSE_DISTANCE", "4"))
+# Seconds between pulls of hashes registered by other workers
+PHASH_REFRESH_INTERVAL = float(os.getenv("PHASH_REFRESH_INTERVAL", "5"))
+# uploaded_at is the registering transaction's start time, so an upload committed after
+# a refresh can carry an older timestamp; each refresh re-scans this window before the watermark
+PHASH_REFRESH_OVERLAP = timedelta(seconds=int(os.getenv("PHASH_REFRESH_OVERLAP_SECONDS", "300")))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree keyed by Hamming distance
+    Each child edge is labelled with its distance to the parent, so a radius
+    query only descends into edges within [d - radius, d + radius]
+    """
+
+    def __init__(self):
+        # node: [hash, payloads, {distance: child node}]
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, hash_value: int, payload):
+        self.size += 1
+        if self._root is None:
+            self._root = [hash_value, [payload], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(payload)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [payload], {}]
+                return
+            node = child
+
+    def search(self, hash_value: int, radius: int) -> List[Tuple[int, object]]:
+        """Return (distance, payload) for every entry within radius, nearest first"""
+        if self._root is None:
+            return []
+
+        results = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= radius:
+                results.extend((distance, payload) for payload in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+class PerceptualIndex:
+    """
+    Per-worker BK-tree of uploaded image hashes
+    Loaded lazily from uploaded_images and topped up with rows other workers registered.
+    The tree is only read and modified on the event loop; database reads and the
+    initial build run in a thread on a separate tree that is swapped in when done.
+    """
+
+    def __init__(self):
+        self._tree = BKTree()
+        self._known: Dict[str, Tuple[int, Optional[str]]] = {}
+        self._loaded = False
+        self._watermark: Optional[datetime] = None
+        self._last_refresh = 0.0
+        # One refresh at a time; concurrent callers wait for it instead of starting their own
+        self._refresh_lock = asyncio.Lock()
+
+    def add(self, image_id: str, phash: str, sha256: Optional[str] = None):
+        """Index an image registered by this worker"""
+        self._add(self._tree, self._known, image_id, int(phash, 16), sha256)
+
+    @staticmethod
+    def _add(tree: BKTree, known: dict, image_id: str, hash_value: int, sha256: Optional[str]):
+        if image_id in known:
+            return
+        known[image_id] = (hash_value, sha256)
+        tree.add(hash_value, (image_id, sha256))
+
+    @staticmethod
+    def _fetch(since: Optional[datetime]) -> List[Tuple[str, int, Optional[str], datetime]]:
+        """Hashes registered at or after `since`, all of them when None (blocking, run in a thread)"""
+        db = SessionLocal()
+        try:
+            query = db.query(
+                models.UploadedImage.id,
+                models.UploadedImage.phash,
+                models.UploadedImage.sha256,
+                models.UploadedImage.uploaded_at
+            ).filter(models.UploadedImage.phash.isnot(None))
+            if since is not None:
+                query = query.filter(models.UploadedImage.uploaded_at >= since)
+            return [
+                (str(image_id), int(phash, 16), sha256, uploaded_at)
+                for image_id, phash, sha256, uploaded_at in query.yield_per(5000)
+            ]
+        finally:
+            db.close()
+
+    @classmethod
+    def _build(cls, rows) -> Tuple[BKTree, dict]:
+        """Tree over fetched rows (blocking, run in a thread)"""
+        tree, known = BKTree(), {}
+        for image_id, hash_value, sha256, _ in rows:
+            cls._add(tree, known, image_id, hash_value, sha256)
+        return tree, known
+
+    async def _refresh(self):
+        since = self._watermark
+        # Rows seen before are skipped by _add
+        rows = await asyncio.to_thread(self._fetch, since - PHASH_REFRESH_OVERLAP if since else None)
+        if not self._loaded:
+            tree, known = await asyncio.to_thread(self._build, rows)
+            # Keep what add() indexed while the tree was being built
+            for image_id, (hash_value, sha256) in self._known.items():
+                self._add(tree, known, image_id, hash_value, sha256)
+            self._tree, self._known, self._loaded = tree, known, True
+        else:
+            for image_id, hash_value, sha256, _ in rows:
+                self._add(self._tree, self._known, image_id, hash_value, sha256)
+        # Never moves back: the overlap returns rows older than the watermark
+        self._watermark = max((row[3] for row in rows if since is None or row[3] > since), default=since)
+        self._last_refresh = time.monotonic()
+
+    def _stale(self) -> bool:
+        return time.monotonic() - self._last_refresh > PHASH_REFRESH_INTERVAL
+
+    async def find(self, phash: str, max_distance: int = PHASH_DUPLICATE_DISTANCE,
+                   exclude: Optional[str] = None) -> List[Dict[str, object]]:
+        """Nearest indexed images within max_distance as [{image_id, sha256, distance}]"""
+        if self._stale():
+            async with self._refresh_lock:
+                # Re-check: the refresh we waited for may have just finished
+                if self._stale():
+                    await self._refresh()
+
+        matches = self._tree.search(int(phash, 16), max_distance)
+        return [
+            {"image_id": image_id, "sha256": sha256, "distance": distance}
+            for distance, (image_id, sha256) in matches
+            if image_id != exclude
+        ]
+
+
+# Global perceptual index instance
+perceptual_index = PerceptualIndex()
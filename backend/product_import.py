@@ -0,0 +1,320 @@
+"""
+Bulk product import for InventoScan
+Streams CSV or JSON Lines files, validates rows against the product schemas in
+batches and loads each batch with multi-row upserts keyed on barcode (core
+schema) or SKU (marketplace schema). Invalid rows are reported per line and
+never stop the import.
+"""
+
+import codecs
+import csv
+import io
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Dict, FrozenSet, Iterator, List, Optional, Tuple, Type
+
+import psycopg2
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import ARRAY, JSON, Boolean, Date, DateTime, Integer, Numeric, column, func, inspect, literal_column, select, table, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
+# Errors listed in the response; further failures are only counted
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+
+IMPORT_FORMATS = ("csv", "jsonl")
+
+
+class ImportFormatError(ValueError):
+    """The file cannot be parsed at all (unknown format, missing header, ...)"""
+
+
+@dataclass(frozen=True)
+class ImportTarget:
+    """
+    Where and how one products schema is imported
+    `key` is the natural key of the upsert; it must have a unique index
+    (partial on `key IS NOT NULL`) so rows without a key are plain inserts.
+    """
+    model: Any
+    schema: Type[BaseModel]
+    key: str
+    # Columns given as JSON in CSV cells (lists also accept "a|b|c")
+    json_columns: FrozenSet[str] = frozenset()
+    # CSV header / JSON key -> schema field
+    aliases: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class ImportResult:
+    format: str
+    total_rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    superseded: int = 0    # Earlier rows of the file with the same key as a later row
+    failed: int = 0
+    ignored_columns: List[str] = field(default_factory=list)
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    elapsed_seconds: float = 0.0
+
+    def add_error(self, line: int, messages: List[str]):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "errors": messages})
+
+
+def detect_format(filename: Optional[str], requested: Optional[str] = None) -> str:
+    if requested:
+        if requested not in IMPORT_FORMATS:
+            raise ImportFormatError(f"Unsupported format '{requested}'. Use one of: {', '.join(IMPORT_FORMATS)}")
+        return requested
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    raise ImportFormatError("Cannot tell the file format from its name; pass format=csv or format=jsonl")
+
+
+# ========== PARSING ==========
+
+def _text_lines(stream: BinaryIO) -> Iterator[str]:
+    """Decode a binary stream line by line (BOM tolerant) without loading it whole"""
+    reader = codecs.getreader("utf-8-sig")(stream)
+    for line in reader:
+        yield line
+
+
+def _read_csv(stream: BinaryIO) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    reader = csv.DictReader(_text_lines(stream))
+    if not reader.fieldnames:
+        raise ImportFormatError("CSV file has no header row")
+    for row in reader:
+        # Empty cells mean "not given", so schema defaults apply
+        yield reader.line_num, {k: v for k, v in row.items() if k is not None and v not in ("", None)}
+
+
+def _read_jsonl(stream: BinaryIO) -> Iterator[Tuple[int, Any]]:
+    for line_number, line in enumerate(_text_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, e
+
+
+def _decode_json_cells(row: Dict[str, Any], json_columns: FrozenSet[str]) -> Dict[str, Any]:
+    for name in json_columns & row.keys():
+        value = row[name]
+        if not isinstance(value, str):
+            continue
+        try:
+            row[name] = json.loads(value)
+        except json.JSONDecodeError:
+            # Lists may also be written as "first|second|third"
+            row[name] = [part.strip() for part in value.split("|") if part.strip()]
+    return row
+
+
+# ========== LOADING ==========
+
+class ProductImporter:
+    def __init__(self, db: Session, target: ImportTarget, batch_size: int = IMPORT_BATCH_SIZE):
+        self.db = db
+        self.target = target
+        self.batch_size = batch_size
+        self.table = target.model.__table__
+        self.fields = set(target.schema.model_fields)
+        # Schema field (= ORM attribute) -> table column, e.g. custom_fields -> metadata
+        self.columns = {attr.key: attr.columns[0].key for attr in inspect(target.model).column_attrs}
+        self.staging_name = f"{self.table.name}_import_staging"
+
+    def run(self, stream: BinaryIO, format: str) -> ImportResult:
+        started = time.perf_counter()
+        result = ImportResult(format=format)
+        rows = _read_csv(stream) if format == "csv" else _read_jsonl(stream)
+        ignored = set()
+
+        batch: List[Tuple[int, BaseModel]] = []
+        for line, raw in rows:
+            result.total_rows += 1
+            if isinstance(raw, Exception):
+                result.add_error(line, [f"Invalid JSON: {raw}"])
+                continue
+            if not isinstance(raw, dict):
+                result.add_error(line, ["Expected a JSON object"])
+                continue
+
+            data = {self.target.aliases.get(k, k): v for k, v in raw.items()}
+            ignored.update(k for k in data if k not in self.fields)
+            if format == "csv":
+                data = _decode_json_cells(data, self.target.json_columns)
+            try:
+                batch.append((line, self.target.schema.model_validate(data)))
+            except ValidationError as e:
+                result.add_error(line, [
+                    f"{'.'.join(str(p) for p in error['loc']) or 'row'}: {error['msg']}" for error in e.errors()
+                ])
+
+            if len(batch) >= self.batch_size:
+                self._load(batch, result)
+                batch = []
+
+        if batch:
+            self._load(batch, result)
+
+        result.ignored_columns = sorted(ignored)
+        result.elapsed_seconds = round(time.perf_counter() - started, 3)
+        return result
+
+    def _load(self, batch: List[Tuple[int, BaseModel]], result: ImportResult):
+        """Upsert one validated batch and commit it"""
+        key = self.target.key
+
+        # ON CONFLICT may touch each row only once per statement: the last row of a key wins
+        latest: Dict[Any, int] = {}
+        for position, (_, item) in enumerate(batch):
+            key_value = getattr(item, key)
+            if key_value is not None:
+                latest[key_value] = position
+        unique = []
+        for position, entry in enumerate(batch):
+            key_value = getattr(entry[1], key)
+            if key_value is not None and latest[key_value] != position:
+                result.superseded += 1
+                continue
+            unique.append(entry)
+
+        # Rows only overwrite the fields they actually provide, so group by that set
+        groups: Dict[FrozenSet[str], List[Tuple[int, BaseModel]]] = {}
+        for entry in unique:
+            groups.setdefault(frozenset(entry[1].model_fields_set), []).append(entry)
+
+        for provided, entries in groups.items():
+            try:
+                with self.db.begin_nested():
+                    inserted, updated = self._copy_upsert(entries, provided)
+                result.inserted += inserted
+                result.updated += updated
+            except DBAPIError:
+                # Isolate the offending rows so the rest of the group still loads
+                for entry in entries:
+                    try:
+                        with self.db.begin_nested():
+                            inserted, updated = self._upsert([entry], provided)
+                        result.inserted += inserted
+                        result.updated += updated
+                    except DBAPIError as e:
+                        result.add_error(entry[0], [str(e.orig).strip().splitlines()[0]])
+
+        self.db.commit()
+
+    def _upsert_statement(self, provided: FrozenSet[str], insert_columns: Optional[List[str]] = None):
+        """INSERT ... ON CONFLICT (key) DO UPDATE of the provided fields, reporting inserts"""
+        key = self.target.key
+        statement = pg_insert(self.table)
+        if insert_columns is not None:
+            staging = table(self.staging_name, *(column(name) for name in insert_columns))
+            statement = statement.from_select(insert_columns, select(*staging.c))
+        update_columns = {
+            self.columns[name]: statement.excluded[self.columns[name]] for name in provided
+            if name != key and name in self.columns
+        }
+        if "updated_at" in self.table.c:
+            update_columns["updated_at"] = func.now()
+        return statement.on_conflict_do_update(
+            index_elements=[key],
+            index_where=text(f"{key} IS NOT NULL"),
+            set_=update_columns
+        ).returning(literal_column("xmax = 0"))
+
+    def _rows(self, entries: List[Tuple[int, BaseModel]]) -> List[Dict[str, Any]]:
+        rows = []
+        for _, item in entries:
+            row = {self.columns[name]: value for name, value in item.model_dump().items() if name in self.columns}
+            row.setdefault("id", uuid.uuid4())
+            rows.append(row)
+        return rows
+
+    def _upsert(self, entries: List[Tuple[int, BaseModel]], provided: FrozenSet[str]) -> Tuple[int, int]:
+        """Multi-row VALUES upsert (used to pinpoint rows the database rejects)"""
+        outcomes = self.db.execute(self._upsert_statement(provided), self._rows(entries)).scalars().all()
+        inserted = sum(1 for was_inserted in outcomes if was_inserted)
+        return inserted, len(outcomes) - inserted
+
+    def _copy_upsert(self, entries: List[Tuple[int, BaseModel]], provided: FrozenSet[str]) -> Tuple[int, int]:
+        """COPY the rows into a temp staging table, then upsert them with one INSERT ... SELECT"""
+        rows = self._rows(entries)
+        insert_columns = list(rows[0])
+        cursor = self.db.connection().connection.cursor()
+        statement = None
+        try:
+            statement = (
+                f"CREATE TEMP TABLE IF NOT EXISTS {self.staging_name} "
+                f"(LIKE {self.table.name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+            cursor.execute(statement)
+            statement = f"TRUNCATE {self.staging_name}"
+            cursor.execute(statement)
+            encoders = [self._copy_encoder(name) for name in insert_columns]
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write("\t".join(
+                    "\\N" if value is None else encode(value)
+                    for encode, value in zip(encoders, row.values())
+                ))
+                buffer.write("\n")
+            buffer.seek(0)
+            quoted_columns = ", ".join(f'"{name}"' for name in insert_columns)
+            statement = f"COPY {self.staging_name} ({quoted_columns}) FROM STDIN"
+            cursor.copy_expert(statement, buffer)
+        except psycopg2.Error as e:
+            # The raw cursor bypasses SQLAlchemy's exception translation; wrap the error
+            # so _load rolls back the savepoint and retries the rows one by one
+            raise DBAPIError(statement, None, e) from e
+        finally:
+            cursor.close()
+
+        outcomes = self.db.execute(self._upsert_statement(provided, insert_columns)).scalars().all()
+        inserted = sum(1 for was_inserted in outcomes if was_inserted)
+        return inserted, len(outcomes) - inserted
+
+    def _copy_encoder(self, name: str) -> Callable[[Any], str]:
+        """Encoder of one column's values for COPY's text format (chosen once per batch)"""
+        column_type = self.table.c[name].type
+        if isinstance(column_type, ARRAY):
+            return lambda items: _copy_escape("{" + ",".join(
+                '"' + str(item).replace("\\", "\\\\").replace('"', '\\"') + '"' for item in items
+            ) + "}")
+        if isinstance(column_type, (Integer, Numeric, Date, DateTime)) or name == "id":
+            return str
+        if isinstance(column_type, Boolean):
+            return lambda value: "t" if value else "f"
+        if isinstance(column_type, JSON):
+            return lambda value: _copy_escape(json.dumps(value))
+        return lambda value: _copy_escape(str(value))
+
+
+def _copy_escape(value: str) -> str:
+    if "\\" in value or "\t" in value or "\n" in value or "\r" in value:
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return value
+
+
+def import_products(db: Session, target: ImportTarget, stream: BinaryIO, format: str) -> Dict[str, Any]:
+    """
+    Import a CSV / JSONL stream; returns the summary with per-line errors
+    Batches are committed as they load, so an unreadable file keeps the rows before the damage.
+    """
+    try:
+        result = ProductImporter(db, target).run(stream, format)
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.rollback()
+        raise ImportFormatError(f"File could not be read: {e}")
+    return result.__dict__
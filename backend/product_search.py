@@ -0,0 +1,112 @@
+"""
+Product search for InventoScan
+Ranked full-text search with a prefix (typeahead) mode and exact-match fast paths
+for barcodes and part numbers. Every branch is served by an index, so latency
+stays flat as the catalog grows.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Tuple
+
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.orm import Query
+
+# Typeahead terms are rebuilt from word characters only, so user input never reaches tsquery syntax
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Barcodes, EANs, SKUs and MPNs: a single token containing at least one digit
+IDENTIFIER_PATTERN = re.compile(r"^(?=.*\d)[\w\-./]+$", re.UNICODE)
+
+SEARCH_MODES = ("full", "prefix")
+
+
+@dataclass(frozen=True)
+class SearchSpec:
+    """
+    How one products schema is searched
+    `document` must build exactly the expression of the schema's GIN index,
+    otherwise Postgres cannot use the index for the match
+    """
+    config: str
+    document: Callable
+    identifier_columns: Tuple[str, ...]
+
+    def regconfig(self):
+        return literal_column(f"'{self.config}'::regconfig")
+
+
+def _core_document(model, regconfig):
+    # idx_products_search in init.sql
+    return func.to_tsvector(
+        regconfig,
+        func.coalesce(model.name, '') + ' ' + func.coalesce(model.brand, '')
+    )
+
+
+def _marketplace_document(model, regconfig):
+    # idx_products_search in migrations/marketplace_schema.sql
+    return func.to_tsvector(
+        regconfig,
+        func.coalesce(model.title, '') + ' '
+        + func.coalesce(model.brand, '') + ' '
+        + func.coalesce(model.description_short, '') + ' '
+        + func.coalesce(func.immutable_array_to_string(model.bullet_points, ' '), '')
+    )
+
+
+# 'simple' keeps brand and model tokens intact and does not stem non-English product names
+CORE_SEARCH = SearchSpec(config="simple", document=_core_document, identifier_columns=("barcode",))
+MARKETPLACE_SEARCH = SearchSpec(config="english", document=_marketplace_document,
+                                identifier_columns=("ean", "mpn", "sku"))
+
+
+def looks_like_identifier(term: str) -> bool:
+    return bool(IDENTIFIER_PATTERN.match(term))
+
+
+def identifier_filter(model, spec: SearchSpec, term: str):
+    """Exact match on the barcode/EAN/MPN/SKU columns for an identifier-shaped term, else None"""
+    term = term.strip()
+    if not looks_like_identifier(term):
+        return None
+    return or_(*(getattr(model, column) == term for column in spec.identifier_columns))
+
+
+def prefix_tsquery(term: str) -> str:
+    """'sony wh-1000' -> 'sony:* & wh:* & 1000:*'"""
+    return " & ".join(f"{word}:*" for word in WORD_PATTERN.findall(term))
+
+
+def search_products(query: Query, model, spec: SearchSpec, term: str,
+                    mode: str = "full", limit: int = 20) -> List:
+    """
+    Best matches for `term` among the rows of `query`, most relevant first
+    An identifier-shaped term that equals a barcode/EAN/MPN/SKU returns only those exact hits.
+    mode="full" accepts web-search syntax ("quoted phrase", -exclude, or);
+    mode="prefix" matches words by their beginning for search-as-you-type.
+    """
+    term = term.strip()
+    if not term:
+        return []
+
+    # Scanned codes: btree equality instead of a text search
+    exact_filter = identifier_filter(model, spec, term)
+    if exact_filter is not None:
+        exact = query.filter(exact_filter).limit(limit).all()
+        if exact:
+            return exact
+
+    if mode == "prefix":
+        expression = prefix_tsquery(term)
+        if not expression:
+            return []
+        tsquery = func.to_tsquery(spec.regconfig(), expression)
+    else:
+        tsquery = func.websearch_to_tsquery(spec.regconfig(), term)
+
+    document = spec.document(model, spec.regconfig())
+    rank = func.ts_rank_cd(document, tsquery)
+    return query.filter(document.op("@@")(tsquery))\
+        .order_by(rank.desc(), model.created_at.desc(), model.id.desc())\
+        .limit(limit)\
+        .all()
@@ -3,23 +3,196 @@ Rate Limiting for InventoScan API
 Prevents DoS attacks and resource abuse
 """
 
+import math
+import os
+import re
 import time
 import hashlib
-from typing import Dict, Optional, Tuple
-from collections import defaultdict
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
 from fastapi import HTTPException, Request, Response
 from fastapi.responses import JSONResponse
+from starlette.routing import Route
 import json
 
+try:
+    import redis.asyncio as redis
+except ImportError:  # Optional: only needed for RATE_LIMIT_BACKEND=redis
+    redis = None
+
+# "memory": buckets live in each worker process; "redis": one shared set of buckets for all workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Seconds a Redis call may take before the request falls back to per-process buckets,
+# and seconds before an unavailable Redis is tried again
+RATE_LIMIT_REDIS_TIMEOUT = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.25"))
+RATE_LIMIT_REDIS_RETRY = float(os.getenv("RATE_LIMIT_REDIS_RETRY", "5"))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+# Endpoint functions carry their rate_limit_policy() in this attribute
+RATE_LIMIT_POLICY_ATTR = "__rate_limit_policy__"
+
+PATH_WORD_PATTERN = re.compile(r"[^a-z0-9]+")
+
+# Expired buckets dropped per request; a small constant keeps cleanup O(1) amortized
+CLEANUP_BATCH = 2
+
+
+class BucketStore(ABC):
+    """
+    Storage of token buckets
+    take() refills the bucket for the elapsed time, then takes one token if there is one.
+    A bucket that has been idle long enough to refill completely is equivalent to a
+    missing one, so stores may drop it after capacity / refill_rate seconds.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, capacity: float, refill_rate: float) -> Tuple[bool, float]:
+        """Returns (allowed, tokens left)"""
+
+
+class MemoryBucketStore(BucketStore):
+    """
+    Per-process buckets in an OrderedDict kept in last-use order
+    Each take() moves its bucket to the end and drops up to CLEANUP_BATCH expired
+    buckets from the front, so there is never a full scan on the request path.
+    """
+
+    def __init__(self, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        # key -> [tokens, last_refill, expires_at]
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def _cleanup(self, now: float):
+        for _ in range(CLEANUP_BATCH):
+            if not self.buckets:
+                return
+            key, bucket = next(iter(self.buckets.items()))
+            if bucket[2] > now and len(self.buckets) <= self.max_buckets:
+                return
+            del self.buckets[key]
+
+    async def take(self, key: str, capacity: float, refill_rate: float) -> Tuple[bool, float]:
+        # No await in here: the read-modify-write is atomic on the event loop
+        now = time.monotonic()
+        self._cleanup(now)
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            self.buckets.move_to_end(key)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = [tokens, now, now + (capacity - tokens) / refill_rate]
+        return allowed, tokens
+
+
+# Atomic refill-and-take on the Redis server, timed by the server clock so all workers agree.
+# Buckets expire once they would be full again.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(0, now - tonumber(bucket[2])) * refill_rate)
+end
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill_rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketStore(BucketStore):
+    """
+    Buckets shared by every worker, updated with one Lua script call per request
+    Denials are remembered in-process until the bucket can have a token again, so a
+    client hammering a limited endpoint costs no Redis round trips. If Redis is
+    unreachable or slow the limiter falls back to per-process buckets instead of
+    failing requests, and only tries Redis again after `retry_interval` seconds.
+    """
+
+    def __init__(self, client, prefix: str = "ratelimit:", fallback: Optional[BucketStore] = None,
+                 retry_interval: float = RATE_LIMIT_REDIS_RETRY):
+        self.client = client
+        self.prefix = prefix
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.fallback = fallback or MemoryBucketStore()
+        self.retry_interval = retry_interval
+        self.available = True
+        # monotonic time before which the fallback is used without trying Redis
+        self.retry_at = 0.0
+        # key -> monotonic time until which requests are denied locally
+        self.blocked: "OrderedDict[str, float]" = OrderedDict()
+
+    async def take(self, key: str, capacity: float, refill_rate: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        for _ in range(CLEANUP_BATCH):
+            if not self.blocked or next(iter(self.blocked.values())) > now:
+                break
+            self.blocked.popitem(last=False)
+        if self.blocked.get(key, 0) > now:
+            return False, 0.0
+        if not self.available and now < self.retry_at:
+            return await self.fallback.take(key, capacity, refill_rate)
+
+        try:
+            allowed, tokens = await self.script(keys=[self.prefix + key], args=[capacity, refill_rate])
+        except (redis.RedisError, OSError) as e:
+            if self.available:
+                print(f"Warning: rate limit store unavailable, using per-process buckets: {e}")
+                self.available = False
+            self.retry_at = now + self.retry_interval
+            return await self.fallback.take(key, capacity, refill_rate)
+        self.available = True
+
+        tokens = float(tokens)
+        if not allowed:
+            self.blocked[key] = now + (1 - tokens) / refill_rate
+            self.blocked.move_to_end(key)
+        return bool(allowed), tokens
+
+
+def create_bucket_store(backend: str = RATE_LIMIT_BACKEND) -> BucketStore:
+    if backend == "redis":
+        if redis is None:
+            # Silently limiting per process would multiply every limit by the number of workers
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the redis package (pip install redis)")
+        # Short timeouts: a hung Redis must fall back quickly instead of stalling requests
+        return RedisBucketStore(redis.from_url(
+            RATE_LIMIT_REDIS_URL,
+            socket_timeout=RATE_LIMIT_REDIS_TIMEOUT,
+            socket_connect_timeout=RATE_LIMIT_REDIS_TIMEOUT
+        ))
+    return MemoryBucketStore()
+
+
 class RateLimiter:
     """
     Token Bucket Rate Limiter
     Implements a token bucket algorithm for flexible rate limiting
     """
     
-    def __init__(self):
-        # Store rate limit data: {client_id: {endpoint: (tokens, last_refill)}}
-        self.buckets: Dict[str, Dict[str, Tuple[float, float]]] = defaultdict(dict)
+    def __init__(self, store: Optional[BucketStore] = None):
+        # Buckets keyed "{client_id}:{endpoint_type}"
+        self.store = store or create_bucket_store()
         
         # Configuration for different endpoint types
         self.limits = {
@@ -56,15 +229,20 @@ class RateLimiter:
     def get_endpoint_type(self, path: str, method: str) -> str:
         """
         Determine endpoint type based on path and method
+        Used once per registered route without a rate_limit_policy, and for unknown paths
         """
-        path_lower = path.lower()
+        # Whole path segments / words, so "/api" does not read as "ai"
+        words = [word for word in PATH_WORD_PATTERN.split(path.lower()) if word]
+        
+        def mentions(*keywords: str) -> bool:
+            return any(keyword in word for word in words for keyword in keywords)
         
         # Auth endpoints
-        if 'login' in path_lower or 'register' in path_lower or 'auth' in path_lower:
+        if mentions('login', 'register', 'auth'):
             return 'auth'
         
         # Upload endpoints
-        if 'upload' in path_lower and method == 'POST':
+        if mentions('upload') and method == 'POST':
             return 'upload'
         
         # Delete endpoints
@@ -76,11 +254,11 @@ class RateLimiter:
             return 'update'
         
         # AI/Analysis endpoints
-        if 'analyze' in path_lower or 'ai' in path_lower:
+        if mentions('analyze') or 'ai' in words:
             return 'analyze'
         
         # Export endpoints
-        if 'export' in path_lower or 'download' in path_lower:
+        if mentions('export', 'download'):
             return 'export'
         
         # Read endpoints
@@ -89,76 +267,105 @@ class RateLimiter:
         
         return 'default'
     
-    def check_rate_limit(
+    def classify_request(self, request: Request) -> str:
+        """Endpoint type of a request, from the app's route table (built on first use)"""
+        classifier = getattr(request.app.state, "rate_limit_routes", None)
+        if classifier is None:
+            classifier = RouteClassifier(request.app.routes, self.get_endpoint_type)
+            request.app.state.rate_limit_routes = classifier
+        
+        path = request.scope["path"]
+        endpoint_type = classifier.lookup(request.method, path)
+        if endpoint_type is None:
+            # Not a registered route (404s, mounts): classify the raw path
+            endpoint_type = self.get_endpoint_type(path, request.method)
+        return endpoint_type
+    
+    async def check_rate_limit(
         self, 
         client_id: str, 
-        endpoint_type: str
+        endpoint_type: str,
+        limit: Optional[Tuple[int, float, int]] = None
     ) -> Tuple[bool, int, int]:
         """
         Check if request is within rate limit
+        `limit` overrides the configured (max_tokens, refill_rate, burst_size)
         
         Returns:
             (allowed, remaining_tokens, reset_time)
         """
-        current_time = time.time()
-        max_tokens, refill_rate, burst_size = self.limits.get(
+        max_tokens, refill_rate, burst_size = limit or self.limits.get(
             endpoint_type, 
             self.limits['default']
         )
         
-        # Get or initialize bucket for this client/endpoint
-        bucket_key = f"{client_id}:{endpoint_type}"
-        
-        if bucket_key not in self.buckets:
-            # Initialize new bucket with full tokens
-            self.buckets[bucket_key] = {
-                'tokens': max_tokens,
-                'last_refill': current_time
-            }
-        
-        bucket = self.buckets[bucket_key]
-        
-        # Calculate tokens to add based on time passed
-        time_passed = current_time - bucket['last_refill']
-        tokens_to_add = time_passed * refill_rate
-        
-        # Refill bucket (up to burst size)
-        bucket['tokens'] = min(burst_size, bucket['tokens'] + tokens_to_add)
-        bucket['last_refill'] = current_time
+        allowed, tokens = await self.store.take(f"{client_id}:{endpoint_type}", burst_size, refill_rate)
+        current_time = time.time()
         
-        # Check if we have tokens available
-        if bucket['tokens'] >= 1:
-            bucket['tokens'] -= 1
-            remaining = int(bucket['tokens'])
-            reset_time = int(current_time + (1 / refill_rate))
-            return True, remaining, reset_time
+        if allowed:
+            return True, int(tokens), int(current_time + (1 / refill_rate))
         
         # Calculate when tokens will be available
-        tokens_needed = 1 - bucket['tokens']
-        wait_time = tokens_needed / refill_rate
-        reset_time = int(current_time + wait_time)
-        
-        return False, 0, reset_time
+        wait_time = (1 - tokens) / refill_rate
+        return False, 0, math.ceil(current_time + wait_time)
+
+
+class RouteClassifier:
+    """
+    Endpoint type of every registered route and method, resolved once
+    Static paths are a dict lookup; parameterized paths are matched against their
+    route regex, only among the routes of the request's method.
+    """
     
-    def cleanup_old_buckets(self, max_age: int = 3600):
-        """
-        Remove old buckets to prevent memory leak
-        """
-        current_time = time.time()
-        keys_to_remove = []
-        
-        for key, bucket in self.buckets.items():
-            if current_time - bucket['last_refill'] > max_age:
-                keys_to_remove.append(key)
+    def __init__(self, routes, classify: Callable[[str, str], str]):
+        self.static: Dict[Tuple[str, str], str] = {}
+        self.dynamic: Dict[str, List[Tuple[Pattern, str]]] = {}
         
-        for key in keys_to_remove:
-            del self.buckets[key]
+        for route in routes:
+            if not isinstance(route, Route) or not route.methods:
+                continue
+            policy = getattr(route.endpoint, RATE_LIMIT_POLICY_ATTR, None)
+            for method in route.methods:
+                endpoint_type = policy or classify(route.path, method)
+                if route.param_convertors:
+                    self.dynamic.setdefault(method, []).append((route.path_regex, endpoint_type))
+                else:
+                    # First registration wins, as in Starlette's routing
+                    self.static.setdefault((method, route.path), endpoint_type)
+    
+    def lookup(self, method: str, path: str) -> Optional[str]:
+        endpoint_type = self.static.get((method, path))
+        if endpoint_type is not None:
+            return endpoint_type
+        for path_regex, endpoint_type in self.dynamic.get(method, ()):
+            if path_regex.match(path):
+                return endpoint_type
+        return None
 
 
 # Global rate limiter instance
 rate_limiter = RateLimiter()
 
 
+def rate_limit_policy(endpoint_type: str):
+    """
+    Count an endpoint against the given limit instead of guessing it from the path
+    
+    Usage:
+        @app.post("/api/products/import")
+        @rate_limit_policy("upload")
+        async def import_products():
+            ...
+    """
+    if endpoint_type not in rate_limiter.limits:
+        raise ValueError(f"Unknown rate limit policy: {endpoint_type}")
+    
+    def decorator(func):
+        setattr(func, RATE_LIMIT_POLICY_ATTR, endpoint_type)
+        return func
+    return decorator
+
+
 async def rate_limit_middleware(request: Request, call_next):
     """
     FastAPI middleware for rate limiting
@@ -170,10 +377,10 @@ async def rate_limit_middleware(request: Request, call_next):
     
     # Get client ID and endpoint type
     client_id = rate_limiter.get_client_id(request)
-    endpoint_type = rate_limiter.get_endpoint_type(request.url.path, request.method)
+    endpoint_type = rate_limiter.classify_request(request)
     
     # Check rate limit
-    allowed, remaining, reset_time = rate_limiter.check_rate_limit(client_id, endpoint_type)
+    allowed, remaining, reset_time = await rate_limiter.check_rate_limit(client_id, endpoint_type)
     
     if not allowed:
         # Return 429 Too Many Requests
@@ -200,11 +407,6 @@ async def rate_limit_middleware(request: Request, call_next):
     response.headers["X-RateLimit-Remaining"] = str(remaining)
     response.headers["X-RateLimit-Reset"] = str(reset_time)
     
-    # Periodic cleanup (1% chance per request)
-    import random
-    if random.random() < 0.01:
-        rate_limiter.cleanup_old_buckets()
-    
     return response
 
 
@@ -227,24 +429,15 @@ def create_rate_limit_decorator(
             client_id = rate_limiter.get_client_id(request)
             
             # Use custom limits if provided
-            if endpoint_type:
-                old_limit = rate_limiter.limits.get(endpoint_type)
-                rate_limiter.limits[endpoint_type] = (
-                    max_calls,
-                    max_calls / time_window,
-                    max_calls
-                )
+            limit = (max_calls, max_calls / time_window, max_calls) if endpoint_type else None
             
             # Check rate limit
-            allowed, remaining, reset_time = rate_limiter.check_rate_limit(
+            allowed, remaining, reset_time = await rate_limiter.check_rate_limit(
                 client_id,
-                endpoint_type or 'default'
+                endpoint_type or 'default',
+                limit
             )
             
-            # Restore old limit if custom was used
-            if endpoint_type and old_limit:
-                rate_limiter.limits[endpoint_type] = old_limit
-            
             if not allowed:
                 raise HTTPException(
                     status_code=429,
@@ -12,6 +12,7 @@ class ProductBase(BaseModel):
     barcode: Optional[str] = Field(None, max_length=50)
     category: Optional[str] = Field(None, max_length=100)
     stock_quantity: int = Field(0, ge=0)
+    min_stock: int = Field(0, ge=0)
     brand: Optional[str] = Field(None, max_length=100)
     location: Optional[str] = Field(None, max_length=50)
     condition: Optional[str] = Field(None, pattern="^(new|used|refurbished|damaged)$")
@@ -30,6 +31,7 @@ class ProductUpdate(BaseModel):
     barcode: Optional[str] = Field(None, max_length=50)
     category: Optional[str] = Field(None, max_length=100)
     stock_quantity: Optional[int] = Field(None, ge=0)
+    min_stock: Optional[int] = Field(None, ge=0)
     brand: Optional[str] = Field(None, max_length=100)
     location: Optional[str] = Field(None, max_length=50)
     condition: Optional[str] = Field(None, pattern="^(new|used|refurbished|damaged)$")
@@ -43,9 +45,25 @@ class Product(ProductBase):
     created_at: datetime
     updated_at: datetime
     images: List['ProductImage'] = []
+    # Newest movements first, only with ?include=stock_movements
+    recent_stock_movements: Optional[List['StockMovement']] = None
     
     model_config = ConfigDict(from_attributes=True, populate_by_name=True)
 
+class ProductSummary(BaseModel):
+    """Compact list row (?view=summary), e.g. for the mobile scanner"""
+    id: UUID
+    name: str
+    barcode: Optional[str] = None
+    brand: Optional[str] = None
+    category: Optional[str] = None
+    location: Optional[str] = None
+    stock_quantity: int
+    min_stock: int
+    selling_price: Optional[Decimal] = None
+    
+    model_config = ConfigDict(from_attributes=True)
+
 # Product Image Schemas
 class ProductImageBase(BaseModel):
     filename: str
@@ -53,6 +71,8 @@ class ProductImageBase(BaseModel):
     file_path: str
     file_size: Optional[int] = None
     mime_type: Optional[str] = None
+    width_px: Optional[int] = None
+    height_px: Optional[int] = None
     is_primary: bool = False
 
 class ProductImageCreate(ProductImageBase):
@@ -65,6 +85,52 @@ class ProductImage(ProductImageBase):
     
     model_config = ConfigDict(from_attributes=True)
 
+# Uploaded Image Schemas
+class UploadedImageCreate(BaseModel):
+    id: UUID
+    filename: str
+    original_filename: Optional[str] = None
+    file_path: str
+    file_size: Optional[int] = None
+    sha256: Optional[str] = Field(None, max_length=64)
+    phash: Optional[str] = Field(None, max_length=16)
+    session_id: Optional[str] = Field(None, max_length=100)
+    product_group: Optional[str] = Field(None, max_length=100)
+
+# Analysis Job Schemas
+class AnalysisJobGroup(BaseModel):
+    product_group: str = Field(..., max_length=100)
+    image_ids: List[UUID] = Field(..., min_length=1)
+
+class AnalysisJobCreate(BaseModel):
+    session_id: Optional[str] = Field(None, max_length=100)
+    groups: List[AnalysisJobGroup] = Field(..., min_length=1, max_length=500)
+
+class AnalysisJobItem(BaseModel):
+    id: UUID
+    product_group: Optional[str] = None
+    image_id: UUID
+    status: str
+    attempts: int
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    updated_at: datetime
+    
+    model_config = ConfigDict(from_attributes=True)
+
+class AnalysisJob(BaseModel):
+    id: UUID
+    session_id: Optional[str] = None
+    status: str
+    total_items: int
+    completed_items: int = 0
+    failed_items: int = 0
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    items: List[AnalysisJobItem] = []
+    
+    model_config = ConfigDict(from_attributes=True)
+
 # Stock Movement Schemas
 class StockMovementBase(BaseModel):
     movement_type: str = Field(..., pattern="^(in|out|adjustment|initial)$")
@@ -81,9 +147,46 @@ class StockMovement(StockMovementBase):
     id: UUID
     product_id: UUID
     created_at: datetime
+    new_quantity: Optional[int] = None  # Product stock after the movement (set when recording)
     
     model_config = ConfigDict(from_attributes=True)
 
+# Upper bound for one bulk request (a full stocktake fits comfortably)
+MAX_BULK_STOCK_MOVEMENTS = 5000
+
+class StockMovementBulkCreate(BaseModel):
+    movements: List[StockMovementCreate] = Field(..., min_length=1, max_length=MAX_BULK_STOCK_MOVEMENTS)
+
+class StockMovementBulkItem(BaseModel):
+    index: int                      # Position in the request
+    product_id: UUID
+    status: str                     # applied, replayed, rejected
+    movement_id: Optional[UUID] = None
+    new_quantity: Optional[int] = None
+    error: Optional[str] = None
+
+class StockMovementBulkResult(BaseModel):
+    applied: int
+    replayed: int
+    rejected: int
+    results: List[StockMovementBulkItem]
+
+# Product Import Schemas
+class ProductImportError(BaseModel):
+    line: int                       # Line in the uploaded file
+    errors: List[str]
+
+class ProductImportResult(BaseModel):
+    format: str
+    total_rows: int
+    inserted: int
+    updated: int
+    superseded: int                 # Rows replaced by a later row with the same key
+    failed: int
+    ignored_columns: List[str] = []
+    errors: List[ProductImportError] = []   # Capped at IMPORT_MAX_REPORTED_ERRORS
+    elapsed_seconds: float
+
 # AI Analysis Response
 class AIAnalysisResponse(BaseModel):
     product_name: str
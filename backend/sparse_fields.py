@@ -0,0 +1,98 @@
+"""
+Sparse fieldsets for product list endpoints
+`?fields=name,stock_quantity` or `?view=summary` selects only those columns and
+serializes them without the full response model, so list views skip the large
+JSONB columns (ai_data, metadata) in the database, in Python and on the wire.
+"""
+
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, create_model
+from sqlalchemy.orm import load_only, noload, selectinload
+
+from fast_json import FastJSONResponse
+
+PRODUCT_VIEWS = ("full", "summary")
+
+# Fields backed by a relationship rather than a column
+RELATIONSHIP_FIELDS = {"images": "images"}
+# Fields filled in after the query (see crud.expand_products)
+EXPANSION_FIELDS = {"recent_stock_movements": "stock_movements"}
+
+
+def parse_fields(schema: Type[BaseModel], fields: Optional[str], view: str = "full",
+                 summary: Optional[Type[BaseModel]] = None) -> Optional[Tuple[str, ...]]:
+    """
+    Requested field names of `schema` ("id" always first), or None for the full model
+    Serialization aliases are accepted too (metadata for custom_fields).
+    Raises ValueError for unknown fields or views.
+    """
+    if view not in PRODUCT_VIEWS:
+        raise ValueError(f"Unknown view: {view}. Use: {', '.join(PRODUCT_VIEWS)}")
+    if view == "summary" and summary is not None:
+        return tuple(summary.model_fields)
+    if not fields:
+        return None
+
+    aliases = {
+        field.serialization_alias: name
+        for name, field in schema.model_fields.items() if field.serialization_alias
+    }
+    requested = ["id"]
+    unknown = []
+    for part in fields.split(","):
+        name = aliases.get(part.strip(), part.strip())
+        if not name:
+            continue
+        if name not in schema.model_fields:
+            unknown.append(name)
+        elif name not in requested:
+            requested.append(name)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(requested)
+
+
+def load_options(model, fields: Iterable[str], always: Iterable[str] = ("id", "created_at")):
+    """Loader options reading only the requested columns (plus the pagination keys)"""
+    columns = [
+        name for name in dict.fromkeys((*always, *fields))
+        if name not in RELATIONSHIP_FIELDS and name not in EXPANSION_FIELDS
+    ]
+    options = [load_only(*(getattr(model, name) for name in columns))]
+    for field, relationship in RELATIONSHIP_FIELDS.items():
+        loader = selectinload if field in fields else noload
+        options.append(loader(getattr(model, relationship)))
+    return options
+
+
+def expansions(fields: Iterable[str]) -> frozenset:
+    """crud.expand_products names needed by the requested fields"""
+    return frozenset(EXPANSION_FIELDS[name] for name in fields if name in EXPANSION_FIELDS)
+
+
+@lru_cache(maxsize=128)
+def sparse_schema(schema: Type[BaseModel], fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """Subset of `schema` with just `fields`, keeping their types and aliases"""
+    schema.model_rebuild()
+    return create_model(
+        f"{schema.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True, populate_by_name=True),
+        **{name: (schema.model_fields[name].annotation, schema.model_fields[name]) for name in fields}
+    )
+
+
+def sparse_response(rows, schema: Type[BaseModel], fields: Tuple[str, ...],
+                    summary: Optional[Type[BaseModel]] = None) -> FastJSONResponse:
+    """
+    Serialize rows loaded with load_options() directly, bypassing the endpoint's response_model
+    (which would touch, and so lazy-load, every column left out of the SELECT)
+    """
+    if summary is not None and fields == tuple(summary.model_fields):
+        row_schema = summary
+    else:
+        row_schema = sparse_schema(schema, fields)
+    return FastJSONResponse(content=[
+        row_schema.model_validate(row).model_dump(mode="json", by_alias=True) for row in rows
+    ])
@@ -0,0 +1,269 @@
+"""
+Stock ledger for InventoScan
+Applies stock movements with a single atomic UPDATE ... RETURNING, so concurrent
+scans of the same product never lose updates and stock can never go negative.
+A movement with a reference_number is recorded at most once per product,
+which makes client retries safe.
+"""
+
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import Integer, column, func, insert, literal, select, true, tuple_, update, values
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+
+# Unique index on (product_id, reference_number), see init.sql
+REFERENCE_CONSTRAINT = "idx_stock_movements_reference"
+
+# Movement types that add to / take from the current quantity; 'adjustment' sets it
+INCREASING_TYPES = ("in", "initial")
+DECREASING_TYPES = ("out",)
+
+MOVEMENT_COLUMNS = (
+    "id", "product_id", "movement_type", "quantity", "reason",
+    "reference_number", "notes", "created_by", "created_at"
+)
+
+
+class StockMovementError(Exception):
+    """Movement rejected; status_code is the HTTP status to report"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@dataclass
+class AppliedMovement:
+    movement: Dict[str, Any]
+    new_quantity: int
+    replayed: bool = False  # reference_number was seen before; nothing was changed
+
+
+def _validate(movement_type: str, quantity: int):
+    if movement_type == "adjustment":
+        if quantity < 0:
+            raise StockMovementError("Adjustment quantity cannot be negative")
+    elif movement_type in INCREASING_TYPES + DECREASING_TYPES:
+        if quantity <= 0:
+            raise StockMovementError("Quantity must be positive")
+    else:
+        raise StockMovementError(f"Invalid movement type: {movement_type}")
+
+
+def _find_recorded(db: Session, product_id: UUID, reference_number: str):
+    """Movement already recorded for this product and reference, with the current stock"""
+    row = db.execute(
+        select(
+            *(getattr(models.StockMovement, column) for column in MOVEMENT_COLUMNS),
+            models.Product.stock_quantity
+        ).join(
+            models.Product, models.Product.id == models.StockMovement.product_id
+        ).where(
+            models.StockMovement.product_id == product_id,
+            models.StockMovement.reference_number == reference_number
+        )
+    ).first()
+    if row is None:
+        return None
+    return dict(zip(MOVEMENT_COLUMNS, row[:-1])), row[-1]
+
+
+def _replay(recorded, movement_type: str, quantity: int) -> AppliedMovement:
+    movement, stock_quantity = recorded
+    if movement["movement_type"] != movement_type or movement["quantity"] != quantity:
+        raise StockMovementError(
+            "reference_number was already used for a different movement of this product",
+            status_code=409
+        )
+    return AppliedMovement(movement=movement, new_quantity=stock_quantity, replayed=True)
+
+
+def apply_movement(
+    db: Session,
+    product_id: UUID,
+    movement_type: str,
+    quantity: int,
+    reason: Optional[str] = None,
+    reference_number: Optional[str] = None,
+    notes: Optional[str] = None,
+    created_by: Optional[str] = None,
+    commit: bool = True
+) -> AppliedMovement:
+    """
+    Record a movement and update the product stock in one statement
+    Raises StockMovementError (404 unknown product, 400 insufficient stock,
+    409 reference_number reused for a different movement).
+    """
+    _validate(movement_type, quantity)
+
+    if reference_number:
+        recorded = _find_recorded(db, product_id, reference_number)
+        if recorded is not None:
+            return _replay(recorded, movement_type, quantity)
+
+    product = models.Product.__table__
+    if movement_type == "adjustment":
+        new_quantity, guard = literal(quantity), true()
+    elif movement_type in DECREASING_TYPES:
+        # The guard is re-checked against the latest row version after the row lock is taken
+        new_quantity, guard = product.c.stock_quantity - quantity, product.c.stock_quantity >= quantity
+    else:
+        new_quantity, guard = product.c.stock_quantity + quantity, true()
+
+    target = select(product.c.id).where(product.c.id == product_id).cte("target")
+    updated = update(product).where(product.c.id == product_id, guard).values(
+        stock_quantity=new_quantity,
+        updated_at=func.now()
+    ).returning(product.c.stock_quantity).cte("updated")
+
+    stock_movements = models.StockMovement.__table__
+    inserted = insert(stock_movements).from_select(
+        ["id", "product_id", "movement_type", "quantity", "reason", "reference_number", "notes", "created_by"],
+        select(
+            literal(uuid.uuid4(), stock_movements.c.id.type),
+            literal(product_id, stock_movements.c.product_id.type),
+            literal(movement_type), literal(quantity), literal(reason, stock_movements.c.reason.type),
+            literal(reference_number, stock_movements.c.reference_number.type),
+            literal(notes, stock_movements.c.notes.type), literal(created_by, stock_movements.c.created_by.type)
+        ).select_from(updated)
+    ).returning(*(stock_movements.c[column] for column in MOVEMENT_COLUMNS)).cte("inserted")
+
+    statement = select(
+        target.c.id.label("target_id"),
+        updated.c.stock_quantity.label("new_quantity"),
+        *(inserted.c[column] for column in MOVEMENT_COLUMNS)
+    ).select_from(
+        target.outerjoin(updated, true()).outerjoin(inserted, true())
+    )
+
+    try:
+        row = db.execute(statement).mappings().first()
+        if commit:
+            db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        # A concurrent retry with the same reference_number won the race
+        if reference_number and REFERENCE_CONSTRAINT in str(e.orig):
+            recorded = _find_recorded(db, product_id, reference_number)
+            if recorded is not None:
+                return _replay(recorded, movement_type, quantity)
+        raise
+
+    if row is None:
+        raise StockMovementError("Product not found", status_code=404)
+    if row["new_quantity"] is None:
+        raise StockMovementError("Insufficient stock")
+
+    return AppliedMovement(
+        movement={column: row[column] for column in MOVEMENT_COLUMNS},
+        new_quantity=row["new_quantity"]
+    )
+
+
+# ========== BULK INGESTION ==========
+
+def apply_movements(db: Session, movements: List[schemas.StockMovementCreate]) -> List[Dict[str, Any]]:
+    """
+    Apply many movements in one transaction with a fixed number of statements
+    Movements of the same product are applied in request order; a rejected row
+    (unknown product, insufficient stock, invalid quantity, reused reference) does
+    not affect the others. Returns one result per input row.
+    """
+    results: List[Dict[str, Any]] = [
+        {"index": index, "product_id": movement.product_id, "status": "applied",
+         "movement_id": None, "new_quantity": None, "error": None}
+        for index, movement in enumerate(movements)
+    ]
+
+    def reject(index: int, message: str):
+        results[index]["status"] = "rejected"
+        results[index]["error"] = message
+
+    pending = []
+    for index, movement in enumerate(movements):
+        try:
+            _validate(movement.movement_type, movement.quantity)
+            pending.append(index)
+        except StockMovementError as e:
+            reject(index, e.message)
+
+    # Lock every affected product in a stable order (avoids deadlocks between batches).
+    # Any other movement of these products now waits for this transaction, so the
+    # quantities and recorded references read below cannot change underneath us.
+    product_ids = sorted({movements[index].product_id for index in pending}, key=str)
+    stock = dict(db.execute(
+        select(models.Product.id, models.Product.stock_quantity)
+        .where(models.Product.id.in_(product_ids))
+        .order_by(models.Product.id)
+        .with_for_update()
+    ).all()) if product_ids else {}
+
+    references = [(movements[index].product_id, movements[index].reference_number)
+                  for index in pending if movements[index].reference_number]
+    recorded = {}
+    if references:
+        rows = db.execute(
+            select(models.StockMovement.product_id, models.StockMovement.reference_number,
+                   models.StockMovement.id, models.StockMovement.movement_type, models.StockMovement.quantity)
+            .where(tuple_(models.StockMovement.product_id, models.StockMovement.reference_number).in_(references))
+        ).all()
+        recorded = {(row[0], row[1]): (row[2], row[3], row[4]) for row in rows}
+
+    new_rows = []
+    changed = {}
+    for index in pending:
+        movement = movements[index]
+        if movement.product_id not in stock:
+            reject(index, "Product not found")
+            continue
+
+        key = (movement.product_id, movement.reference_number)
+        if movement.reference_number and key in recorded:
+            movement_id, movement_type, quantity = recorded[key]
+            if (movement_type, quantity) != (movement.movement_type, movement.quantity):
+                reject(index, "reference_number was already used for a different movement of this product")
+            else:
+                results[index].update(status="replayed", movement_id=movement_id,
+                                      new_quantity=stock[movement.product_id])
+            continue
+
+        current = stock[movement.product_id]
+        if movement.movement_type == "adjustment":
+            quantity = movement.quantity
+        elif movement.movement_type in DECREASING_TYPES:
+            if current < movement.quantity:
+                reject(index, "Insufficient stock")
+                continue
+            quantity = current - movement.quantity
+        else:
+            quantity = current + movement.quantity
+        stock[movement.product_id] = changed[movement.product_id] = quantity
+
+        movement_id = uuid.uuid4()
+        new_rows.append({"id": movement_id, **movement.dict()})
+        results[index].update(movement_id=movement_id, new_quantity=quantity)
+        if movement.reference_number:
+            # Later rows repeating this reference replay it
+            recorded[key] = (movement_id, movement.movement_type, movement.quantity)
+
+    if changed:
+        # One UPDATE ... FROM (VALUES ...) for all products, then a multi-row INSERT
+        final = values(
+            column("id", models.Product.id.type), column("stock_quantity", Integer), name="final"
+        ).data(list(changed.items()))
+        db.execute(
+            update(models.Product.__table__)
+            .where(models.Product.id == final.c.id)
+            .values(stock_quantity=final.c.stock_quantity, updated_at=func.now())
+        )
+        db.execute(insert(models.StockMovement.__table__), new_rows)
+    db.commit()
+    return results
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions endpoint
+Used to load-test the analysis path without paying for upstream calls
+
+Usage:
+    python stub_vision_server.py --port 8001 --delay 2.0
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub uvicorn app:app
+"""
+
+import argparse
+import asyncio
+import json
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Vision API Stub")
+
+# Simulated upstream behaviour (overridden by command line arguments)
+settings = {"delay": 1.0, "jitter": 0.5, "error_rate": 0.0}
+
+SAMPLE_ANALYSIS = {
+    "brand": "WÜRTH",
+    "model": "0948 32 04",
+    "mpn": "0948-32-04",
+    "ean": "4047376706309",
+    "product_name": "Einnietmutter Senkkopf M4",
+    "category": "Befestigungstechnik",
+    "description": "Einnietmutter mit Senkkopf, Stahl verzinkt",
+    "material": "Stahl",
+    "color": "silber",
+    "size": "M4",
+    "din_iso": "",
+    "country_of_origin": "DE",
+    "certifications": [],
+    "specifications": {"Gewinde": "M4"},
+    "quantity": "100",
+    "surface_treatment": "verzinkt",
+    "marketplace_suggestions": {
+        "title": "WÜRTH Einnietmutter Senkkopf M4 Stahl verzinkt 100 Stück",
+        "category_ebay_id": "42630",
+        "category_amazon": "B001",
+        "bullet_points": [],
+        "search_terms": [],
+        "hs_code": "7318159000"
+    }
+}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """Answer like the real endpoint after a configurable delay"""
+    await request.body()
+    await asyncio.sleep(max(0.0, settings["delay"] + random.uniform(-settings["jitter"], settings["jitter"])))
+
+    if random.random() < settings["error_rate"]:
+        return JSONResponse(
+            status_code=503,
+            content={"error": {"message": "Simulated upstream overload"}}
+        )
+
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(SAMPLE_ANALYSIS)},
+                "finish_reason": "stop"
+            }
+        ]
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Vision API stub server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=settings["delay"], help="Mean response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=settings["jitter"], help="Random delay variation in seconds")
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"], help="Fraction of 503 responses")
+    args = parser.parse_args()
+
+    settings.update(delay=args.delay, jitter=args.jitter, error_rate=args.error_rate)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,122 @@
+"""
+Tests for the rate limit bucket stores
+RedisBucketStore runs TOKEN_BUCKET_SCRIPT against fakeredis (needs the fakeredis
+and lupa packages), so no Redis server is required:
+
+    pip install pytest fakeredis lupa
+    python -m pytest test_rate_limiter.py
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import BucketStore, MemoryBucketStore, RedisBucketStore, create_bucket_store
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+
+def take_many(store: BucketStore, count: int, key: str = "client:upload",
+              capacity: float = 3, refill_rate: float = 1.0):
+    async def run():
+        return [await store.take(key, capacity, refill_rate) for _ in range(count)]
+    return asyncio.run(run())
+
+
+def redis_store(server, **kwargs) -> RedisBucketStore:
+    return RedisBucketStore(fakeredis.FakeAsyncRedis(server=server), **kwargs)
+
+
+class CountingStore(MemoryBucketStore):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def take(self, key, capacity, refill_rate):
+        self.calls += 1
+        return await super().take(key, capacity, refill_rate)
+
+
+def test_bucket_store_is_abstract():
+    with pytest.raises(TypeError):
+        BucketStore()
+
+
+def test_memory_store_takes_capacity_then_denies():
+    results = take_many(MemoryBucketStore(), 4)
+    assert [allowed for allowed, _ in results] == [True, True, True, False]
+
+
+def test_redis_script_takes_capacity_then_denies():
+    results = take_many(redis_store(fakeredis.FakeServer()), 4)
+    assert [allowed for allowed, _ in results] == [True, True, True, False]
+    assert results[2][1] == pytest.approx(0, abs=0.01)
+
+
+def test_redis_buckets_are_shared_between_workers():
+    server = fakeredis.FakeServer()
+    assert all(allowed for allowed, _ in take_many(redis_store(server), 3))
+    # A second worker (own client and local state) sees the same, now empty bucket
+    assert take_many(redis_store(server), 1)[0][0] is False
+
+
+def test_redis_script_refills_and_sets_expiry():
+    server = fakeredis.FakeServer()
+    store = redis_store(server)
+    take_many(store, 3, refill_rate=20)
+    time.sleep(0.1)  # 2 tokens at 20/s
+    store.blocked.clear()
+    assert [allowed for allowed, _ in take_many(store, 3, refill_rate=20)] == [True, True, False]
+
+    async def ttl():
+        return await fakeredis.FakeAsyncRedis(server=server).pttl("ratelimit:client:upload")
+    # Expires once the bucket would be full again (3 tokens at 20/s, plus a second of slack)
+    assert 0 < asyncio.run(ttl()) <= 1150 + 100
+
+
+def test_redis_denials_are_answered_locally():
+    store = redis_store(fakeredis.FakeServer())
+    take_many(store, 4)
+    assert "client:upload" in store.blocked
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("Redis called for a bucket known to be empty")
+    store.script = fail
+    assert take_many(store, 2) == [(False, 0.0), (False, 0.0)]
+
+
+def test_unavailable_redis_falls_back_and_retries_later():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    fallback = CountingStore()
+    store = redis_store(server, fallback=fallback, retry_interval=60)
+
+    results = take_many(store, 4)
+    assert [allowed for allowed, _ in results] == [True, True, True, False]
+    assert fallback.calls == 4
+    assert store.available is False
+
+    # Back up, but not retried before retry_interval has passed
+    server.connected = True
+    take_many(store, 1, key="client:other")
+    assert fallback.calls == 5
+    store.retry_at = 0
+    assert take_many(store, 1, key="client:other")[0][0] is True
+    assert fallback.calls == 5
+    assert store.available is True
+
+
+def test_redis_backend_without_package_fails_loudly(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis", None)
+    with pytest.raises(RuntimeError):
+        create_bucket_store("redis")
+
+
+def test_redis_backend_uses_short_timeouts():
+    store = create_bucket_store("redis")
+    connection_kwargs = store.client.connection_pool.connection_kwargs
+    assert connection_kwargs["socket_timeout"] == rate_limiter.RATE_LIMIT_REDIS_TIMEOUT
+    assert connection_kwargs["socket_connect_timeout"] == rate_limiter.RATE_LIMIT_REDIS_TIMEOUT
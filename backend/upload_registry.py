@@ -0,0 +1,72 @@
+"""
+Upload registry for InventoScan
+Database-backed lookup of uploaded images with an optional in-process read-through cache
+"""
+
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+import crud
+import schemas
+
+# Entries per worker kept in memory (0 disables the cache)
+UPLOAD_REGISTRY_CACHE_SIZE = int(os.getenv("UPLOAD_REGISTRY_CACHE_SIZE", "1024"))
+
+
+class UploadRegistry:
+    """
+    Upload records are written once and never modified, so any worker may
+    cache them locally; only misses go to the database
+    """
+
+    def __init__(self, cache_size: int = UPLOAD_REGISTRY_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _remember(self, image_info: Dict[str, Any]):
+        if self.cache_size <= 0:
+            return
+        self._cache[image_info["id"]] = image_info
+        self._cache.move_to_end(image_info["id"])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def register(self, db: Session, upload: schemas.UploadedImageCreate) -> Dict[str, Any]:
+        """Persist an upload and return its image info"""
+        image_info = crud.create_uploaded_image(db, upload).to_dict()
+        self._remember(image_info)
+        return dict(image_info)
+
+    def discard(self, db: Session, image_id: str):
+        """Forget an upload whose file was removed again (failed upload)"""
+        self._cache.pop(image_id, None)
+        db.rollback()  # the failure may have left the session in an aborted transaction
+        crud.delete_uploaded_image(db, UUID(image_id))
+
+    def get(self, db: Session, image_id: str) -> Optional[Dict[str, Any]]:
+        """Get image info by ID, or None if unknown"""
+        image_info = self._cache.get(image_id)
+        if image_info is not None:
+            self._cache.move_to_end(image_id)
+            return dict(image_info)
+
+        try:
+            upload_uuid = UUID(image_id)
+        except ValueError:
+            return None
+
+        db_upload = crud.get_uploaded_image(db, upload_uuid)
+        if db_upload is None:
+            return None
+
+        image_info = db_upload.to_dict()
+        self._remember(image_info)
+        return dict(image_info)
+
+
+# Global upload registry instance
+upload_registry = UploadRegistry()
@@ -0,0 +1,59 @@
+"""
+Streaming upload storage for InventoScan
+Writes uploads to disk chunk by chunk, enforcing the size limit and hashing as it goes
+"""
+
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import BinaryIO, Tuple
+
+from fastapi import UploadFile
+
+# Bytes read from the request body per step (peak memory per upload)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the maximum size"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"File too large. Maximum size: {max_size / 1024 / 1024}MB")
+        self.max_size = max_size
+
+
+def _write_chunk(buffer: BinaryIO, digest, chunk: bytes):
+    # hashlib and file writes release the GIL, so both run off the event loop
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+async def save_upload(upload: UploadFile, file_path: Path, max_size: int) -> Tuple[int, str]:
+    """
+    Stream an UploadFile to file_path
+    Returns (size, sha256 hex digest); the partial file is removed on any error
+    """
+    # Reject early when the multipart parser already knows the size
+    if upload.size is not None and upload.size > max_size:
+        raise UploadTooLarge(max_size)
+
+    digest = hashlib.sha256()
+    size = 0
+    buffer = await asyncio.to_thread(open, file_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge(max_size)
+            await asyncio.to_thread(_write_chunk, buffer, digest, chunk)
+        await asyncio.to_thread(buffer.close)
+    except BaseException:
+        await asyncio.to_thread(buffer.close)
+        file_path.unlink(missing_ok=True)
+        raise
+
+    return size, digest.hexdigest()
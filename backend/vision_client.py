@@ -0,0 +1,242 @@
+"""
+Vision API client for InventoScan
+Shared async HTTP client with keep-alive pooling, timeouts and bounded concurrency
+"""
+
+import asyncio
+import json
+import os
+import re
+from typing import Any, Dict, Optional
+
+import httpx
+
+# Upstream configuration (point OPENAI_BASE_URL at stub_vision_server.py for load tests)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+VISION_MODEL = os.getenv("VISION_MODEL", "gpt-4o-mini")
+VISION_MAX_TOKENS = int(os.getenv("VISION_MAX_TOKENS", "500"))
+
+# Connection pool and timeout settings
+VISION_MAX_CONCURRENCY = int(os.getenv("VISION_MAX_CONCURRENCY", "8"))
+VISION_MAX_CONNECTIONS = int(os.getenv("VISION_MAX_CONNECTIONS", "20"))
+VISION_CONNECT_TIMEOUT = float(os.getenv("VISION_CONNECT_TIMEOUT", "5"))
+VISION_READ_TIMEOUT = float(os.getenv("VISION_READ_TIMEOUT", "30"))
+VISION_QUEUE_TIMEOUT = float(os.getenv("VISION_QUEUE_TIMEOUT", "60"))
+
+ANALYSIS_PROMPT = """Analyze this product image for marketplace selling. Extract ALL visible information.
+
+IDENTIFY (look for text, labels, markings):
+- brand: Manufacturer/brand name
+- model: Model number or product code
+- mpn: Manufacturer part number (e.g., Art. Nr., Item #)
+- ean: EAN/UPC barcode number if visible
+- material: Material composition (steel, plastic, aluminum, etc.)
+- color: Product color
+- size: Dimensions or size designation
+- din_iso: DIN/ISO/EN standards (e.g., DIN 912, ISO 9001)
+- country: Country of origin if marked
+- certifications: CE, RoHS, TÜV, other certifications
+
+ANALYZE TECHNICAL DETAILS:
+- specifications: All technical specs (thread size, voltage, capacity, etc.)
+- quantity_per_package: Number of items if bulk package
+- surface_treatment: Coating/finish (galvanized, anodized, painted)
+
+SUGGEST FOR MARKETPLACE (be specific):
+- title: Product title max 80 chars, format: "BRAND Product Type Specification Size Quantity"
+- category_ebay_id: eBay category ID (e.g., 42630 for fasteners)
+- category_amazon: Amazon browse node
+- bullet_points: Exactly 5 bullet points, each max 500 chars:
+  1. Main feature/use case
+  2. Technical specification
+  3. Material and quality
+  4. Compatibility/application
+  5. Package contents/quantity
+- search_terms: 10 relevant search keywords
+- hs_code: Suggested customs HS code
+
+Return ONLY valid JSON with this structure:
+{
+    "brand": "",
+    "model": "",
+    "mpn": "",
+    "ean": "",
+    "product_name": "",
+    "category": "",
+    "description": "",
+    "material": "",
+    "color": "",
+    "size": "",
+    "din_iso": "",
+    "country_of_origin": "",
+    "certifications": [],
+    "specifications": {},
+    "quantity": "",
+    "surface_treatment": "",
+    "marketplace_suggestions": {
+        "title": "",
+        "category_ebay_id": "",
+        "category_amazon": "",
+        "bullet_points": [],
+        "search_terms": [],
+        "hs_code": ""
+    }
+}"""
+
+
+class VisionAPIError(Exception):
+    """Raised when the vision upstream fails or cannot be reached"""
+
+    def __init__(self, message: str, status_code: int = 502, retryable: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+class VisionClient:
+    """
+    Async client for the chat completions endpoint
+    One pooled httpx.AsyncClient is shared by all requests of a worker process
+    """
+
+    def __init__(self, api_key: Optional[str], base_url: str = OPENAI_BASE_URL):
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(VISION_MAX_CONCURRENCY)
+
+    @property
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Create the pooled HTTP client on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(
+                    VISION_READ_TIMEOUT,
+                    connect=VISION_CONNECT_TIMEOUT,
+                    pool=VISION_QUEUE_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=VISION_MAX_CONNECTIONS,
+                    max_keepalive_connections=VISION_MAX_CONNECTIONS
+                ),
+                # Avoid picking up HTTP(S)_PROXY from the environment (see test_openai.py)
+                trust_env=False,
+            )
+        return self._client
+
+    async def close(self):
+        """Close pooled connections (call on application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def chat_completion(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST a chat completion request
+        Waits for a free concurrency slot first so a burst of analyses
+        cannot open more upstream requests than VISION_MAX_CONCURRENCY
+        """
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=VISION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise VisionAPIError("Vision API busy, please retry", status_code=503, retryable=True)
+
+        try:
+            response = await self._get_client().post("/chat/completions", json=payload)
+        except httpx.TimeoutException:
+            raise VisionAPIError("Vision API request timed out", status_code=504, retryable=True)
+        except httpx.HTTPError as e:
+            raise VisionAPIError(f"Vision API unreachable: {e}", status_code=502, retryable=True)
+        finally:
+            self._semaphore.release()
+
+        if response.status_code != 200:
+            try:
+                error_detail = response.json().get('error', {}).get('message', 'Unknown error')
+            except ValueError:
+                error_detail = response.text[:200] or 'Unknown error'
+            raise VisionAPIError(
+                f"OpenAI API error: {error_detail}",
+                status_code=500,
+                retryable=response.status_code == 429 or response.status_code >= 500
+            )
+
+        return response.json()
+
+    async def analyze_image(self, base64_image: str, mime_type: str = "image/jpeg") -> Dict[str, Any]:
+        """Run the product analysis prompt against a base64 encoded image"""
+        payload = {
+            "model": VISION_MODEL,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": ANALYSIS_PROMPT},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": VISION_MAX_TOKENS
+        }
+
+        result = await self.chat_completion(payload)
+        try:
+            result_text = result['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            raise VisionAPIError("Malformed response from Vision API")
+        return parse_analysis_text(result_text or "")
+
+
+class UnparsedAnalysis(dict):
+    """Placeholder analysis for model output that contained no JSON (not worth caching)"""
+
+
+def parse_analysis_text(result_text: str) -> Dict[str, Any]:
+    """Parse the model output into a dict, tolerating markdown fences and extra text"""
+    result_text = result_text.strip()
+
+    # Clean the response text (remove markdown code blocks if present)
+    if result_text.startswith('```json'):
+        result_text = result_text[7:]  # Remove ```json
+    if result_text.startswith('```'):
+        result_text = result_text[3:]  # Remove ```
+    if result_text.endswith('```'):
+        result_text = result_text[:-3]  # Remove trailing ```
+    result_text = result_text.strip()
+
+    # Try to parse as JSON
+    try:
+        return json.loads(result_text)
+    except json.JSONDecodeError:
+        pass
+
+    # If parsing still fails, try to extract JSON from the text
+    json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
+    if json_match:
+        try:
+            return json.loads(json_match.group())
+        except json.JSONDecodeError:
+            pass
+
+    # Last resort: create a structured response
+    return UnparsedAnalysis({
+        "product_name": "Unknown",
+        "brand": "Unknown",
+        "category": "Unknown",
+        "description": result_text,
+        "barcode": None,
+        "quantity": None,
+        "additional_info": None
+    })
+
+
+# Global vision client instance
+vision_client = VisionClient(os.getenv("OPENAI_API_KEY"))
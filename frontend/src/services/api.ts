@@ -194,6 +194,7 @@ export const getProducts = async (params?: {
   category?: string;
   location?: string;
   low_stock?: boolean;
+  cursor?: string;
   skip?: number;
   limit?: number;
 }) => {